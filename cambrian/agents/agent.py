@@ -1,6 +1,6 @@
 """Defines agent classes."""
 
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Self, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Self, Tuple
 
 import mujoco as mj
 import numpy as np
@@ -11,6 +11,7 @@ from cambrian.utils import (
     MjCambrianActuator,
     MjCambrianGeometry,
     MjCambrianJoint,
+    check_contacts,
     get_body_id,
     get_geom_id,
 )
@@ -77,6 +78,14 @@ class MjCambrianAgentConfig(MjCambrianBaseConfig):
         eyes (Dict[str, MjCambrianEyeConfig]): The eyes on the agent. The keys are the
             names of the eyes and the values are the configs for the eyes. The eyes will
             be placed on the agent at the specified coordinates.
+        render_frequency (int): The eyes are only rendered every `render_frequency`
+            steps. In between, the previous observations of the eyes are returned.
+            Defaults to 1, i.e. the eyes are rendered every step.
+        render_pose_threshold (Optional[float]): If set, the eyes are also rendered
+            before `render_frequency` steps have passed if the pose of the agent
+            changed by more than this threshold since the last render. The change is
+            the translation plus the rotation angle times the `rbound` of the agent's
+            geometry, i.e. roughly how far the eyes moved. Defaults to None.
     """
 
     instance: Callable[[Self, str, int], "MjCambrianAgent"]
@@ -100,6 +109,8 @@ class MjCambrianAgentConfig(MjCambrianBaseConfig):
     use_contact_obs: bool
 
     eyes: Dict[str, MjCambrianEyeConfig]
+    render_frequency: int = 1
+    render_pose_threshold: Optional[float] = None
 
 
 class MjCambrianAgent:
@@ -140,8 +151,16 @@ class MjCambrianAgent:
         self._geom: MjCambrianGeometry = None
         self._actadrs: List[int] = []
         self._body_id: int = None
+        self._geom_rootid: np.ndarray = None
         self._initialize()
 
+        # Used to decide whether to render the eyes or return the held observations
+        self._eye_obs: Dict[str, Any] = {}
+        self._steps_since_render: int = 0
+        self._rendered: bool = False
+        self._render_pos: np.ndarray = None
+        self._render_quat: np.ndarray = None
+
     def _check_config(self, config: MjCambrianAgentConfig) -> MjCambrianAgentConfig:
         """Run some checks/asserts on the config to make sure everything's there."""
 
@@ -338,6 +357,7 @@ class MjCambrianAgent:
                 obs.update(eye_obs)
             else:
                 obs[name] = eye_obs
+        self._set_rendered(obs)
 
         return self._update_obs(obs)
 
@@ -349,6 +369,9 @@ class MjCambrianAgent:
         self._body_id = get_body_id(model, body_name)
         assert self._body_id != -1, f"Could not find body with name {body_name}."
 
+        # Lookup table from geom id to the root body id, used for contact checking
+        self._geom_rootid = model.body_rootid[model.geom_bodyid]
+
         # Geometry id
         geom_id = get_geom_id(model, self._config.geom_name)
         assert geom_id != -1, f"Could not find geom {self._config.geom_name}."
@@ -371,7 +394,13 @@ class MjCambrianAgent:
         f"{len(self._actadrs)} != {self._numctrl}."
 
     def step(self) -> Dict[str, Any]:
-        """Steps the eyes and returns the observation."""
+        """Steps the eyes and returns the observation. The eyes are only rendered if
+        `should_render` is True, otherwise the previous eye observations are held."""
+
+        self._steps_since_render += 1
+        self._rendered = self.should_render
+        if not self._rendered:
+            return self._update_obs(dict(self._eye_obs))
 
         obs: Dict[str, Any] = {}
         for name, eye in self.eyes.items():
@@ -380,9 +409,40 @@ class MjCambrianAgent:
                 obs.update(eye_obs)
             else:
                 obs[name] = eye_obs
+        self._set_rendered(obs)
 
         return self._update_obs(obs)
 
+    def _set_rendered(self, eye_obs: Dict[str, Any]):
+        """Stores the eye observations and the pose at which the eyes were rendered."""
+        self._eye_obs = eye_obs
+        self._steps_since_render = 0
+        self._rendered = True
+        self._render_pos = self.pos
+        self._render_quat = self.quat
+
+    @property
+    def should_render(self) -> bool:
+        """Whether the eyes should be rendered, i.e. `render_frequency` steps have
+        passed since the last render or the pose changed by more than
+        `render_pose_threshold`."""
+        if self._steps_since_render >= self._config.render_frequency:
+            return True
+
+        if (threshold := self._config.render_pose_threshold) is None:
+            return False
+
+        # The rotation angle between the two quaternions
+        dot = np.clip(np.abs(np.dot(self.quat, self._render_quat)), 0.0, 1.0)
+        angle = 2 * np.arccos(dot)
+        dist = np.linalg.norm(self.pos - self._render_pos)
+        return dist + angle * self._geom.rbound > threshold
+
+    @property
+    def rendered(self) -> bool:
+        """Whether the eyes were rendered at the last step."""
+        return self._rendered
+
     def _update_obs(self, obs: Dict[str, Any]) -> Dict[str, Any]:
         """Add additional attributes to the observation."""
         if self._config.use_action_obs:
@@ -402,31 +462,11 @@ class MjCambrianAgent:
 
     @property
     def has_contacts(self) -> bool:
-        """Returns whether or not the agent has contacts.
-
-        Walks through all the contacts in the environment and checks if any of them
-        involve this agent.
-        """
-        if not self._config.check_contacts:
+        """Returns whether or not the agent has contacts. See `check_contacts`."""
+        if not self._config.check_contacts or self._data.ncon == 0:
             return False
 
-        for contact in self._data.contact:
-            geom1 = int(contact.geom[0])
-            body1 = self._model.geom_bodyid[geom1]
-            rootbody1 = self._model.body_rootid[body1]
-
-            geom2 = int(contact.geom[1])
-            body2 = self._model.geom_bodyid[geom2]
-            rootbody2 = self._model.body_rootid[body2]
-
-            is_this_agent = rootbody1 == self._body_id or rootbody2 == self._body_id
-            if not is_this_agent or contact.exclude:
-                # Not a contact with this agent
-                continue
-
-            return True
-
-        return False
+        return bool(check_contacts(self._data, self._geom_rootid, [self._body_id])[0])
 
     @property
     def observation_space(self) -> spaces.Space:
@@ -616,6 +656,11 @@ class MjCambrianAgent:
         """Returns the geom of the agent."""
         return self._geom
 
+    @property
+    def body_id(self) -> int:
+        """Returns the id of the root body of the agent."""
+        return self._body_id
+
     @property
     def trainable(self) -> bool:
         """Returns whether the agent is trainable or not."""
@@ -1,4 +1,7 @@
+import hashlib
 import pickle
+import time
+from dataclasses import dataclass
 from pathlib import Path
 from typing import (
     Any,
@@ -33,6 +36,7 @@ from cambrian.renderer.overlays import (
     MjCambrianTextViewerOverlay,
     MjCambrianViewerOverlay,
 )
+from cambrian.utils import check_contacts, get_cache_path, save_atomically
 from cambrian.utils.cambrian_xml import MjCambrianXML, MjCambrianXMLConfig
 from cambrian.utils.config import MjCambrianBaseConfig, config_wrapper
 from cambrian.utils.logger import get_logger
@@ -97,6 +101,20 @@ class MjCambrianEnvConfig(MjCambrianBaseConfig):
             use for the mujoco viewer. If unset, no renderer will be used. Should
             set to None if `render` will never be called. This may be useful to
             reduce the amount of vram consumed by non-rendering environments.
+        share_model (bool): Whether to share the compiled model between all the
+            environments in a process which have the same xml. Only the data is then
+            held per environment, which reduces memory when many environments live in
+            one process (e.g. `MjCambrianThreadedVecEnv`). A shared model must be
+            read-only after it's loaded, since changes would apply to all the
+            environments; this is asserted when the environment is closed. The model
+            is released once all the environments which use it are closed.
+            Environments which change the model on reset (e.g. the maze wall
+            textures, if there are multiple textures to choose from) can't share it.
+        model_cache_dir (Optional[Path]): Directory in which the compiled models are
+            cached as mujoco binaries (.mjb). The cache is keyed by a hash of the xml,
+            the files it references and the mujoco version, so environments (or
+            processes) with the same xml load the compiled model from disk instead of
+            compiling it. If None, the models aren't cached.
 
         save_filename (Optional[str]): The filename to save recordings to. This is more
             of a placeholder for external scripts to use, if desired.
@@ -123,12 +141,36 @@ class MjCambrianEnvConfig(MjCambrianBaseConfig):
     clear_overlays_on_reset: bool
     debug_overlays_size: float
     renderer: Optional[MjCambrianRendererConfig] = None
+    share_model: bool = False
+    model_cache_dir: Optional[Path] = None
 
     save_filename: Optional[str] = None
 
     agents: Dict[str, MjCambrianAgentConfig | Any]
 
 
+@dataclass
+class MjCambrianSharedModel:
+    """A compiled model which is shared between environments which set share_model.
+
+    Attributes:
+        model (mj.MjModel): The compiled model.
+        checksum (str): The checksum of the model when it was compiled. Used to assert
+            that the model isn't changed.
+        num_users (int): The number of environments which use the model. The model is
+            released when the last one is closed.
+    """
+
+    model: mj.MjModel
+    checksum: str
+    num_users: int = 0
+
+
+# Compiled models shared between environments which set share_model. Maps the xml
+# string to the shared model.
+SHARED_MODELS: Dict[str, MjCambrianSharedModel] = {}
+
+
 class MjCambrianEnv(ParallelEnv, Env):
     """A MjCambrianEnv defines a gymnasium environment that's based off mujoco.
 
@@ -155,16 +197,22 @@ class MjCambrianEnv(ParallelEnv, Env):
 
         self._xml = self.generate_xml()
 
-        try:
-            self._model = mj.MjModel.from_xml_string(self._xml.to_string())
-        except Exception:
-            get_logger().error(
-                f"Error creating model from xml\n{self._xml.to_string()}"
-            )
-            raise
+        self._shared_model: Optional[MjCambrianSharedModel] = None
+        self._model = self._create_model()
 
         self._data = mj.MjData(self._model)
 
+        # Lookup tables used to classify the contacts for all agents at once. The
+        # agent body ids are filled in on reset, since they're resolved by the agents.
+        self._geom_rootid = self._model.body_rootid[self._model.geom_bodyid]
+        self._contact_agents: List[str] = []
+        self._contact_body_ids: np.ndarray = np.empty(0, dtype=int)
+
+        # Called with the agent stepping (i.e. the rendering) on each step. Vectorized
+        # envs which step the physics in worker threads set this to run the rendering
+        # on the thread which owns the GL contexts. See `MjCambrianThreadedVecEnv`.
+        self._render_dispatcher: Optional[Callable[[Callable[[], Any]], Any]] = None
+
         self.render_mode = "rgb_array"
         self._renderer: MjCambrianRenderer = None
         if renderer_config := self._config.renderer:
@@ -199,6 +247,65 @@ class MjCambrianEnv(ParallelEnv, Env):
             assert name not in self._agents, f"Agent {name} already exists."
             self._agents[name] = agent_config.instance(agent_config, name)
 
+    def _create_model(self) -> mj.MjModel:
+        """Helper method to compile the model from the xml. If `share_model` is set,
+        a model previously compiled in this process from the same xml is reused. If
+        `model_cache_dir` is set, the compiled model is loaded from (or saved to) the
+        on-disk cache."""
+        xml_string = self._xml.to_string()
+        if self._config.share_model and xml_string in SHARED_MODELS:
+            self._shared_model = SHARED_MODELS[xml_string]
+            self._shared_model.num_users += 1
+            return self._shared_model.model
+
+        cache_path = self._get_model_cache_path(xml_string)
+        if cache_path is not None and cache_path.exists():
+            get_logger().debug(f"Loading cached model from {cache_path}.")
+            model = mj.MjModel.from_binary_path(str(cache_path))
+        else:
+            try:
+                model = mj.MjModel.from_xml_string(xml_string)
+            except Exception:
+                get_logger().error(f"Error creating model from xml\n{xml_string}")
+                raise
+
+            if cache_path is not None:
+                save_atomically(cache_path, lambda f: mj.mj_saveModel(model, f, None))
+                get_logger().debug(f"Saved model to {cache_path}.")
+
+        if self._config.share_model:
+            checksum = self._compute_model_checksum(model)
+            self._shared_model = MjCambrianSharedModel(model, checksum, num_users=1)
+            SHARED_MODELS[xml_string] = self._shared_model
+        return model
+
+    @staticmethod
+    def _compute_model_checksum(model: mj.MjModel) -> str:
+        """Returns a hash of all the array fields of the model. Used to assert that a
+        shared model isn't changed. This hashes the whole model (e.g. the textures),
+        so it's only computed when the model is compiled and when it's released."""
+        sha = hashlib.sha256()
+        for name in dir(model):
+            value = getattr(model, name)
+            if not name.startswith("_") and isinstance(value, np.ndarray):
+                sha.update(value.tobytes())
+        return sha.hexdigest()
+
+    def _get_model_cache_path(self, xml_string: str) -> Optional[Path]:
+        """Returns the path of the model cache file for the xml. The key is a hash of
+        the xml, the contents of the files it references and the mujoco version.
+        Returns None if caching is disabled."""
+        if self._config.model_cache_dir is None:
+            return None
+
+        sha = hashlib.sha256(mj.__version__.encode())
+        sha.update(xml_string.encode())
+        for path in self._xml.get_referenced_files():
+            sha.update(str(path).encode())
+            sha.update(path.read_bytes())
+        filename = f"model_{sha.hexdigest()}.mjb"
+        return get_cache_path(self._config.model_cache_dir, filename)
+
     def generate_xml(self) -> MjCambrianXML:
         """Generates the xml for the environment."""
         xml = MjCambrianXML.from_string(self._config.xml)
@@ -236,6 +343,12 @@ class MjCambrianEnv(ParallelEnv, Env):
         obs: Dict[str, Dict[str, Any]] = {}
         for name, agent in self._agents.items():
             obs[name] = agent.reset(self._model, self._data)
+        self._contact_agents = [
+            name for name, agent in self._agents.items() if agent.config.check_contacts
+        ]
+        self._contact_body_ids = np.array(
+            [self._agents[name].body_id for name in self._contact_agents], dtype=int
+        )
 
         # We'll step the simulation once to allow for states to propagate
         self._step_mujoco_simulation(1, info)
@@ -310,12 +423,15 @@ class MjCambrianEnv(ParallelEnv, Env):
             info[name]["action"] = action[name]
 
         # Then, step the mujoco simulation
+        start_time = time.perf_counter()
         self._step_mujoco_simulation(self._config.frame_skip, info)
+        physics_time = time.perf_counter() - start_time
 
-        # We'll then step each agent to render it's current state and get the obs
-        obs: Dict[str, Any] = {}
-        for name, agent in self._agents.items():
-            obs[name] = agent.step()
+        # We'll then step each agent to render it's current state and get the obs.
+        if self._render_dispatcher is not None:
+            obs = self._render_dispatcher(lambda: self._step_agents(info, physics_time))
+        else:
+            obs = self._step_agents(info, physics_time)
 
         # Call helper methods to update the observations, rewards, terminated, and info
         obs, info = self._config.step_fn(self, obs, info)
@@ -339,6 +455,21 @@ class MjCambrianEnv(ParallelEnv, Env):
 
         return obs, reward, terminated, truncated, info
 
+    def _step_agents(
+        self, info: Dict[str, Dict[str, Any]], physics_time: float
+    ) -> Dict[str, Any]:
+        """Steps each agent, which renders the eyes, and returns the observations.
+        Agents may hold their previous eye observations instead of rendering, so the
+        render and physics times are reported separately."""
+        obs: Dict[str, Any] = {}
+        for name, agent in self._agents.items():
+            start_time = time.perf_counter()
+            obs[name] = agent.step()
+            info[name]["render_time"] = time.perf_counter() - start_time
+            info[name]["rendered"] = agent.rendered
+            info[name]["physics_time"] = physics_time
+        return obs
+
     def _step_mujoco_simulation(self, n_frames: int, info: Dict[str, Dict[str, Any]]):
         """Sets the mujoco simulation. Will step the simulation `n_frames` times, each
         time checking if the agent has contacts."""
@@ -357,17 +488,23 @@ class MjCambrianEnv(ParallelEnv, Env):
             # that, if during the course of the frame skip, the agent hits an object
             # and then moves away, the contact would not be detected.
             if self._data.ncon > 0:
-                for name, agent in self._agents.items():
-                    if not info[name]["has_contacts"]:
-                        # Only check for has contacts if it hasn't been set to True
-                        # This reduces redundant checks
-                        info[name]["has_contacts"] = agent.has_contacts
+                self._update_contacts(info)
 
         # As of MuJoCo 2.0, force-related quantities like cacc are not computed
         # unless there's a force sensor in the model.
         # See https://github.com/openai/gym/issues/1541
         mj.mj_rnePostConstraint(self._model, self._data)
 
+    def _update_contacts(self, info: Dict[str, Any]):
+        """Classifies the current contacts for all agents which check contacts at
+        once (see `check_contacts`). Agents with a contact have their `has_contacts`
+        flag set; the flags are never reset to False here so that contacts are
+        accumulated over the frame skip."""
+        hits = check_contacts(self._data, self._geom_rootid, self._contact_body_ids)
+        for name, hit in zip(self._contact_agents, hits):
+            if hit:
+                info[name]["has_contacts"] = True
+
     def _compute_terminated(self, info: Dict[str, Any]) -> Dict[str, bool]:
         """Compute whether the env has terminated. Termination indicates success,
         whereas truncated indicates failure.
@@ -685,6 +822,18 @@ class MjCambrianEnv(ParallelEnv, Env):
         get_logger().info(f"Setting random seed to {seed}")
         set_random_seed(seed)
 
+    @property
+    def render_dispatcher(self) -> Optional[Callable[[Callable[[], Any]], Any]]:
+        """Returns the function used to run the agent stepping (i.e. the rendering)
+        on each step, if any."""
+        return self._render_dispatcher
+
+    @render_dispatcher.setter
+    def render_dispatcher(self, value: Optional[Callable[[Callable[[], Any]], Any]]):
+        """Sets the function used to run the agent stepping on each step. It's called
+        with a function which takes no arguments and must return its result."""
+        self._render_dispatcher = value
+
     @property
     def record(self):
         """Returns whether the environment is recording."""
@@ -710,8 +859,23 @@ class MjCambrianEnv(ParallelEnv, Env):
             get_logger().debug(f"Saved rollout to {path.with_suffix('.pkl')}")
 
     def close(self):
-        """Closes the environment."""
-        pass
+        """Closes the environment. A shared model is released once the last
+        environment which uses it is closed, such that long running processes (e.g.
+        sweeps) don't hold on to every model."""
+        if (shared_model := self._shared_model) is None:
+            return
+        self._shared_model = None
+
+        shared_model.num_users -= 1
+        if shared_model.num_users == 0:
+            xml_string = self._xml.to_string()
+            if SHARED_MODELS.get(xml_string) is shared_model:
+                del SHARED_MODELS[xml_string]
+
+        assert shared_model.checksum == self._compute_model_checksum(self._model), (
+            f"The shared model of env '{self._name}' was changed. Models which are "
+            "changed can't be shared; set `share_model` to False."
+        )
 
 
 if __name__ == "__main__":
@@ -298,11 +298,14 @@ class MjCambrianMaze:
                     gridlayout=".U..LFRB.D..",
                 )
 
-        # Add the walls. Each wall has it's own geom.
+        # Add the walls. Each wall has it's own geom. The walls start with the first
+        # of their textures, which is only changed on reset if there are multiple
+        # textures to choose from.
         scale = self._config.scale / 2
         height = self._config.height
-        for i, (x, y) in enumerate(self._wall_locations):
+        for i, ((x, y), t) in enumerate(zip(self._wall_locations, self._wall_textures)):
             name = f"wall_{self._name}_{i}"
+            texture = self._config.wall_texture_map[t][0]
             # Set the contype != conaffinity so walls don't collide with each other
             xml.add(
                 worldbody,
@@ -310,6 +313,7 @@ class MjCambrianMaze:
                 name=name,
                 pos=f"{x} {y} {scale * height}",
                 size=f"{scale} {scale} {scale * height}",
+                material=f"wall_{self._name}_{t}_{texture}_mat",
                 contype="1",
                 conaffinity="2",
                 **{"class": f"maze_wall_{self._name}"},
@@ -4,6 +4,7 @@ from cambrian.eyes.eye import MjCambrianEye, MjCambrianEyeConfig
 from cambrian.eyes.multi_eye import MjCambrianMultiEye, MjCambrianMultiEyeConfig
 from cambrian.eyes.approx_multi_eye import MjCambrianApproxMultiEye, MjCambrianApproxMultiEyeConfig
 from cambrian.eyes.optics import MjCambrianOpticsEye, MjCambrianOpticsEyeConfig
+from cambrian.eyes.raycast import MjCambrianRaycastEye
 
 __all__ = [
     "MjCambrianEyeConfig",
@@ -14,4 +15,5 @@ __all__ = [
     "MjCambrianApproxMultiEye",
     "MjCambrianOpticsEyeConfig",
     "MjCambrianOpticsEye",
+    "MjCambrianRaycastEye",
 ]
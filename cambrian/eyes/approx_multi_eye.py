@@ -12,7 +12,10 @@ from cambrian.utils import MjCambrianGeometry, get_camera_id
 from cambrian.utils.cambrian_xml import MjCambrianXML
 from cambrian.utils.config import config_wrapper
 from cambrian.renderer import MjCambrianRenderer
-from cambrian.renderer.render_utils import project_images_to_spherical_panorama
+from cambrian.renderer.render_utils import (
+    compute_spherical_panorama_lut,
+    project_images_to_spherical_panorama,
+)
 
 
 @config_wrapper
@@ -21,10 +24,19 @@ class MjCambrianApproxMultiEyeConfig(MjCambrianMultiEyeConfig):
 
     Inherits from MjCambrianApproxEyeConfig and adds additional attributes for
     an approximate multi-eye setup.
+
+    Attributes:
+        use_spherical_panorama (bool): Whether to project the camera images onto a
+            spherical (equirectangular) panorama before cropping the eyes. If False,
+            the images are simply concatenated, which distorts the eyes away from
+            the center of each camera. The projection uses a lookup table which is
+            precomputed at construction. Defaults to False.
     """
 
     instance: Callable[[Self, str], "MjCambrianApproxMultiEye"]
 
+    use_spherical_panorama: bool = False
+
 
 class MjCambrianApproxEye(MjCambrianEye):
     """Defines a single eye which is an approximation of an actual eye. Basically,
@@ -98,8 +110,9 @@ class MjCambrianApproxEye(MjCambrianEye):
         self._model = model
         self._data = data
 
-        self._prev_obs = np.zeros((*self._config.resolution, 3), dtype=np.float32)
-        return self.step(np.zeros((*self._total_resolution, 3)))
+        self._prev_obs = self._create_obs_buffer()
+        full_image = np.zeros((*self._total_resolution, 3), self._prev_obs.dtype)
+        return self.step(full_image)
 
     def step(self, full_image: np.ndarray) -> np.ndarray:
         """Renders the image and returns the observation for the eye."""
@@ -109,6 +122,26 @@ class MjCambrianApproxEye(MjCambrianEye):
         resized_eye_image = self._resize_image(eye_image, *self._config.resolution)
         return super().step(resized_eye_image)
 
+    def compute_gather_indices(self) -> np.ndarray:
+        """Computes the indices into the full image (flattened over its width and
+        height) which crop and resize it to the eye's resolution. Gathering with these
+        indices is equivalent to the nearest neighbor crop/resize in `step`.
+
+        Returns:
+            np.ndarray: The flat indices of shape (W, H), where W, H is the resolution
+                of the eye.
+        """
+        x_start, x_end, y_start, y_end = self._crop_rect
+        width, height = self._config.resolution
+        crop_width, crop_height = x_end - x_start, y_end - y_start
+
+        # Nearest neighbor sampling like cv2.INTER_NEAREST, i.e. floor(dst * scale)
+        x = np.floor(np.arange(width) * crop_width / width).astype(int)
+        y = np.floor(np.arange(height) * crop_height / height).astype(int)
+        x = x_start + np.minimum(x, crop_width - 1)
+        y = y_start + np.minimum(y, crop_height - 1)
+        return x[:, None] * self._total_resolution[1] + y[None, :]
+
     def _resize_image(self, image: np.ndarray, width: int, height: int) -> np.ndarray:
         """Resizes the image to the given size using bilinear interpolation."""
         if image.shape[0] == width and image.shape[1] == height:
@@ -132,6 +165,7 @@ class MjCambrianApproxMultiEye(MjCambrianMultiEye):
             self._config.resolution[1] * self._config.num_eyes[0],
         )
         self._renderers: Dict[str, MjCambrianRenderer] = {}
+        self._full_image: np.ndarray = None
         for i in range(4):
             renderer_name = f"{name}_renderer_{i}"
             self._renderers[renderer_name] = MjCambrianRenderer(config.renderer)
@@ -156,6 +190,27 @@ class MjCambrianApproxMultiEye(MjCambrianMultiEye):
                 (self._min_lon, self._max_lon),
             )
 
+        # The crop rects and resolutions are fixed, so the observations of all the
+        # eyes are gathered from the full image at once with precomputed indices
+        indices = [eye.compute_gather_indices() for eye in self._eyes.values()]
+        shape = (len(indices), *self._config.resolution)
+        self._gather_indices = np.reshape(indices, shape).astype(np.intp)
+
+        # The cameras and resolutions are fixed, so precompute the panorama lookup
+        # table. Camera i faces a yaw of lon - 90 and covers a quarter of the images.
+        self._yaws = [lon - 90 for lon in self._lons]
+        self._panorama_lut: Tuple[np.ndarray, np.ndarray] = None
+        if self._config.use_spherical_panorama:
+            self._panorama_lut = compute_spherical_panorama_lut(
+                self._resolution,
+                self._yaws,
+                90.0,
+                self._config.fov[1],
+                self._total_resolution,
+                lon_range=(self._min_lon, self._max_lon),
+                lat_range=(self._min_lat, self._max_lat),
+            )
+
     def generate_xml(
         self, parent_xml: MjCambrianXML, geom: MjCambrianGeometry, parent_body_name: str
     ) -> MjCambrianXML:
@@ -232,26 +287,44 @@ class MjCambrianApproxMultiEye(MjCambrianMultiEye):
         for eye in self._eyes.values():
             eye.reset(model, data)
 
+        # The renderers read their views directly into adjacent slices of the full
+        # image, so it's allocated once. The observations are gathered from it, so it
+        # has the dtype of the observation space of the eyes.
+        if self._full_image is None:
+            dtype = next(iter(self._eyes.values())).observation_space.dtype
+            self._full_image = np.empty((*self._total_resolution, 3), dtype=dtype)
+
         return self.step()
 
     def step(self) -> Dict[str, np.ndarray]:
         """Renders the images from all cameras, stitches them, and returns observations for each eye."""
-        images = []
-        for renderer in self._renderers.values():
-            image = renderer.render()
-            if self._renders_depth:
-                image = image[0]  # Assuming RGB image is the first element
-            images.append(image)
+        # Render each camera into its slice of the full image, i.e. the images are
+        # concatenated along the width without any copies
+        width = self._resolution[0]
+        for i, renderer in enumerate(self._renderers.values()):
+            renderer.render(out=self._full_image[i * width : (i + 1) * width])
+        full_image = self._full_image
+
         # Now stitch the images together
-        # full_image = project_images_to_spherical_panorama(
-        #     images=images,
-        #     yaw_angles=[135, 45, -45, -135],
-        #     fov_x=90,
-        #     fov_y=self._config.fov[1],
-        #     total_resolution=self._total_resolution,
-        # )
-        full_image = np.concatenate(images, axis=0)  # Concatenate along width
-        obs = {}
-        for name, eye in self._eyes.items():
-            obs[name] = eye.step(full_image)
-        return obs
+        if self._panorama_lut is not None:
+            images = full_image.reshape(len(self._renderers), *self._resolution, 3)
+            full_image = project_images_to_spherical_panorama(
+                images=images,
+                yaw_angles=self._yaws,
+                fov_x=90,
+                fov_y=self._config.fov[1],
+                total_resolution=self._total_resolution,
+                lut=self._panorama_lut,
+            )
+
+        # Crop and resize all the eyes with a single gather into an (N, W, H, 3) array
+        pixels = full_image.reshape(-1, full_image.shape[-1])
+        batched_obs = np.take(pixels, self._gather_indices, axis=0)
+        for eye, eye_obs in zip(self._eyes.values(), batched_obs):
+            eye._prev_obs = eye_obs
+        if self._config.use_stacked_obs:
+            # The gather already produces the stacked observations. np.take allocates
+            # a new array on each step, so the returned obs isn't reused.
+            self._obs_arena = batched_obs
+            return {self._name: batched_obs}
+        return dict(zip(self._eyes.keys(), batched_obs))
@@ -39,6 +39,11 @@ class MjCambrianEyeConfig(MjCambrianBaseConfig):
             agent. The eye has no knowledge of the geometry it's trying to be placed
             on. Fmt: lat lon
         orthographic (bool): Whether the camera is orthographic
+        use_uint8_obs (bool): Whether the observations are uint8 in [0, 255] rather
+            than float32 in [0, 1]. This cuts the size of the observations (and the
+            rollout buffer) by 4x. The images are normalized on-device by the feature
+            extractor. The renderer's `use_uint8` should be set to match, which is
+            the default in the eye config.
 
         renderer (MjCambrianRendererConfig): The renderer config to use for the
             underlying renderer. The width and height of the renderer will be set to the
@@ -53,6 +58,7 @@ class MjCambrianEyeConfig(MjCambrianBaseConfig):
     resolution: Tuple[int, int]
     coord: Tuple[float, float]
     orthographic: bool
+    use_uint8_obs: bool = False
 
     renderer: MjCambrianRendererConfig
 
@@ -113,9 +119,18 @@ class MjCambrianEye:
                 body tag with this name, i.e. <body name="<parent_body_name>" ...>.
         """
 
-        xml = MjCambrianXML.make_empty()
         if self._renderer is None:
-            return xml
+            return MjCambrianXML.make_empty()
+
+        return self._generate_camera_xml(parent_xml, geom, parent_body_name)
+
+    def _generate_camera_xml(
+        self, parent_xml: MjCambrianXML, geom: MjCambrianGeometry, parent_body_name: str
+    ) -> MjCambrianXML:
+        """Generates the xml for the camera of the eye. See `generate_xml` for more
+        information."""
+
+        xml = MjCambrianXML.make_empty()
 
         # Get the parent body reference
         parent_body = parent_xml.find(".//body", name=parent_body_name)
@@ -136,7 +151,7 @@ class MjCambrianEye:
 
         # Finally add the camera element at the end
         pos, quat = self._calculate_pos_quat(geom)
-        resolution = [self._renderer.config.width, self._renderer.config.height]
+        resolution = [self._config.renderer.width, self._config.renderer.height]
         xml.add(
             parent,
             "camera",
@@ -191,10 +206,16 @@ class MjCambrianEye:
         self._renderer.viewer.camera.type = mj.mjtCamera.mjCAMERA_FIXED
         self._renderer.viewer.camera.fixedcamid = self._fixedcamid
 
-        self._prev_obs = np.zeros((*self._config.resolution, 3), dtype=np.float32)
+        self._prev_obs = self._create_obs_buffer()
 
         return self.step()
 
+    def _create_obs_buffer(self) -> np.ndarray:
+        """Allocates the buffer which holds the previous observation."""
+        return np.zeros(
+            (*self._config.resolution, 3), dtype=self.observation_space.dtype
+        )
+
     def step(
         self, obs: Optional[np.ndarray] = None
     ) -> np.ndarray | Tuple[np.ndarray, np.ndarray]:
@@ -218,8 +239,11 @@ class MjCambrianEye:
         """Render the image from the camera. Will always only return the rgb array.
 
         This differs from step in that this is a debug method. The rendered image here
-        will be used to visualize the eye in the viewer.
+        will be used to visualize the eye in the viewer. uint8 observations are
+        converted to float32 in [0, 1] for visualization.
         """
+        if self._prev_obs.dtype == np.uint8:
+            return self._prev_obs.astype(np.float32) / 255.0
         return self._prev_obs
 
     @property
@@ -238,6 +262,8 @@ class MjCambrianEye:
         `spaces.Box` with the shape of the resolution of the eye."""
 
         shape = (*self._config.resolution, 3)
+        if self._config.use_uint8_obs:
+            return spaces.Box(0, 255, shape=shape, dtype=np.uint8)
         return spaces.Box(0.0, 1.0, shape=shape, dtype=np.float32)
 
     @property
@@ -2,12 +2,15 @@ from typing import Callable, Dict, Self, Tuple, Any
 
 import mujoco as mj
 import numpy as np
+import torch
 from gymnasium import spaces
 
+from cambrian.renderer import MjCambrianAtlasRenderer
 from cambrian.utils import MjCambrianGeometry, generate_sequence_from_range
 from cambrian.utils.cambrian_xml import MjCambrianXML
 from cambrian.utils.config import config_wrapper
 from cambrian.eyes.eye import MjCambrianEye, MjCambrianEyeConfig
+from cambrian.eyes.optics import MjCambrianOpticsEye
 
 
 @config_wrapper
@@ -40,6 +43,15 @@ class MjCambrianMultiEyeConfig(MjCambrianEyeConfig):
             to use the first eye config in the `eyes` attribute. `eyes` must have a
             length of 1 if this is specified. Each eye is named `eye_{lat}_{lon}` where
             `lat` is the latitude index and `lon` is the longitude index.
+
+        use_atlas (bool): If True, all the eyes are rendered into a single offscreen
+            buffer in one pass and read back with a single readback. Requires the eyes
+            to use a shared context. Defaults to False.
+        use_stacked_obs (bool): If True, the observations of all the eyes are stacked
+            in one preallocated (N, W, H, 3) array, which is exposed as a single Box
+            keyed by the name of the multi-eye. Each eye writes into its slice in
+            place. Image feature extractors process the stacked eyes in one batched
+            call. Defaults to False.
     """
 
     instance: Callable[[Self, str], "MjCambrianMultiEye"]
@@ -49,6 +61,9 @@ class MjCambrianMultiEyeConfig(MjCambrianEyeConfig):
     lon_range: Tuple[float, float]
     num_eyes: Tuple[int, int]
 
+    use_atlas: bool = False
+    use_stacked_obs: bool = False
+
 
 class MjCambrianMultiEye(MjCambrianEye):
     """Defines a multi-eye system that procedurally generates multiple eyes and manages them.
@@ -69,6 +84,20 @@ class MjCambrianMultiEye(MjCambrianEye):
         # Generate eyes procedurally
         self._place_eyes()
 
+        # If all the eyes are optics eyes, we'll step them together such that the psfs
+        # are applied to all the eyes in one batched convolution
+        self._batch_optics = len(self._eyes) > 1 and all(
+            isinstance(eye, MjCambrianOpticsEye) for eye in self._eyes.values()
+        )
+        self._optics_obs: torch.Tensor = None
+
+        # The previous observations of the eyes are views into this array if the eyes
+        # are batched or stacked
+        self._obs_arena: np.ndarray = None
+
+        # The atlas is created on the first reset, after the eye renderers are reset
+        self._atlas: MjCambrianAtlasRenderer = None
+
     def _place_eyes(self):
         """Place the eyes procedurally based on config."""
         nlat, nlon = self._config.num_eyes
@@ -77,10 +106,8 @@ class MjCambrianMultiEye(MjCambrianEye):
         for lat_idx, lat in enumerate(lat_bins):
             for lon_idx, lon in enumerate(lon_bins):
                 eye_name = f"{self._name}_{lat_idx}_{lon_idx}"
-                eye_config = self._config.copy()
-                # Update the eye's coord to the current lat, lon
-                with eye_config.set_readonly_temporarily(False):
-                    eye_config.update("coord", [lat, lon])
+                # The eyes only differ from the multi-eye's config in their coord
+                eye_config = self._config.merge(coord=[lat, lon])
                 # Create the eye instance
                 eye = eye_config.eye_instance(eye_config, eye_name)
                 self._eyes[eye_name] = eye
@@ -97,16 +124,61 @@ class MjCambrianMultiEye(MjCambrianEye):
 
     def reset(self, model: mj.MjModel, data: mj.MjData):
         """Reset all eyes."""
+        if self._atlas is not None:
+            self._atlas.invalidate()
+
         obs = {}
         for name, eye in self._eyes.items():
             obs[name] = eye.reset(model, data)
 
-        super().reset(model, data)
+        if self._config.use_atlas and self._atlas is None:
+            renderers = [eye._renderer for eye in self._eyes.values()]
+            self._atlas = MjCambrianAtlasRenderer(renderers)
+
+        use_arena = self._batch_optics or self._config.use_stacked_obs
+        if use_arena and self._obs_arena is None:
+            shape = (len(self._eyes), *self._config.resolution, 3)
+            if self._batch_optics:
+                # The arena is a shared memory buffer which is filled by the batched
+                # step
+                dtype = torch.uint8 if self._config.use_uint8_obs else torch.float32
+                self._optics_obs = torch.zeros(shape, dtype=dtype).share_memory_()
+                self._obs_arena = self._optics_obs.numpy()
+            else:
+                dtype = np.uint8 if self._config.use_uint8_obs else np.float32
+                self._obs_arena = np.zeros(shape, dtype=dtype)
+        if self._obs_arena is not None:
+            # The eyes reallocate their previous observation on reset, so point them
+            # back at their slice of the arena
+            for i, eye in enumerate(self._eyes.values()):
+                eye._prev_obs = self._obs_arena[i]
+
+        # Steps all the eyes, such that the arena is filled
+        stacked_obs = super().reset(model, data)
+        if self._config.use_stacked_obs:
+            return stacked_obs
 
         return obs
 
     def step(self) -> Dict[str, Any]:
         """Step all eyes and collect observations."""
+        if self._atlas is not None:
+            self._atlas.invalidate()
+
+        if self._batch_optics:
+            eyes = list(self._eyes.values())
+            batched_obs = MjCambrianOpticsEye.step_batched(eyes, self._optics_obs)
+            if self._config.use_stacked_obs:
+                return {self._name: batched_obs}
+            return dict(zip(self._eyes.keys(), batched_obs))
+
+        if self._config.use_stacked_obs:
+            # Each eye writes into its slice of the arena in place. A copy is returned
+            # since wrappers (e.g. frame stacking) keep references to the obs.
+            for eye in self._eyes.values():
+                eye.step()
+            return {self._name: self._obs_arena.copy()}
+
         obs = {}
         for name, eye in self._eyes.items():
             obs[name] = eye.step()
@@ -114,7 +186,7 @@ class MjCambrianMultiEye(MjCambrianEye):
 
     def render(self) -> np.ndarray | None:
         """This is a debug method which renders the eye's as a composite image.
-        
+
         Will appear as a compound eye. For example, if we have a 3x3 grid of eyes:
             TL T TR
             ML M MR
@@ -142,13 +214,22 @@ class MjCambrianMultiEye(MjCambrianEye):
             assert lon not in images[lat], f"Duplicate eye at {lat}, {lon}."
 
             # Add the image to the dictionary
-            images[lat][lon] = eye.prev_obs[:, :, :3]
+            images[lat][lon] = eye.render()[:, :, :3]
 
         return generate_composite(images, max_res)
 
     @property
     def observation_space(self) -> spaces.Space:
         """Constructs the observation space for the multi-eye."""
+        if self._config.use_stacked_obs:
+            # All the eyes share the multi-eye's config, so they have its space
+            eye_space = super().observation_space
+            shape = (len(self._eyes), *eye_space.shape)
+            low = np.broadcast_to(eye_space.low, shape)
+            high = np.broadcast_to(eye_space.high, shape)
+            stacked_space = spaces.Box(low, high, dtype=eye_space.dtype)
+            return spaces.Dict({self._name: stacked_space})
+
         observation_space = {}
         for name, eye in self._eyes.items():
             observation_space[name] = eye.observation_space
@@ -157,6 +238,9 @@ class MjCambrianMultiEye(MjCambrianEye):
     @property
     def prev_obs(self) -> Dict[str, np.ndarray]:
         """The last observations from all eyes."""
+        if self._config.use_stacked_obs:
+            return {self._name: self._obs_arena.copy()}
+
         obs = {}
         for name, eye in self._eyes.items():
             obs[name] = eye.prev_obs
@@ -1,15 +1,43 @@
 """This is an optics-enabled eye, which implements a height map and a PSF on top
 of the existing eye."""
 
-from typing import Dict, List, Optional, Tuple, Callable, Self
+import hashlib
+import math
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Callable, Self
 
+import mujoco as mj
 import numpy as np
 import torch
 
 from cambrian.eyes.eye import MjCambrianEye, MjCambrianEyeConfig
-from cambrian.utils import get_logger, make_odd
+from cambrian.utils import get_cache_path, get_logger, make_odd, save_atomically
 from cambrian.utils.config import MjCambrianBaseConfig, config_wrapper
 
+# Process-level registry of the optics parameters and precomputed psfs. Eyes with
+# identical optics share the same tensors, so they're only computed once per process.
+# The least recently used entries are evicted, such that the memory doesn't grow
+# without bound across many distinct optics (e.g. during evolution).
+OPTICS_CACHE: OrderedDict[Tuple, Any] = OrderedDict()
+OPTICS_CACHE_SIZE: int = 32
+
+# Number of depths for which the psfs are computed at once
+PSF_BATCH_SIZE: int = 8
+
+
+def _cached(key: Tuple, fn: Callable[[], Any]) -> Any:
+    """Returns the value in `OPTICS_CACHE` for the key, calling `fn` to calculate it
+    if it's not cached yet. At most `OPTICS_CACHE_SIZE` entries are kept."""
+    if key in OPTICS_CACHE:
+        OPTICS_CACHE.move_to_end(key)
+        return OPTICS_CACHE[key]
+
+    value = OPTICS_CACHE[key] = fn()
+    while len(OPTICS_CACHE) > OPTICS_CACHE_SIZE:
+        OPTICS_CACHE.popitem(last=False)
+    return value
+
 
 @config_wrapper
 class MjCambrianApertureConfig(MjCambrianBaseConfig):
@@ -65,6 +93,12 @@ class MjCambrianOpticsEyeConfig(MjCambrianEyeConfig):
 
         noise_std (float): Standard deviation of the Gaussian noise to be
             added to the image. If 0.0, no noise is added.
+        noise_bank_size (int): If > 0, a bank of this many images worth of gaussian
+            noise is generated on each reset and the noise of each step is a window
+            at a random offset into the bank, rather than sampling new noise for the
+            whole image each step. The bank is reseeded from the global rng on each
+            reset, which is seeded by the env, so the noise is reproducible for a
+            given seed. Defaults to 0.
         wavelengths (Tuple[float, float, float]): Wavelengths of the RGB channels.
 
         f_stop (float): F-stop of the lens. This is used to calculate the PSF.
@@ -78,6 +112,38 @@ class MjCambrianOpticsEyeConfig(MjCambrianEyeConfig):
 
         depths (List[float]): Depths at which the PSF is calculated. If empty, the psf
             is calculated for each render call; otherwise, the PSFs are precomputed.
+        depth_range (Optional[Tuple[float, float]]): If set, `depths` is ignored and
+            the psfs are precomputed at `num_depths` log-spaced depths within this
+            (near, far) range. Defaults to None.
+        num_depths (int): Number of log-spaced depths used with `depth_range`.
+            Defaults to 16.
+        interpolate_psfs (bool): If True, the psf at a given depth is linearly
+            interpolated (in log-depth) between the two neighbouring precomputed psfs
+            instead of using the nearest one. Defaults to False.
+        num_depth_planes (int): Number of depth planes the scene is split into. If 1,
+            a single psf at the mean depth of the scene is applied to the whole image.
+            Otherwise, the depth buffer is binned into this many log-spaced planes
+            between the nearest and farthest precomputed depths, each plane is
+            convolved with its own psf and the results are summed. The cost of the
+            convolution scales linearly with the number of planes. Defaults to 1.
+
+        conv_mode (str): How the image is convolved with the psf. "direct" uses a
+            spatial convolution, which scales with the psf size. "fft" multiplies the
+            spectrum of the image with the cached spectrum of the psf, which is
+            cheaper for large psfs. "separable" approximates each psf channel with a
+            rank `separable_rank` SVD and applies it as row/column 1-D convolutions,
+            which is the cheapest but not exact. "auto" picks the cheaper of the
+            exact modes from a simple cost model. The fft convolution is only equal
+            to the direct convolution up to floating point error, so experiments
+            must opt into it. Defaults to "direct".
+        separable_rank (int): Rank of the separable psf approximation. The relative
+            approximation error of the precomputed psfs is logged on construction
+            and is available through `separable_error`. Defaults to 1.
+        psf_cache_dir (Optional[Path]): Directory in which the precomputed psfs are
+            cached. The cache is keyed by a hash of all the parameters the psfs depend
+            on, so eyes (or processes) with identical optics load the psfs from disk
+            (memory-mapped) instead of recomputing them. If None, the psfs aren't
+            cached. Defaults to None.
     """
 
     instance: Callable[[Self, str], "MjCambrianOpticsEye"]
@@ -85,6 +151,7 @@ class MjCambrianOpticsEyeConfig(MjCambrianEyeConfig):
     pupil_resolution: Tuple[int, int]
 
     noise_std: float
+    noise_bank_size: int = 0
     wavelengths: Tuple[float, float, float]
 
     f_stop: float
@@ -94,6 +161,14 @@ class MjCambrianOpticsEyeConfig(MjCambrianEyeConfig):
     aperture: MjCambrianApertureConfig
 
     depths: List[float]
+    depth_range: Optional[Tuple[float, float]] = None
+    num_depths: int = 16
+    interpolate_psfs: bool = False
+    num_depth_planes: int = 1
+
+    conv_mode: str = "direct"
+    separable_rank: int = 1
+    psf_cache_dir: Optional[Path] = None
 
 
 class MjCambrianOpticsEye(MjCambrianEye):
@@ -109,17 +184,77 @@ class MjCambrianOpticsEye(MjCambrianEye):
 
         self._renders_depth = "depth_array" in self._config.renderer.render_modes
         assert self._renders_depth, "Eye: 'depth_array' must be a render mode."
+        assert (
+            not self._config.renderer.use_uint8
+        ), "Eye: renderer.use_uint8 must be False, the optics need the float image."
 
         self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-        self._psfs: Dict[torch.Tensor, torch.Tensor] = {}
-        self._depths = torch.tensor(self._config.depths).to(self._device)
+        self._psfs: Optional[torch.Tensor] = None
+        self._psf_ffts: Optional[torch.Tensor] = None
+        self._psf_factors: Optional[torch.Tensor] = None
+        self._noise_bank: Optional[torch.Tensor] = None
+        self._noise_generator: Optional[torch.Generator] = None
+        self._separable_error: Optional[float] = None
+        self._depths = self._get_depths().to(self._device)
         self._initialize()
-        if self._config.depths:
+        self._conv_mode = self._select_conv_mode()
+        if len(self._depths) > 0:
             self._precompute_psfs()
+        if self._config.num_depth_planes > 1:
+            self._initialize_depth_planes()
+
+    def _get_depths(self) -> torch.Tensor:
+        """Returns the sorted depths at which the psfs are precomputed."""
+        if self._config.depth_range is not None:
+            near, far = self._config.depth_range
+            assert 0 < near < far, f"Invalid depth range: {near=}, {far=}"
+            assert self._config.num_depths > 1, "Must use at least 2 depths."
+            return torch.logspace(
+                math.log10(near), math.log10(far), self._config.num_depths
+            )
+        return torch.tensor(sorted(self._config.depths))
 
     def _initialize(self):
-        """This will initialize the parameters used during the PSF calculation."""
+        """This will initialize the parameters used during the PSF calculation. The
+        parameters which don't depend on the aperture are identical for all the eyes
+        with the same optics, so they're calculated once per process and shared
+        through `OPTICS_CACHE`."""
+        optics = _cached(("optics", self._get_optics_key()), self._calculate_optics)
+        for name, value in optics.items():
+            setattr(self, f"_{name}", value)
+
+        # Aperture mask
+        fx, fy = self._config.focal
+        Lx, Ly = fx / self._config.f_stop, fy / self._config.f_stop
+        A = self._calculate_aperture_mask(self._X1_Y1, Lx, Ly).to(self._device)
+
+        # Going to scale the intensity by the overall throughput of the aperture
+        pupil_Mx, pupil_My = self._config.pupil_resolution
+        self._scaling_intensity = (A.sum() / (max(pupil_Mx * pupil_My, 1))) ** 2
+
+        # The pupil is shared as well if the aperture is identical
+        self._A = A
+        self._pupil = _cached(
+            ("pupil", self._get_psf_key()), lambda: A * self._lens_phase
+        )
+
+    def _get_optics_key(self) -> Tuple:
+        """Returns the key of the aperture independent optics parameters."""
+        return (
+            tuple(self._config.pupil_resolution),
+            tuple(self._config.focal),
+            tuple(self._config.sensorsize),
+            self._config.f_stop,
+            tuple(self._config.wavelengths),
+            self._config.refractive_index,
+            (self._config.renderer.width, self._config.renderer.height),
+            str(self._device),
+        )
+
+    def _calculate_optics(self) -> Dict[str, torch.Tensor | Tuple[int, int]]:
+        """Calculates the aperture independent parameters used during the PSF
+        calculation."""
         # pupil_Mx,pupil_My defines the number of pixels in x,y direction
         # (i.e. width, height) of the pupil
         pupil_Mx, pupil_My = torch.tensor(self._config.pupil_resolution)
@@ -154,12 +289,6 @@ class MjCambrianOpticsEye(MjCambrianEye):
         )
         FX, FY = torch.meshgrid(freqx, freqy, indexing="ij")
 
-        # Aperture mask
-        A = self._calculate_aperture_mask(X1_Y1, Lx, Ly)
-
-        # Going to scale the intensity by the overall throughput of the aperture
-        self._scaling_intensity = (A.sum() / (max(pupil_Mx * pupil_My, 1))) ** 2
-
         # Calculate the wave number
         wavelengths = torch.tensor(self._config.wavelengths).reshape(-1, 1, 1)
         k = 1j * 2 * torch.pi / wavelengths
@@ -176,7 +305,7 @@ class MjCambrianOpticsEye(MjCambrianEye):
         height_map = h_r[r.to(torch.int64)]  # (n, n)
         height_map *= torch.max(wavelengths / (self._config.refractive_index - 1.0))
         phi_m = k * (self._config.refractive_index - 1.0) * height_map
-        pupil = A * torch.exp(phi_m)
+        lens_phase = torch.exp(phi_m)
 
         # Determine the scaled down psf size. Will resample the psf such that the conv
         # is faster
@@ -195,18 +324,31 @@ class MjCambrianOpticsEye(MjCambrianEye):
         )
         H = H_valid * FX_FY
 
-        # Now store all as class attributes
-        self._X1, self._Y1 = X1.to(self._device), Y1.to(self._device)
-        self._X1_Y1 = X1_Y1.to(self._device)
-        self._H_valid = H_valid.to(self._device)
-        self._H = H.to(self._device)
-        self._FX, self._FY = FX.to(self._device), FY.to(self._device)
-        self._FX_FY = FX_FY.to(self._device)
-        self._k = k.to(self._device)
-        self._A = A.to(self._device)
-        self._pupil = pupil.to(self._device)
-        self._height_map = height_map.to(self._device)
-        self._psf_resolution = psf_resolution
+        # Now return all, which are stored as class attributes
+        return dict(
+            X1=X1.to(self._device),
+            Y1=Y1.to(self._device),
+            X1_Y1=X1_Y1.to(self._device),
+            H_valid=H_valid.to(self._device),
+            H=H.to(self._device),
+            FX=FX.to(self._device),
+            FY=FY.to(self._device),
+            FX_FY=FX_FY.to(self._device),
+            k=k.to(self._device),
+            lens_phase=lens_phase.to(self._device),
+            height_map=height_map.to(self._device),
+            psf_resolution=psf_resolution,
+        )
+
+    def _create_obs_buffer(self) -> np.ndarray:
+        """The obs buffer is backed by shared memory and allocated once, such that the
+        obs is written to it directly from torch and can be shared with other
+        processes without a copy."""
+        if self._prev_obs is None:
+            shape = (*self._config.resolution, 3)
+            dtype = torch.uint8 if self._config.use_uint8_obs else torch.float32
+            return torch.zeros(shape, dtype=dtype).share_memory_().numpy()
+        return self._prev_obs
 
     def _calculate_aperture_mask(
         self, X1_Y1: torch.Tensor, Lx: float, Ly: float
@@ -250,11 +392,111 @@ class MjCambrianOpticsEye(MjCambrianEye):
 
     def _precompute_psfs(self):
         """This will precompute the PSFs for all depths. This is done to avoid
-        recomputing the PSF for each render call."""
-        for depth in self._depths:
-            self._psfs[depth.item()] = self._calculate_psf(depth).to(self._device)
+        recomputing the PSF for each render call. If the fft or separable convolution
+        is used, the spectra or separable factors of the psfs are cached as well.
+
+        The psfs (and their spectra/factors) are shared between all the eyes with the
+        same optics in this process through `OPTICS_CACHE`. If `psf_cache_dir` is set,
+        the psfs are also loaded from the on-disk cache if they've already been
+        computed for the same optics. Otherwise, they're computed and written to the
+        cache."""
+        psf_key = self._get_psf_key()
+        self._psfs = _cached(("psfs", psf_key), lambda: self._load_psfs(psf_key))
+        if self._conv_mode == "fft":
+            self._psf_ffts = _cached(
+                ("fft", psf_key), lambda: self._calculate_psf_fft(self._psfs)
+            )
+        elif self._conv_mode == "separable":
+            rank = self._config.separable_rank
+            self._psf_factors, self._separable_error = _cached(
+                ("separable", psf_key, rank),
+                lambda: (
+                    self._calculate_psf_factors(self._psfs),
+                    self._calculate_separable_error(self._psfs),
+                ),
+            )
+            get_logger().info(
+                f"Separable psf approximation error for {self.name} "
+                f"(rank {self._config.separable_rank}): {self._separable_error:.2e}"
+            )
+
+    def _load_psfs(self, psf_key: str) -> torch.Tensor:
+        """Loads the psfs from the on-disk cache or computes them for all the depths.
+        The psfs are computed in batches of depths to bound the memory usage."""
+        cache_path = get_cache_path(self._config.psf_cache_dir, f"psfs_{psf_key}.pt")
+        if cache_path is not None and cache_path.exists():
+            get_logger().debug(f"Loading cached psfs from {cache_path}.")
+            psfs = torch.load(cache_path, mmap=True, weights_only=True)
+        else:
+            depths = torch.split(self._depths, PSF_BATCH_SIZE)
+            psfs = torch.cat([self._calculate_psf(depth) for depth in depths])
+            if cache_path is not None:
+                psfs_cpu = psfs.cpu()
+                save_atomically(cache_path, lambda f: torch.save(psfs_cpu, f))
+                get_logger().debug(f"Saved psfs to {cache_path}.")
+        return psfs.to(self._device)
+
+    def _initialize_depth_planes(self):
+        """Splits the range of precomputed depths into log-spaced planes. Each plane
+        uses the kernel at the geometric center of its bin, so the kernels of all the
+        planes are looked up once here."""
+        num_planes = self._config.num_depth_planes
+        assert len(self._depths) > 1, "Depth planes require at least 2 depths."
+
+        near, far = self._depths[0].log().item(), self._depths[-1].log().item()
+        log_edges = torch.linspace(near, far, num_planes + 1, device=self._device)
+        plane_depths = ((log_edges[:-1] + log_edges[1:]) / 2).exp()
+
+        # Only the inner edges are used to bucketize the depth buffer, such that depths
+        # outside of the range end up in the nearest/farthest plane
+        self._plane_edges = log_edges[1:-1].exp()
+        self._plane_kernels = torch.stack([self._get_kernel(d) for d in plane_depths])
+
+    def _get_psf_key(self) -> str:
+        """Returns a hash of everything the precomputed psfs depend on."""
+        key = (
+            tuple(self._config.pupil_resolution),
+            tuple(self._config.focal),
+            tuple(self._config.sensorsize),
+            self._config.f_stop,
+            tuple(self._config.wavelengths),
+            self._config.refractive_index,
+            (self._config.renderer.width, self._config.renderer.height),
+            tuple(self._depths.tolist()),
+        )
+        sha = hashlib.sha256(repr(key).encode())
+        # The height map and aperture are hashed after they've been calculated, such
+        # that randomized apertures are keyed by the sampled mask
+        sha.update(self._height_map.cpu().numpy().tobytes())
+        sha.update(self._A.cpu().numpy().tobytes())
+        return sha.hexdigest()
+
+    def _select_conv_mode(self) -> str:
+        """Selects the convolution mode. If the config sets it to "auto", the mode is
+        picked by comparing the number of multiply-adds of the direct convolution with
+        an estimate for the fft convolution (forward and inverse transforms of the
+        padded image)."""
+        conv_mode = self._config.conv_mode
+        assert conv_mode in ["auto", "direct", "fft", "separable"], f"{conv_mode=}"
+        if conv_mode != "auto":
+            return conv_mode
+
+        W, H = self._config.renderer.width, self._config.renderer.height
+        psf_W, psf_H = self._psf_resolution
+        padded_W, padded_H = W + psf_W - 1, H + psf_H - 1
+
+        direct_cost = W * H * psf_W * psf_H
+        fft_cost = 5 * padded_W * padded_H * math.log2(padded_W * padded_H)
+        conv_mode = "fft" if fft_cost < direct_cost else "direct"
+        get_logger().debug(f"Using {conv_mode} convolution for {self.name}.")
+        return conv_mode
 
     def _calculate_psf(self, depth: torch.Tensor):
+        """Calculates the psf at the specified depth. The depth can either be a scalar,
+        in which case the psf is of shape [3, psf_W, psf_H], or a batch of depths of
+        shape [D], in which case the psfs are of shape [D, 3, psf_W, psf_H]."""
+        depth = depth.reshape(*depth.shape, 1, 1, 1)
+
         # electric field originating from point source
         u1 = torch.exp(self._k * torch.sqrt(self._X1_Y1 + depth.square()))
 
@@ -263,14 +505,15 @@ class MjCambrianOpticsEye(MjCambrianEye):
 
         # electric field at the sensor plane
         # Calculate the sqrt of the PSF
-        u2_fft = torch.fft.fft2(torch.fft.fftshift(u2))
-        H_u2_fft = torch.mul(torch.fft.fftshift(self._H), u2_fft)
-        u3: torch.Tensor = torch.fft.ifftshift(torch.fft.ifft2(H_u2_fft))
+        dim = (-2, -1)
+        u2_fft = torch.fft.fft2(torch.fft.fftshift(u2, dim=dim))
+        H_u2_fft = torch.mul(torch.fft.fftshift(self._H, dim=dim), u2_fft)
+        u3: torch.Tensor = torch.fft.ifftshift(torch.fft.ifft2(H_u2_fft), dim=dim)
 
         # Normalize the PSF by channel
         psf: torch.Tensor = u3.abs().square()
         psf = self._resize(psf)
-        psf /= psf.sum(axis=(1, 2)).reshape(-1, 1, 1)
+        psf /= psf.sum(axis=(-2, -1), keepdim=True)
 
         # TODO: we have to do this post-calculations otherwise there are differences
         # between previous algo
@@ -278,78 +521,346 @@ class MjCambrianOpticsEye(MjCambrianEye):
 
         return psf
 
+    def _calculate_psf_fft(self, psfs: torch.Tensor) -> torch.Tensor:
+        """Calculates the spectrum of the psfs used by the fft convolution. The psfs
+        are flipped, since the direct convolution is actually a cross-correlation, and
+        zero-padded to the linear convolution size to avoid circular wrap-around.
+
+        Args:
+            psfs (torch.Tensor): The psfs of shape [..., 3, psf_W, psf_H].
+
+        Returns:
+            torch.Tensor: The spectra of shape [..., 3, W + psf_W - 1,
+                (H + psf_H - 1) // 2 + 1].
+        """
+        return torch.fft.rfft2(psfs.flip(-2, -1), s=self._padded_resolution())
+
+    def _calculate_psf_factors(self, psfs: torch.Tensor) -> torch.Tensor:
+        """Decomposes each psf channel into `separable_rank` separable filters using
+        the SVD, such that psf ~= sum_i outer(col_i, row_i).
+
+        The sign of each pair of filters is fixed such that the column filter sums to
+        a positive value. This removes the sign ambiguity of the SVD, so the factors of
+        neighbouring depths can be interpolated. Note that interpolating the factors
+        is only an approximation of interpolating the psfs.
+
+        Args:
+            psfs (torch.Tensor): The psfs of shape [..., 3, psf_W, psf_H].
+
+        Returns:
+            torch.Tensor: The column and row filters concatenated along the last
+                dimension, of shape [..., 3, rank, psf_W + psf_H].
+        """
+        rank = self._config.separable_rank
+        assert 0 < rank <= min(self._psf_resolution), f"Invalid separable {rank=}"
+
+        U, S, Vh = torch.linalg.svd(psfs)
+        sqrt_S = S[..., :rank].sqrt().unsqueeze(-1)
+        cols = U[..., :rank].transpose(-2, -1) * sqrt_S
+        rows = Vh[..., :rank, :] * sqrt_S
+
+        sign = torch.where(cols.sum(-1, keepdim=True) < 0, -1.0, 1.0)
+        return torch.cat([cols * sign, rows * sign], dim=-1)
+
+    def _calculate_separable_error(self, psfs: torch.Tensor) -> float:
+        """Returns the worst case relative (Frobenius) error of the separable
+        approximation over all the psfs and channels."""
+        S = torch.linalg.svdvals(psfs)
+        rank = self._config.separable_rank
+        error = S[..., rank:].square().sum(-1) / S.square().sum(-1)
+        return error.sqrt().max().item()
+
+    def _padded_resolution(self) -> Tuple[int, int]:
+        """Returns the size of the full linear convolution of the image with the psf."""
+        W, H = self._config.renderer.width, self._config.renderer.height
+        psf_W, psf_H = self._psf_resolution
+        return W + psf_W - 1, H + psf_H - 1
+
+    def reset(self, model: mj.MjModel, data: mj.MjData):
+        """Resets the noise bank (i.e. after the env has set the seed) and then resets
+        the eye."""
+        if self._config.noise_bank_size > 0:
+            self._reset_noise_bank()
+
+        return super().reset(model, data)
+
+    def _reset_noise_bank(self):
+        """Reseeds the noise generator from the global torch rng and redraws the bank
+        of standard normal noise. This is done on every reset, such that the bank and
+        the offsets sampled into it are tied to the seed of the global rng, like noise
+        which is sampled from the global rng each step."""
+        seed = torch.randint(2**62, (1,)).item()
+        self._noise_generator = torch.Generator().manual_seed(seed)
+
+        W, H = self._config.renderer.width, self._config.renderer.height
+        size = self._config.noise_bank_size * W * H * 3
+        bank = torch.randn(size, generator=self._noise_generator)
+        if self._noise_bank is None:
+            self._noise_bank = bank.to(self._device)
+        else:
+            self._noise_bank.copy_(bank)
+
     def step(self) -> np.ndarray:
         """Overwrites the default render method to apply the depth invariant PSF to the
         image."""
-        image, depth = self._renderer.render()
+        layers, kernels = self._render()
 
-        # pytorch doesn't support negative strides, so copy if there are any
-        image = image.copy() if any(s < 0 for s in image.strides) else image
-        image = torch.from_numpy(image).to(self._device)
+        # Apply the PSF of each depth plane and composite the planes
+        image = self._convolve(layers, kernels).sum(0)
 
-        # Calculate the depth. Remove the sky depth, which is capped at the extent
-        # of the configured environment and apply a far field approximation assumption.
-        depth = depth[depth < np.max(depth)]
-        depth = np.clip(depth, 5 * max(self.config.focal), np.inf)
-        mean_depth = torch.tensor(np.mean(depth), device=self._device)
+        # Apply the scaling intensity ratio
+        image *= self._scaling_intensity
 
-        # Add noise to the image
-        image = self._apply_noise(image, self._config.noise_std)
+        # Post-process the image and write it directly into the obs buffer. A copy is
+        # returned since wrappers (e.g. frame stacking) keep references to the obs.
+        torch.from_numpy(self._prev_obs).copy_(self._postprocess(image))
+        return self._prev_obs.copy()
+
+    @staticmethod
+    def step_batched(
+        eyes: List["MjCambrianOpticsEye"], out: torch.Tensor
+    ) -> np.ndarray:
+        """Steps multiple optics eyes at once. Each eye renders its own image, but the
+        PSFs are applied to all the images in a single grouped convolution and the
+        post-processing is done on the whole batch.
+
+        Args:
+            eyes (List[MjCambrianOpticsEye]): The eyes to step. All the eyes must
+                share the same renderer resolution, psf resolution and eye
+                resolution.
+            out (torch.Tensor): The buffer of shape (N, W, H, 3) which holds the
+                previous observations of the eyes, where N is the number of eyes. The
+                observation of the i-th eye is written to out[i].
+
+        Returns:
+            np.ndarray: A copy of the observations of shape (N, W, H, 3). The
+                observation of each eye is a view into this contiguous array.
+        """
+        layers, kernels = zip(*[eye._render() for eye in eyes])
 
-        # Apply the depth invariant PSF
-        psf = self._get_psf(mean_depth)
+        # All the eyes share the same config, so just use the first for convolving
+        eye = eyes[0]
+        images = eye._convolve(torch.cat(layers), torch.cat(kernels))
+        images = images.reshape(len(eyes), -1, *images.shape[1:]).sum(1)
 
-        # Image may be batched in the form
-        image = image.permute(2, 0, 1).unsqueeze(0)
-        psf = psf.unsqueeze(1)
-        image = torch.nn.functional.conv2d(image, psf, padding="same", groups=3)
+        # The aperture may be randomized per eye, so scale each image separately
+        scaling = torch.stack([e._scaling_intensity for e in eyes])
+        images *= scaling.to(images.device).reshape(-1, 1, 1, 1)
 
-        # Apply the scaling intensity ratio
-        image *= self._scaling_intensity
+        out.copy_(eye._postprocess(images))
+        return out.numpy().copy()
+
+    def _render(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Renders the image and depth and splits the noisy image into depth layers.
 
-        # Post-process the image
-        image = image.squeeze(0).permute(1, 2, 0)
-        image = self._crop(image)
-        image = torch.clip(image, 0, 1)
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: The layers and their kernels. See
+                `_split_layers`.
+        """
+        image, depth = self._renderer.render()
+        image, depth = self._to_tensor(image), self._to_tensor(depth)
+
+        # Add noise to the image
+        image = self._apply_noise(image, self._config.noise_std)
 
-        return super().step(obs=image.cpu().numpy())
+        return self._split_layers(image.permute(2, 0, 1), depth)
+
+    def _to_tensor(self, array: np.ndarray) -> torch.Tensor:
+        """Wraps a renderer output as a tensor on the eye's device without copying it
+        on the host. pytorch doesn't support negative strides, so the flipped axes are
+        unflipped in numpy (a view) and flipped back on the device."""
+        flipped_dims = [i for i, stride in enumerate(array.strides) if stride < 0]
+        if not flipped_dims:
+            return torch.from_numpy(array).to(self._device)
+
+        array = np.flip(array, flipped_dims)
+        return torch.from_numpy(array).to(self._device).flip(flipped_dims)
+
+    def _split_layers(
+        self, image: torch.Tensor, depth: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Splits the image into depth layers, each of which is convolved with its own
+        kernel. The convolved layers sum to the final image.
+
+        If a single depth plane is used, the image is a single layer and the kernel is
+        taken at the mean depth of the scene. Otherwise, each pixel is assigned to the
+        plane its depth falls into and the layers are the masked images.
+
+        Args:
+            image (torch.Tensor): The image of shape [3, W, H].
+            depth (torch.Tensor): The depth of shape [W, H].
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: The layers of shape [K, 3, W, H] and
+                the kernels of shape [K, 3, ...] (see `_get_kernel`), where K is the
+                number of depth planes.
+        """
+        # The sky depth is capped at the extent of the configured environment
+        is_sky = depth >= depth.max()
+
+        if self._config.num_depth_planes == 1:
+            # Calculate the depth. Remove the sky depth and apply a far field
+            # approximation assumption. If only the sky is visible, the farthest
+            # precomputed depth is used, or the far field depth if the psfs aren't
+            # precomputed.
+            far_field_depth = 5 * max(self._config.focal)
+            depth = depth[~is_sky]
+            if depth.numel() == 0:
+                depth = self._depths[-1:]
+            if depth.numel() == 0:
+                depth = torch.tensor([far_field_depth], device=self._device)
+            depth = torch.clip(depth, min=far_field_depth)
+            return image.unsqueeze(0), self._get_kernel(depth.mean()).unsqueeze(0)
+
+        # Put the sky in the farthest plane
+        depth = torch.where(is_sky, torch.inf, depth)
+        planes = torch.bucketize(depth, self._plane_edges)
+        plane_ids = torch.arange(len(self._plane_kernels), device=self._device)
+        masks = planes == plane_ids.reshape(-1, 1, 1)
+        return image * masks.unsqueeze(1), self._plane_kernels
+
+    def _convolve(self, images: torch.Tensor, kernels: torch.Tensor) -> torch.Tensor:
+        """Convolves each image with its kernel. For the direct convolution, all the
+        images are convolved in a single grouped convolution, where each channel of
+        each image is its own group. For the fft convolution, the spectra of the images
+        are multiplied with the spectra of the psfs and cropped back to [W, H]. For the
+        separable convolution, the images are convolved with the column filters and
+        then the row filters (both grouped) and the ranks are summed.
+
+        Args:
+            images (torch.Tensor): The images of shape [B, 3, W, H].
+            kernels (torch.Tensor): The kernels of shape [B, 3, ...], as returned by
+                `_get_kernel`.
+
+        Returns:
+            torch.Tensor: The convolved images of shape [B, 3, W, H].
+        """
+        B, C, W, H = images.shape
+        if self._conv_mode == "fft":
+            padded_resolution = self._padded_resolution()
+            spectra = torch.fft.rfft2(images, s=padded_resolution) * kernels
+            images = torch.fft.irfft2(spectra, s=padded_resolution)
+
+            # Crop the "same" region out of the full linear convolution
+            left, top = self._psf_resolution[0] // 2, self._psf_resolution[1] // 2
+            return images[..., left : left + W, top : top + H]
+
+        elif self._conv_mode == "separable":
+            psf_W, psf_H = self._psf_resolution
+            rank = kernels.shape[-2]
+            cols = kernels[..., :psf_W].reshape(B * C * rank, 1, psf_W, 1)
+            rows = kernels[..., psf_W:].reshape(B * C * rank, 1, 1, psf_H)
+
+            images = images.reshape(1, B * C, W, H)
+            images = torch.nn.functional.conv2d(
+                images, cols, padding="same", groups=B * C
+            )
+            images = torch.nn.functional.conv2d(
+                images, rows, padding="same", groups=B * C * rank
+            )
+            return images.reshape(B, C, rank, W, H).sum(2)
+
+        psfs = kernels
+        images = images.reshape(1, B * C, W, H)
+        psfs = psfs.reshape(B * C, 1, *psfs.shape[-2:])
+        images = torch.nn.functional.conv2d(images, psfs, padding="same", groups=B * C)
+        return images.reshape(B, C, W, H)
+
+    def _postprocess(self, images: torch.Tensor) -> torch.Tensor:
+        """Converts the images from [..., 3, W, H] to [..., W, H, 3], crops them to the
+        eye resolution and clips them to [0, 1]. If the eye returns uint8 observations,
+        the images are quantized to [0, 255] after the convolution."""
+        images = images.movedim(-3, -1)
+        images = self._crop(images)
+        images = torch.clip(images, 0, 1)
+        if self._config.use_uint8_obs:
+            images = (images * 255.0).round().to(torch.uint8)
+        return images
 
     def _apply_noise(self, image: torch.Tensor, std: float) -> torch.Tensor:
-        """Add Gaussian noise to the image."""
+        """Add Gaussian noise to the image. If the noise bank is used, the noise is a
+        window at a random offset into the bank."""
         if std == 0.0:
             return image
 
-        noise = torch.normal(mean=0.0, std=std, size=image.shape, device=self._device)
+        if self._noise_bank is not None:
+            high = len(self._noise_bank) - image.numel() + 1
+            offset = torch.randint(high, (1,), generator=self._noise_generator).item()
+            noise = self._noise_bank[offset : offset + image.numel()]
+            noise = noise.view(image.shape) * std
+        else:
+            noise = torch.normal(0.0, std, size=image.shape, device=self._device)
         return torch.clamp(image + noise, 0, 1)
 
     def _get_psf(self, depth: torch.Tensor) -> torch.Tensor:
         """This will retrieve the psf with the closest depth to the specified depth.
         If the psfs are precomputed, this will be a simple lookup. Otherwise, the psf
         will be calculated on the fly."""
-        if self._psfs:
-            closest_depth = self._depths[torch.argmin(torch.abs(depth - self._depths))]
-            return self._psfs[closest_depth.item()]
+        if self._psfs is not None:
+            return self._lookup_depth(self._psfs, depth)
         else:
             return self._calculate_psf(depth)
 
+    def _get_kernel(self, depth: torch.Tensor) -> torch.Tensor:
+        """Returns the kernel passed to `_convolve` for the specified depth. For the
+        direct convolution this is the psf of shape [3, psf_W, psf_H]; for the fft
+        convolution this is the (cached) spectrum of the psf and for the separable
+        convolution these are the (cached) separable factors of the psf."""
+        if self._conv_mode == "direct":
+            return self._get_psf(depth)
+        elif self._conv_mode == "fft":
+            if self._psf_ffts is not None:
+                return self._lookup_depth(self._psf_ffts, depth)
+            return self._calculate_psf_fft(self._calculate_psf(depth))
+        else:
+            if self._psf_factors is not None:
+                return self._lookup_depth(self._psf_factors, depth)
+            return self._calculate_psf_factors(self._calculate_psf(depth))
+
+    def _lookup_depth(self, table: torch.Tensor, depth: torch.Tensor) -> torch.Tensor:
+        """Looks up the entry of a precomputed table (i.e. the psfs or their spectra)
+        at the specified depth. The first dimension of the table corresponds to
+        `self._depths`. If `interpolate_psfs` is set, the two neighbouring entries are
+        linearly interpolated in log-depth; otherwise, the nearest entry is returned.
+        Since the convolution is linear, interpolating the spectra is equivalent to
+        interpolating the psfs."""
+        depth = depth.to(self._depths).reshape(1)
+        if not self._config.interpolate_psfs or len(self._depths) == 1:
+            return table[torch.argmin(torch.abs(depth - self._depths))]
+
+        hi = torch.searchsorted(self._depths, depth).clamp(1, len(self._depths) - 1)
+        lo = hi - 1
+        log_depths = self._depths.log()
+        t = (depth.log() - log_depths[lo]) / (log_depths[hi] - log_depths[lo])
+        t = t.clamp(0, 1).reshape(-1, *[1] * (table.dim() - 1))
+        return torch.lerp(table[lo], table[hi], t.to(table.dtype)).squeeze(0)
+
     def _crop(self, image: torch.Tensor) -> torch.Tensor:
         """Crop the image to the resolution specified in the config. This method
-        supports input shape [W, H, 3]. It crops the center part of the image.
+        supports input shape [..., W, H, 3]. It crops the center part of the image.
         """
-        width, height, _ = image.shape
+        width, height, _ = image.shape[-3:]
         target_width, target_height = self._config.resolution
         top = (height - target_height) // 2
         left = (width - target_width) // 2
-        return image[left : left + target_width, top : top + target_height, :]
+        return image[..., left : left + target_width, top : top + target_height, :]
 
     def _resize(self, psf: torch.Tensor) -> torch.Tensor:
-        """Resize the PSF to the psf_resolution."""
+        """Resize the PSF to the psf_resolution. Supports input shape
+        [..., 3, W, H]."""
         return torch.nn.functional.interpolate(
-            psf.unsqueeze(0),
+            psf.reshape(-1, *psf.shape[-3:]),
             size=self._psf_resolution,
             mode="bilinear",
             align_corners=False,
-        ).squeeze(0)
+        ).reshape(*psf.shape[:-2], *self._psf_resolution)
+
+    @property
+    def separable_error(self) -> Optional[float]:
+        """The worst case relative error of the separable psf approximation over the
+        precomputed psfs. None if the separable convolution isn't used or the psfs
+        aren't precomputed."""
+        return self._separable_error
 
 
 if __name__ == "__main__":
@@ -0,0 +1,182 @@
+"""Defines the `MjCambrianRaycastEye` class. Instead of rendering the scene with
+OpenGL, the pixels are computed by casting one ray per pixel with `mj_multiRay`. This
+is much cheaper than rendering for very low resolution eyes (e.g. 1x1 to 5x5) and
+doesn't require a GL backend at all."""
+
+from typing import Any, Dict, Tuple
+
+import mujoco as mj
+import numpy as np
+
+from cambrian.eyes.eye import MjCambrianEye, MjCambrianEyeConfig
+from cambrian.utils import MjCambrianGeometry, get_camera_id
+from cambrian.utils.cambrian_xml import MjCambrianXML
+
+# The default geom rgba. The material color is only overridden by other geom colors.
+_DEFAULT_RGBA = np.array([0.5, 0.5, 0.5, 1.0])
+
+
+class MjCambrianRaycastEye(MjCambrianEye):
+    """An eye which computes each pixel by casting a ray from the camera through the
+    center of the pixel. The pixel is the color of the geom which is hit, i.e. the
+    material/geom rgba modulated by the mean color of the material's texture. Lighting
+    isn't simulated. Rays which don't hit anything are black, like the renderer with
+    the skybox disabled.
+
+    The observations have the same shape, dtype and orientation as those of
+    `MjCambrianEye` for the same config, so the two are interchangeable.
+
+    Args:
+        config (MjCambrianEyeConfig): The configuration for the eye.
+        name (str): The name of the eye.
+    """
+
+    def __init__(self, config: MjCambrianEyeConfig, name: str):
+        super().__init__(config, name, disable_render=True)
+
+        assert (
+            not self._config.orthographic
+        ), f"Eye ({name}): orthographic cameras aren't supported by the raycast eye."
+
+        # Rays in the camera frame, one per pixel, of shape (W * H, 3)
+        self._rays = self._calculate_rays()
+        self._geomid = np.empty(len(self._rays), dtype=np.int32)
+        self._dist = np.empty(len(self._rays), dtype=np.float64)
+
+        self._geomgroup = np.asarray(
+            self._config.renderer.scene_options.geomgroup, dtype=np.uint8
+        )
+        self._colors: np.ndarray = None
+        self._far: float = None
+
+        self._multiray_kwargs = self._get_multiray_kwargs()
+
+    def generate_xml(
+        self, parent_xml: MjCambrianXML, geom: MjCambrianGeometry, parent_body_name: str
+    ) -> MjCambrianXML:
+        """The raycast eye doesn't have a renderer, but still needs a camera to cast
+        the rays from. See `MjCambrianEye.generate_xml` for more information."""
+        return self._generate_camera_xml(parent_xml, geom, parent_body_name)
+
+    @staticmethod
+    def _get_multiray_kwargs() -> Dict[str, Any]:
+        """`mj_multiRay` takes an additional normal output in newer mujoco versions,
+        which is required there. This casts a single ray in an empty model to check
+        which signature is available.
+
+        Returns:
+            Dict[str, Any]: The additional kwargs to pass to `mj_multiRay`.
+        """
+        model = mj.MjModel.from_xml_string("<mujoco/>")
+        kwargs = dict(
+            m=model,
+            d=mj.MjData(model),
+            pnt=np.zeros(3),
+            vec=np.array([0.0, 0.0, -1.0]),
+            geomgroup=None,
+            flg_static=1,
+            bodyexclude=-1,
+            geomid=np.empty(1, dtype=np.int32),
+            dist=np.empty(1, dtype=np.float64),
+            nray=1,
+            cutoff=1.0,
+        )
+        try:
+            mj.mj_multiRay(**kwargs, normal=None)
+            return dict(normal=None)
+        except TypeError:
+            return {}
+
+    def _calculate_rays(self) -> np.ndarray:
+        """Calculates the direction of the ray through the center of each pixel in the
+        camera frame (x right, y up, looking down -z). The rays are scaled to have a
+        z component of -1, such that the distance along the ray is the depth of the
+        hit, like the depth returned by the renderer."""
+        W, H = self._config.resolution
+        sx, sy = self._config.sensorsize
+        fx, fy = self._config.focal
+
+        # Pixels are indexed W x H from the top left, like the renderer output
+        x = ((np.arange(W) + 0.5) / W - 0.5) * sx / fx
+        y = (0.5 - (np.arange(H) + 0.5) / H) * sy / fy
+        x, y = np.meshgrid(x, y, indexing="ij")
+        rays = np.stack([x, y, -np.ones_like(x)], axis=-1)
+        return rays.reshape(-1, 3)
+
+    def _calculate_colors(self) -> np.ndarray:
+        """Calculates the color of each geom. The last row is the background color,
+        such that the colors can be indexed directly with the geom ids returned by
+        `mj_multiRay` (which are -1 if nothing is hit)."""
+        model = self._model
+
+        colors = np.zeros((model.ngeom + 1, 3))
+        colors[:-1] = model.geom_rgba[:, :3]
+        for geomid, matid in enumerate(model.geom_matid):
+            # Like the renderer, the material is used unless the geom rgba is set
+            if matid == -1 or not np.allclose(model.geom_rgba[geomid], _DEFAULT_RGBA):
+                continue
+
+            color = model.mat_rgba[matid, :3].copy()
+            texid = model.mat_texid[matid, mj.mjtTextureRole.mjTEXROLE_RGB]
+            if texid != -1:
+                adr, nchannel = model.tex_adr[texid], model.tex_nchannel[texid]
+                size = model.tex_width[texid] * model.tex_height[texid] * nchannel
+                texels = model.tex_data[adr : adr + size].reshape(-1, nchannel)
+                color *= texels[:, :3].mean(axis=0) / 255.0
+            colors[geomid] = color
+
+        if self._config.use_uint8_obs:
+            return (colors * 255.0).round().astype(np.uint8)
+        return colors.astype(np.float32)
+
+    def reset(self, model: mj.MjModel, data: mj.MjData):
+        """Sets up the camera and the geom colors for the raycasting."""
+        self._model = model
+        self._data = data
+
+        self._fixedcamid = get_camera_id(model, self._name)
+        assert self._fixedcamid != -1, f"Camera '{self._name}' not found."
+
+        self._colors = self._calculate_colors()
+        self._far = model.vis.map.zfar * model.stat.extent
+
+        self._prev_obs = self._create_obs_buffer()
+
+        return self.step()
+
+    def step(self) -> np.ndarray:
+        """Casts the rays and sets the last observation."""
+        rgb, _ = self._raycast()
+        return super().step(rgb)
+
+    def _raycast(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Casts a ray through each pixel from the current camera pose.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The rgb image of shape (W, H, 3) and the
+                depth of shape (W, H). Pixels which don't hit anything are at the far
+                plane of the renderer.
+        """
+        pos = self._data.cam_xpos[self._fixedcamid]
+        mat = self._data.cam_xmat[self._fixedcamid].reshape(3, 3)
+        vec = self._rays @ mat.T
+
+        mj.mj_multiRay(
+            m=self._model,
+            d=self._data,
+            pnt=pos,
+            vec=vec.reshape(-1),
+            geomgroup=self._geomgroup,
+            flg_static=1,
+            bodyexclude=-1,
+            geomid=self._geomid,
+            dist=self._dist,
+            nray=len(vec),
+            cutoff=self._far,
+            **self._multiray_kwargs,
+        )
+
+        shape = self._config.resolution
+        rgb = self._colors[self._geomid].reshape(*shape, 3)
+        depth = np.where(self._geomid == -1, self._far, self._dist).reshape(shape)
+        return rgb, depth
@@ -3,6 +3,7 @@
 from typing import Dict, List
 
 import gymnasium as gym
+import numpy as np
 import torch
 from gymnasium import spaces
 from stable_baselines3.common.torch_layers import (
@@ -21,12 +22,12 @@ def is_image_space(
     normalized_image: bool = False,
 ) -> bool:
     """This is an extension of the sb3 is_image_space to support both regular images
-    (HxWxC) and images with an additional dimension (NxHxWxC)."""
+    (HxWxC) and images with additional dimensions (NxHxWxC or TxNxHxWxC)."""
     from stable_baselines3.common.preprocessing import (
         is_image_space as sb3_is_image_space,
     )
 
-    return len(observation_space.shape) == 4 or sb3_is_image_space(
+    return len(observation_space.shape) in [4, 5] or sb3_is_image_space(
         observation_space, normalized_image=normalized_image
     )
 
@@ -34,8 +35,18 @@ def is_image_space(
 def maybe_transpose_space(observation_space: spaces.Box) -> spaces.Box:
     """This is an extension of the sb3 maybe_transpose_space to support both regular
     images (HxWxC) and images with an additional dimension (NxHxWxC). sb3 will call
-    maybe_transpose_space on the 3D case, but not the 4D."""
+    maybe_transpose_space on the 3D case, but not the 4D.
 
+    Stacked images with two additional dimensions (TxNxHxWxC), i.e. frame stacking of
+    the stacked observations of a multi-eye, are folded into a single dimension of
+    T * N images."""
+
+    if len(observation_space.shape) == 5:
+        observation_space = spaces.Box(
+            low=observation_space.low.reshape(-1, *observation_space.shape[2:]),
+            high=observation_space.high.reshape(-1, *observation_space.shape[2:]),
+            dtype=observation_space.dtype,
+        )
     if len(observation_space.shape) == 4:
         num, height, width, channels = observation_space.shape
         new_shape = (num, channels, height, width)
@@ -53,9 +64,13 @@ def maybe_transpose_obs(observation: torch.Tensor) -> torch.Tensor:
     maybe_transpose_obs on the 3D case, but not the 4D.
 
     Note:
-        In this case, there is a batch dimension, so the observation is 5D.
+        In this case, there is a batch dimension, so the observation is 5D. Stacked
+        images with two additional dimensions (6D) are folded like in
+        `maybe_transpose_space`.
     """
 
+    if len(observation.shape) == 6:
+        observation = observation.flatten(1, 2)
     if len(observation.shape) == 5:
         observation = observation.permute(0, 1, 4, 2, 3)
 
@@ -98,9 +113,26 @@ class MjCambrianCombinedExtractor(BaseFeaturesExtractor):
 
         extractors: Dict[str, BaseFeaturesExtractor] = {}
 
+        # Supported uint8 image shapes (i.e. `use_uint8_obs`):
+        # - (H, W, C): sb3 wraps the env in a VecTransposeImage, so the space is
+        #   channels first here, and normalizes the images itself.
+        # - (N, W, H, C): stacked images (e.g. multi-eye arenas or frame stacking).
+        #   sb3 only normalizes 3D images, so these are normalized in forward.
+        # - (T, N, W, H, C): frame stacking of the stacked multi-eye images. These
+        #   are folded into (T * N, W, H, C) and normalized in forward.
+        self._uint8_keys: List[str] = []
+
         total_concat_size = 0
         for key, subspace in observation_space.spaces.items():
+            if subspace.dtype == np.uint8 and len(subspace.shape) > 2:
+                assert len(subspace.shape) in [3, 4, 5], (
+                    f"Unsupported uint8 image shape {subspace.shape} for '{key}'. "
+                    "Only (H, W, C), (N, W, H, C) and (T, N, W, H, C) images are "
+                    "supported."
+                )
             if is_image_space(subspace, normalized_image=normalized_image):
+                if len(subspace.shape) in [4, 5] and subspace.dtype == np.uint8:
+                    self._uint8_keys.append(key)
                 subspace = maybe_transpose_space(subspace)
                 if share_image_extractor:
                     extractors[key] = self._image_extractor
@@ -120,6 +152,8 @@ class MjCambrianCombinedExtractor(BaseFeaturesExtractor):
         encoded_tensor_list = []
         for key, extractor in self.extractors.items():
             observation = maybe_transpose_obs(observations[key])
+            if key in self._uint8_keys:
+                observation = observation / 255.0
             encoded_tensor_list.append(extractor(observation))
 
         features = torch.cat(encoded_tensor_list, dim=1)
@@ -135,7 +169,12 @@ class PermutedFlattenExtractor(FlattenExtractor):
 
 class MjCambrianImageFeaturesExtractor(BaseFeaturesExtractor):
     """This is a feature extractor for images. Will implement an image queue for
-    temporal features. Should be inherited by other classes."""
+    temporal features. Should be inherited by other classes.
+
+    The observations are (B, N, C, H, W), where N is either the temporal queue, the
+    eyes of a multi-eye with `use_stacked_obs` or both (see `maybe_transpose_space`).
+    The N images are encoded in one batched call and then combined by
+    `temporal_linear`."""
 
     def __init__(
         self,
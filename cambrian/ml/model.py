@@ -9,18 +9,215 @@ import pickle
 from pathlib import Path
 from typing import Any, Dict, List
 
+import numpy as np
 import torch
+from gymnasium import spaces
 from stable_baselines3 import PPO
+from stable_baselines3.common.buffers import DictRolloutBuffer, RolloutBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.utils import obs_as_tensor
+from stable_baselines3.common.vec_env import (
+    VecEnv,
+    VecEnvWrapper,
+    VecTransposeImage,
+)
 
+from cambrian.ml.vec_env import MjCambrianAsyncVecEnv, MjCambrianVecMonitor
 from cambrian.utils.logger import get_logger
 
 
+class MjCambrianDictRolloutBuffer(DictRolloutBuffer):
+    """Overwrite of the sb3 dict rollout buffer which stores each observation with
+    the dtype of its observation space. sb3 stores all the observations as float32,
+    which would undo the memory savings of uint8 image observations."""
+
+    def reset(self) -> None:
+        super().reset()
+
+        for key, subspace in self.observation_space.spaces.items():
+            observations = self.observations[key]
+            if observations.dtype != subspace.dtype:
+                self.observations[key] = np.zeros_like(observations, subspace.dtype)
+
+
 class MjCambrianModel(PPO):
     def __init__(self, *args, **kwargs):
+        # The observations are only stored with their own dtype for dict spaces. Other
+        # spaces use the default sb3 buffers.
+        env = kwargs.get("env", args[1] if len(args) > 1 else None)
+        if isinstance(getattr(env, "observation_space", None), spaces.Dict):
+            kwargs.setdefault("rollout_buffer_class", MjCambrianDictRolloutBuffer)
         super().__init__(*args, **kwargs)
 
         self._rollout: List[Dict[str, Any]] = None
 
+    def collect_rollouts(
+        self,
+        env: VecEnv,
+        callback: BaseCallback,
+        rollout_buffer: RolloutBuffer,
+        n_rollout_steps: int,
+    ) -> bool:
+        """Overwrite of the sb3 collect_rollouts to support `MjCambrianAsyncVecEnv`.
+        Other vec envs use the default implementation.
+
+        With an async env, the policy is run on each batch of environments returned by
+        `recv` and the actions are sent back to only those environments. Each
+        environment fills its own column of the rollout buffer, so each column is
+        still a consecutive trajectory and the returns and advantages are computed as
+        usual. Environments which have collected `n_rollout_steps` wait until the
+        others have caught up.
+        """
+        if not isinstance(env.unwrapped, MjCambrianAsyncVecEnv):
+            return super().collect_rollouts(
+                env, callback, rollout_buffer, n_rollout_steps
+            )
+
+        assert self._last_obs is not None, "No previous observation was provided"
+        assert not self.use_sde, "gSDE isn't supported with async envs."
+
+        # send/recv are forwarded to the async env past the wrappers, so only the
+        # wrappers which are handled here are supported. The monitor implements
+        # send/recv itself and the image transposes (inserted by sb3 for uint8 images)
+        # are applied to the received observations.
+        async_env: MjCambrianAsyncVecEnv | MjCambrianVecMonitor = env.unwrapped
+        transposes: List[VecTransposeImage] = []
+        wrapper = env
+        while isinstance(wrapper, VecEnvWrapper):
+            assert isinstance(
+                wrapper, (MjCambrianVecMonitor, VecTransposeImage)
+            ), f"{type(wrapper).__name__} doesn't support the async send/recv api."
+            if isinstance(wrapper, VecTransposeImage):
+                transposes.append(wrapper)
+            elif async_env is env.unwrapped:
+                async_env = wrapper
+            wrapper = wrapper.venv
+        assert env.unwrapped.num_pending == 0, "Envs are still stepping."
+
+        # Switch to eval mode (this affects batch norm / dropout)
+        self.policy.set_training_mode(False)
+
+        rollout_buffer.reset()
+        callback.on_rollout_start()
+
+        def index(x: Dict[str, np.ndarray] | np.ndarray, idx: Any):
+            if isinstance(x, dict):
+                return {key: value[idx] for key, value in x.items()}
+            return x[idx]
+
+        def assign(x: Dict[str, np.ndarray] | np.ndarray, idx: Any, value: Any):
+            if isinstance(x, dict):
+                for key in x:
+                    x[key][idx] = value[key]
+            else:
+                x[idx] = value
+
+        # The position of each env in the rollout buffer
+        positions = np.zeros(env.num_envs, dtype=int)
+        # The received steps which the callback hasn't seen yet. The callback is
+        # called once per num_envs received steps, like once per step of a
+        # synchronous vec env, such that e.g. the step counting callbacks behave the
+        # same.
+        step_infos: List[Dict] = []
+        step_dones = np.zeros(0, dtype=bool)
+        env_ids = np.arange(env.num_envs)
+        while True:
+            # Step the envs which were returned and still need steps
+            env_ids = env_ids[positions[env_ids] < n_rollout_steps]
+            if len(env_ids) > 0:
+                obs = index(self._last_obs, env_ids)
+                with torch.no_grad():
+                    obs_tensor = obs_as_tensor(obs, self.device)
+                    actions, values, log_probs = self.policy(obs_tensor)
+                actions = actions.cpu().numpy()
+
+                clipped_actions = actions
+                if isinstance(self.action_space, spaces.Box):
+                    if self.policy.squash_output:
+                        clipped_actions = self.policy.unscale_action(clipped_actions)
+                    else:
+                        clipped_actions = np.clip(
+                            actions, self.action_space.low, self.action_space.high
+                        )
+                async_env.send(clipped_actions, env_ids)
+
+                # Everything but the rewards is known before the step
+                idx = (positions[env_ids], env_ids)
+                assign(rollout_buffer.observations, idx, obs)
+                rollout_buffer.actions[idx] = actions.reshape(len(env_ids), -1)
+                rollout_buffer.episode_starts[idx] = self._last_episode_starts[env_ids]
+                rollout_buffer.values[idx] = values.cpu().numpy().flatten()
+                rollout_buffer.log_probs[idx] = log_probs.cpu().numpy()
+
+            if env.unwrapped.num_pending == 0:
+                break
+
+            new_obs, rewards, dones, infos, env_ids = async_env.recv()
+            for transpose in reversed(transposes):
+                new_obs = transpose.transpose_observations(new_obs)
+                for info in infos:
+                    if "terminal_observation" in info:
+                        terminal_obs = info["terminal_observation"]
+                        terminal_obs = transpose.transpose_observations(terminal_obs)
+                        info["terminal_observation"] = terminal_obs
+
+            step_infos.extend(infos)
+            step_dones = np.concatenate([step_dones, dones])
+            while len(step_infos) >= env.num_envs:
+                self.num_timesteps += env.num_envs
+
+                # Give access to local variables, with the infos and dones of the
+                # full step
+                callback.update_locals(
+                    {
+                        **locals(),
+                        "infos": step_infos[: env.num_envs],
+                        "dones": step_dones[: env.num_envs],
+                    }
+                )
+                if not callback.on_step():
+                    return False
+
+                step_infos = step_infos[env.num_envs :]
+                step_dones = step_dones[env.num_envs :]
+
+            self._update_info_buffer(infos, dones)
+
+            # Handle timeout by bootstrapping with value function
+            for i, done in enumerate(dones):
+                if (
+                    done
+                    and infos[i].get("terminal_observation") is not None
+                    and infos[i].get("TimeLimit.truncated", False)
+                ):
+                    terminal_obs = infos[i]["terminal_observation"]
+                    terminal_obs = self.policy.obs_to_tensor(terminal_obs)[0]
+                    with torch.no_grad():
+                        terminal_value = self.policy.predict_values(terminal_obs)[0]
+                    rewards[i] += self.gamma * terminal_value
+
+            rollout_buffer.rewards[positions[env_ids], env_ids] = rewards
+            positions[env_ids] += 1
+
+            assign(self._last_obs, env_ids, new_obs)
+            self._last_episode_starts[env_ids] = dones
+
+        rollout_buffer.pos = rollout_buffer.buffer_size
+        rollout_buffer.full = True
+
+        with torch.no_grad():
+            # Compute value for the last timestep
+            obs_tensor = obs_as_tensor(self._last_obs, self.device)
+            values = self.policy.predict_values(obs_tensor)
+
+        dones = self._last_episode_starts
+        rollout_buffer.compute_returns_and_advantage(last_values=values, dones=dones)
+
+        callback.update_locals(locals())
+        callback.on_rollout_end()
+
+        return True
+
     def save_policy(self, path: Path | str):
         """Overwrite the save method. Instead of saving the entire state, we'll
         just save the policy weights."""
@@ -1,18 +1,15 @@
 """This module contains the trainer class for training and evaluating agents."""
 
 from pathlib import Path
-from typing import Callable, Concatenate, Dict, Optional, Type
+from typing import Callable, Concatenate, Dict, List, Optional, Type
 
+import gymnasium as gym
 from stable_baselines3.common.callbacks import BaseCallback, CallbackList
-from stable_baselines3.common.vec_env import (
-    DummyVecEnv,
-    SubprocVecEnv,
-    VecEnv,
-    VecMonitor,
-)
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
 
 from cambrian.envs.env import MjCambrianEnv, MjCambrianEnvConfig
 from cambrian.ml.model import MjCambrianModel
+from cambrian.ml.vec_env import MjCambrianVecMonitor
 from cambrian.utils import evaluate_policy
 from cambrian.utils.config.config import (
     MjCambrianBaseConfig,
@@ -36,6 +33,10 @@ class MjCambrianTrainerConfig(MjCambrianBaseConfig):
         callbacks (Dict[str, BaseCallback]): The callbacks to use for training.
         wrappers (Dict[str, Callable[[VecEnv], VecEnv]] | None): The wrappers to use for
             training. If None, will ignore.
+        vec_env (Optional[Callable[[List[Callable[[], gym.Env]]], VecEnv]]): The
+            vectorized environment to use for training when `n_envs` is greater than 1.
+            Called with the functions to create each environment. If None, will use the
+            `SubprocVecEnv`. See `cambrian.ml.vec_env` for alternatives.
 
         prune_fn (Optional[Callable[[MjCambrianConfig], bool]]): The function to use to
             determine if an experiment should be pruned. If None, will ignore. If set,
@@ -55,6 +56,7 @@ class MjCambrianTrainerConfig(MjCambrianBaseConfig):
     model: Type[MjCambrianModel]
     callbacks: Dict[str, BaseCallback | Callable[[VecEnv], BaseCallback]]
     wrappers: Dict[str, Callable[[VecEnv], VecEnv] | None]
+    vec_env: Optional[Callable[[List[Callable[[], gym.Env]]], VecEnv]] = None
 
     prune_fn: Optional[Callable[[Concatenate[MjCambrianConfig, ...]], bool]] = None
     fitness_fn: Callable[Concatenate[MjCambrianConfig, ...], float]
@@ -210,9 +212,14 @@ class MjCambrianTrainer:
             envs.append(wrapped_env)
 
         # Wrap the environments
-        vec_env = DummyVecEnv(envs) if n_envs == 1 else SubprocVecEnv(envs)
+        if n_envs == 1:
+            vec_env = DummyVecEnv(envs)
+        elif self._config.trainer.vec_env is not None:
+            vec_env = self._config.trainer.vec_env(envs)
+        else:
+            vec_env = SubprocVecEnv(envs)
         if monitor is not None:
-            vec_env = VecMonitor(vec_env, str(self._config.expdir / monitor))
+            vec_env = MjCambrianVecMonitor(vec_env, str(self._config.expdir / monitor))
 
         # Do an initial reset
         vec_env.reset()
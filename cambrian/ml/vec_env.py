@@ -0,0 +1,478 @@
+"""This module defines vectorized environments for the `MjCambrianEnv`. These are
+drop-in replacements for the stable_baselines3 vec envs and can be selected with the
+`vec_env` attribute of the trainer config."""
+
+import multiprocessing as mp
+import multiprocessing.connection
+import queue
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import gymnasium as gym
+import numpy as np
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import (
+    DummyVecEnv,
+    SubprocVecEnv,
+    VecEnv,
+    VecMonitor,
+)
+from stable_baselines3.common.vec_env.base_vec_env import (
+    CloudpickleWrapper,
+    VecEnvObs,
+    VecEnvStepReturn,
+)
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
+from stable_baselines3.common.vec_env.util import dict_to_obs, obs_space_info
+
+from cambrian.envs.env import MjCambrianEnv
+
+
+class MjCambrianThreadedVecEnv(DummyVecEnv):
+    """A vectorized environment which holds all the environments in this process and
+    steps them concurrently in a thread pool. MuJoCo releases the GIL in `mj_step`, so
+    the physics of the environments runs in parallel. The observations are written
+    directly into the batched observation buffers of the `DummyVecEnv`.
+
+    Rendering must happen on the thread which owns the GL contexts (i.e. this one), so
+    the agent stepping of each environment is dispatched back to this thread (see
+    `MjCambrianEnv.render_dispatcher`) and runs serially while the physics of the other
+    environments continues in the pool. Resets are also run on this thread.
+
+    Compared to the `SubprocVecEnv`, there is no observation IPC and only one process,
+    and with `share_model` set in the env config, a single model is shared by all the
+    environments. NOTE: the environments share the global numpy random state, so
+    the per-environment seeds don't give reproducible rollouts.
+
+    Args:
+        env_fns (List[Callable[[], gym.Env]]): The functions to create the
+            environments. Each must wrap a `MjCambrianEnv`.
+
+    Keyword Args:
+        num_threads (Optional[int]): The number of worker threads. If None, uses one
+            thread per environment.
+    """
+
+    def __init__(
+        self,
+        env_fns: List[Callable[[], gym.Env]],
+        *,
+        num_threads: Optional[int] = None,
+    ):
+        super().__init__(env_fns)
+
+        self._pool = ThreadPoolExecutor(max_workers=num_threads or self.num_envs)
+
+        # Functions dispatched by the workers to this thread. A None item indicates
+        # that a worker has finished stepping its environment.
+        self._dispatch_queue: queue.Queue[Optional[Tuple[Callable, Future]]] = (
+            queue.Queue()
+        )
+
+        for env in self.envs:
+            cambrian_env: MjCambrianEnv = env.unwrapped
+            assert isinstance(
+                cambrian_env, MjCambrianEnv
+            ), f"The environments must wrap a MjCambrianEnv, got {type(cambrian_env)}."
+            cambrian_env.render_dispatcher = self._dispatch
+
+    def _dispatch(self, fn: Callable[[], Any]) -> Any:
+        """Runs `fn` on the main thread and waits for the result. Called from the
+        worker threads."""
+        future = Future()
+        self._dispatch_queue.put((fn, future))
+        return future.result()
+
+    def _step_env(self, env_idx: int) -> Tuple[Any, float, bool, bool, dict]:
+        """Steps a single environment. Called from the worker threads."""
+        try:
+            return self.envs[env_idx].step(self.actions[env_idx])
+        finally:
+            self._dispatch_queue.put(None)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        futures = [self._pool.submit(self._step_env, i) for i in range(self.num_envs)]
+
+        # Run the dispatched functions until all the workers have finished
+        num_running = self.num_envs
+        while num_running > 0:
+            item = self._dispatch_queue.get()
+            if item is None:
+                num_running -= 1
+                continue
+
+            fn, future = item
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+
+        for env_idx, future in enumerate(futures):
+            obs, reward, terminated, truncated, info = future.result()
+
+            # Convert to the SB3 VecEnv api (see DummyVecEnv.step_wait)
+            self.buf_rews[env_idx] = reward
+            self.buf_dones[env_idx] = terminated or truncated
+            self.buf_infos[env_idx] = info
+            info["TimeLimit.truncated"] = truncated and not terminated
+
+            if self.buf_dones[env_idx]:
+                info["terminal_observation"] = obs
+                obs, self.reset_infos[env_idx] = self.envs[env_idx].reset()
+            self._save_obs(env_idx, obs)
+
+        return (
+            self._obs_from_buf(),
+            np.copy(self.buf_rews),
+            np.copy(self.buf_dones),
+            deepcopy(self.buf_infos),
+        )
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        super().close()
+
+
+# ==================
+
+
+def _create_shared_obs_buffers(
+    observation_space: gym.Space, num_envs: int, shm: Optional[SharedMemory] = None
+) -> Tuple[Dict[Any, np.ndarray], int]:
+    """Lays out the batched observation buffers in a shared memory block. Each key of
+    the observation space gets a contiguous (num_envs, *shape) array, one after the
+    other and aligned to 64 bytes.
+
+    Args:
+        observation_space (gym.Space): The observation space of a single env.
+        num_envs (int): The number of environments.
+        shm (Optional[SharedMemory]): The shared memory block. If None, only the
+            required size is computed.
+
+    Returns:
+        Tuple[Dict[Any, np.ndarray], int]: The buffers, keyed like
+            `obs_space_info` (empty if `shm` is None), and the size of the block in
+            bytes.
+    """
+    keys, shapes, dtypes = obs_space_info(observation_space)
+
+    buffers: Dict[Any, np.ndarray] = {}
+    offset = 0
+    for key in keys:
+        shape, dtype = (num_envs, *shapes[key]), np.dtype(dtypes[key])
+        if shm is not None:
+            buffers[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        offset += -(-nbytes // 64) * 64
+
+    return buffers, max(offset, 1)
+
+
+def _shared_memory_worker(
+    remote: mp.connection.Connection,
+    parent_remote: mp.connection.Connection,
+    env_fn_wrapper: CloudpickleWrapper,
+    env_idx: int,
+):
+    """The worker of the `MjCambrianSharedMemoryVecEnv`. Like the `SubprocVecEnv`
+    worker, but the observations of steps and resets are written into the shared
+    memory block (once attached) instead of being sent through the pipe."""
+    parent_remote.close()
+    env = _patch_env(env_fn_wrapper.var())
+
+    shm: SharedMemory = None
+    buffers: Dict[Any, np.ndarray] = {}
+
+    def write_obs(obs: Any):
+        if None in buffers:
+            buffers[None][env_idx] = obs
+        else:
+            for key, buffer in buffers.items():
+                buffer[env_idx] = obs[key]
+
+    reset_info: Dict[str, Any] = {}
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                obs, reward, terminated, truncated, info = env.step(data)
+                done = terminated or truncated
+                info["TimeLimit.truncated"] = truncated and not terminated
+                if done:
+                    # The terminal observation is only sent on done, which is rare
+                    info["terminal_observation"] = obs
+                    obs, reset_info = env.reset()
+                write_obs(obs)
+                remote.send((reward, done, info, reset_info))
+            elif cmd == "reset":
+                options = {"options": data[1]} if data[1] else {}
+                obs, reset_info = env.reset(seed=data[0], **options)
+                write_obs(obs)
+                remote.send(reset_info)
+            elif cmd == "attach":
+                shm_name, num_envs = data
+                shm = SharedMemory(name=shm_name)
+                buffers, _ = _create_shared_obs_buffers(
+                    env.observation_space, num_envs, shm
+                )
+                remote.send(None)
+            elif cmd == "render":
+                remote.send(env.render())
+            elif cmd == "close":
+                buffers.clear()
+                if shm is not None:
+                    shm.close()
+                env.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((env.observation_space, env.action_space))
+            elif cmd == "env_method":
+                method = env.get_wrapper_attr(data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(env.get_wrapper_attr(data))
+            elif cmd == "has_attr":
+                try:
+                    env.get_wrapper_attr(data)
+                    remote.send(True)
+                except AttributeError:
+                    remote.send(False)
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except (EOFError, KeyboardInterrupt):
+            break
+
+
+class MjCambrianSharedMemoryVecEnv(SubprocVecEnv):
+    """A `SubprocVecEnv` where the workers write their observations into a shared
+    memory block laid out from the observation space, so only the rewards, dones and
+    infos are pickled and sent through the pipes. For agents with many eyes, the
+    observations are by far the largest part of the IPC.
+
+    The returned observations are copies of the shared buffers, since the buffers are
+    overwritten by the next step while SB3 still holds the previous observations.
+
+    Args:
+        env_fns (List[Callable[[], gym.Env]]): The functions to create the
+            environments.
+
+    Keyword Args:
+        start_method (Optional[str]): The multiprocessing start method. See
+            `SubprocVecEnv`.
+    """
+
+    def __init__(
+        self,
+        env_fns: List[Callable[[], gym.Env]],
+        *,
+        start_method: Optional[str] = None,
+    ):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        if start_method is None:
+            forkserver_available = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = mp.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for env_idx, (work_remote, remote, env_fn) in enumerate(
+            zip(self.work_remotes, self.remotes, env_fns)
+        ):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), env_idx)
+            process = ctx.Process(target=_shared_memory_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+        # Allocate the shared observation buffers and attach the workers to them
+        _, size = _create_shared_obs_buffers(observation_space, n_envs)
+        self._shm = SharedMemory(create=True, size=size)
+        self._buffers, _ = _create_shared_obs_buffers(
+            observation_space, n_envs, self._shm
+        )
+        for remote in self.remotes:
+            remote.send(("attach", (self._shm.name, n_envs)))
+        for remote in self.remotes:
+            remote.recv()
+
+    def _obs_from_buffers(self) -> VecEnvObs:
+        obs = {key: buffer.copy() for key, buffer in self._buffers.items()}
+        return dict_to_obs(self.observation_space, obs)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        rewards, dones, infos, reset_infos = zip(*results)
+        self.reset_infos = list(reset_infos)
+        return self._obs_from_buffers(), np.stack(rewards), np.stack(dones), infos
+
+    def reset(self) -> VecEnvObs:
+        for env_idx, remote in enumerate(self.remotes):
+            remote.send(("reset", (self._seeds[env_idx], self._options[env_idx])))
+        self.reset_infos = [remote.recv() for remote in self.remotes]
+
+        # Seeds and options are only used once
+        self._reset_seeds()
+        self._reset_options()
+        return self._obs_from_buffers()
+
+    def close(self):
+        if self.closed:
+            return
+
+        super().close()
+        self._buffers.clear()
+        self._shm.close()
+        self._shm.unlink()
+
+
+class MjCambrianAsyncVecEnv(MjCambrianSharedMemoryVecEnv):
+    """An asynchronous vectorized environment, in the style of EnvPool. Actions are
+    sent to a subset of the environments with `send` and `recv` returns the first
+    `batch_size` environments which finished stepping, so the slowest environments
+    (e.g. larger mazes or optics eyes) don't stall the others. `MjCambrianModel`
+    collects its rollouts this way when trained on this env.
+
+    The synchronous `VecEnv` api (`reset`, `step`) is still available, but it can't
+    be mixed with `send`/`recv` while steps are pending.
+
+    Args:
+        env_fns (List[Callable[[], gym.Env]]): The functions to create the
+            environments.
+
+    Keyword Args:
+        batch_size (int): The number of environments returned by `recv`. Must be
+            less than or equal to the number of environments.
+        start_method (Optional[str]): The multiprocessing start method. See
+            `SubprocVecEnv`.
+    """
+
+    def __init__(
+        self,
+        env_fns: List[Callable[[], gym.Env]],
+        *,
+        batch_size: int,
+        start_method: Optional[str] = None,
+    ):
+        super().__init__(env_fns, start_method=start_method)
+
+        assert (
+            0 < batch_size <= self.num_envs
+        ), f"batch_size must be in (0, {self.num_envs}], got {batch_size}."
+        self.batch_size = batch_size
+
+        # Maps the remotes of the environments which are stepping to their env ids
+        self._pending: Dict[mp.connection.Connection, int] = {}
+
+    def send(self, actions: np.ndarray, env_ids: np.ndarray):
+        """Sends the actions to the given environments, which start stepping.
+
+        Args:
+            actions (np.ndarray): The actions, one per env id.
+            env_ids (np.ndarray): The ids of the environments to step. None of them
+                may be stepping already.
+        """
+        for action, env_id in zip(actions, env_ids):
+            remote = self.remotes[env_id]
+            assert remote not in self._pending, f"Env {env_id} is already stepping."
+            remote.send(("step", action))
+            self._pending[remote] = int(env_id)
+
+    def recv(self) -> Tuple[VecEnvObs, np.ndarray, np.ndarray, List[Dict], np.ndarray]:
+        """Waits for the first `batch_size` environments to finish stepping (or all the
+        pending environments, if fewer are stepping).
+
+        Returns:
+            Tuple[VecEnvObs, np.ndarray, np.ndarray, List[Dict], np.ndarray]: The
+                observations, rewards, dones and infos of the returned environments,
+                like `step_wait`, and their env ids.
+        """
+        assert self._pending, "No environments are stepping, call send first."
+
+        batch_size = min(self.batch_size, len(self._pending))
+        ready: List[mp.connection.Connection] = []
+        while len(ready) < batch_size:
+            waiting = [remote for remote in self._pending if remote not in ready]
+            ready.extend(mp.connection.wait(waiting))
+        ready = ready[:batch_size]
+
+        results = [remote.recv() for remote in ready]
+        env_ids = np.array([self._pending.pop(remote) for remote in ready])
+        rewards, dones, infos, reset_infos = zip(*results)
+        for env_id, reset_info in zip(env_ids, reset_infos):
+            self.reset_infos[env_id] = reset_info
+
+        obs = {key: buffer[env_ids] for key, buffer in self._buffers.items()}
+        obs = dict_to_obs(self.observation_space, obs)
+        return obs, np.stack(rewards), np.stack(dones), list(infos), env_ids
+
+    @property
+    def num_pending(self) -> int:
+        """Returns the number of environments which are stepping."""
+        return len(self._pending)
+
+    def step_async(self, actions: np.ndarray):
+        assert not self._pending, "Can't step synchronously while steps are pending."
+        super().step_async(actions)
+
+    def reset(self) -> VecEnvObs:
+        assert not self._pending, "Can't reset while steps are pending."
+        return super().reset()
+
+    def close(self):
+        if self.closed:
+            return
+
+        # Drain the pending steps such that the workers can receive the close command
+        for remote in self._pending:
+            remote.recv()
+        self._pending.clear()
+        super().close()
+
+
+class MjCambrianVecMonitor(VecMonitor):
+    """A `VecMonitor` which also records the episodes of the asynchronous `send` and
+    `recv` api of `MjCambrianAsyncVecEnv`. Behaves like the `VecMonitor` otherwise."""
+
+    def send(self, actions: np.ndarray, env_ids: np.ndarray):
+        self.venv.send(actions, env_ids)
+
+    def recv(self) -> Tuple[VecEnvObs, np.ndarray, np.ndarray, List[Dict], np.ndarray]:
+        obs, rewards, dones, infos, env_ids = self.venv.recv()
+        self.episode_returns[env_ids] += rewards
+        self.episode_lengths[env_ids] += 1
+        for i, env_id in enumerate(env_ids):
+            if not dones[i]:
+                continue
+
+            info = infos[i].copy()
+            episode_info = {
+                "r": self.episode_returns[env_id],
+                "l": self.episode_lengths[env_id],
+                "t": round(time.time() - self.t_start, 6),
+            }
+            for key in self.info_keywords:
+                episode_info[key] = info[key]
+            info["episode"] = episode_info
+            self.episode_count += 1
+            self.episode_returns[env_id] = 0
+            self.episode_lengths[env_id] = 0
+            if self.results_writer:
+                self.results_writer.write_row(episode_info)
+            infos[i] = info
+        return obs, rewards, dones, infos, env_ids
@@ -11,6 +11,7 @@ from cambrian.renderer.render_utils import (  # noqa
     resize_with_aspect_fill,
 )
 from cambrian.renderer.renderer import (  # noqa
+    MjCambrianAtlasRenderer,
     MjCambrianRenderer,
     MjCambrianRendererConfig,
     MjCambrianRendererSaveMode,
@@ -29,6 +30,7 @@ __all__ = [
     "MjCambrianRendererConfig",
     "MjCambrianRendererSaveMode",
     "MjCambrianRenderer",
+    "MjCambrianAtlasRenderer",
     "resize_with_aspect_fill",
     "convert_depth_distances",
 ]
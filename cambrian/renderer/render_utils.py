@@ -1,11 +1,10 @@
 """Rendering utilities."""
 
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 
 import cv2
 import mujoco as mj
 import numpy as np
-from scipy.spatial.transform import Rotation as R
 
 
 def resize_with_aspect_fill(
@@ -153,95 +152,146 @@ def generate_composite(
 
     return composite
 
-def project_images_to_spherical_panorama(
-    images: List[np.ndarray],
+
+def compute_spherical_panorama_lut(
+    image_resolution: Tuple[int, int],
     yaw_angles: List[float],
     fov_x: float,
     fov_y: float,
     total_resolution: Tuple[int, int],
-) -> np.ndarray:
-    """
-    Projects multiple camera images onto a spherical surface to create a panorama.
+    *,
+    lon_range: Tuple[float, float] = (-180.0, 180.0),
+    lat_range: Tuple[float, float] = (-90.0, 90.0),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Precomputes the lookup table used to project camera images onto a spherical
+    (equirectangular) panorama. The cameras, their fov and the resolutions are fixed,
+    so this only needs to be computed once.
+
+    For each panorama pixel, the camera which sees it most head-on is selected (the
+    source index) and the pixel is projected into that camera's image (map x/y). These
+    are folded into the flat indices of the four bilinear taps into the stacked images
+    and their weights, such that the projection is a single gather. See
+    `project_images_to_spherical_panorama`.
+
+    The images and the panorama are W x H x C, like the renderer output. The panorama
+    x increases with decreasing longitude (i.e. left to right) and y increases with
+    decreasing latitude (i.e. top to bottom). A camera with a yaw of 0 looks along
+    the +x axis, with +y to its left and +z up.
 
     Args:
-        images: List of images from the cameras.
-        yaw_angles: List of yaw angles (in degrees) corresponding to each camera image.
+        image_resolution: Resolution (width, height) of each camera image.
+        yaw_angles: List of yaw angles (in degrees) of each camera.
         fov_x: Horizontal field of view of each camera in degrees.
         fov_y: Vertical field of view of each camera in degrees.
         total_resolution: Resolution (width, height) of the resulting panorama.
 
+    Keyword Args:
+        lon_range: The (min, max) longitude of the panorama in degrees.
+        lat_range: The (min, max) latitude of the panorama in degrees.
+
     Returns:
-        The spherical panorama image as a NumPy array.
+        Tuple[np.ndarray, np.ndarray]: The flat indices into the stacked images and
+            the weights of the bilinear taps, both of shape (width, height, 4).
+            Panorama pixels which aren't seen by any camera have zero weights.
     """
+    width, height = image_resolution
     total_width, total_height = total_resolution
 
-    # Convert yaw angles to radians
-    yaw_angles_rad = [np.deg2rad(yaw) for yaw in yaw_angles]
-
-    # Create an empty panorama image
-    panorama = np.zeros((total_width, total_height, 3), dtype=np.uint8)
-
-    # Create meshgrid for panorama image
-    phi = np.linspace(-np.pi, np.pi, total_width)
-    theta = np.linspace(-np.pi / 2, np.pi / 2, total_height)
-    phi, theta = np.meshgrid(phi, theta)
-
-    # Compute the direction vectors for each pixel in the panorama
-    x = np.cos(theta) * np.cos(phi)
-    y = np.cos(theta) * np.sin(phi)
-    z = np.sin(theta)
-
-    dirs = np.stack((x, y, z), axis=-1)  # Shape: (H, W, 3)
-
-    # Flatten the directions for easier processing
-    dirs_flat = dirs.reshape(-1, 3)  # Shape: (H*W, 3)
-
-    # Initialize an array to keep track of which pixels have been filled
-    filled_mask = np.zeros((total_width, total_height), dtype=bool)
-
-    for idx, (image, yaw) in enumerate(zip(images, yaw_angles_rad)):
-        h, w, _ = image.shape
+    # The direction of each panorama pixel (at the pixel centers)
+    (min_lon, max_lon), (min_lat, max_lat) = lon_range, lat_range
+    lon = np.deg2rad(max_lon - (max_lon - min_lon) * _centers(total_width))
+    lat = np.deg2rad(max_lat - (max_lat - min_lat) * _centers(total_height))
+    lon, lat = np.meshgrid(lon, lat, indexing="ij")
+    dirs = np.stack(
+        (np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=-1
+    )
 
-        # Rotate the direction vectors to align with the camera orientation
-        rot = R.from_euler('y', 0) * R.from_euler('z', -yaw)
-        dirs_cam = rot.apply(dirs_flat)
+    # Project the directions into each camera. The camera looks along forward with
+    # right and up spanning the image plane.
+    yaws = np.deg2rad(yaw_angles)
+    forward = np.stack((np.cos(yaws), np.sin(yaws), np.zeros_like(yaws)), axis=-1)
+    right = np.stack((np.sin(yaws), -np.cos(yaws), np.zeros_like(yaws)), axis=-1)
+    z = dirs @ forward.T  # (W, H, N)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (dirs @ right.T) / z / np.tan(np.deg2rad(fov_x) / 2)
+        y = dirs[..., 2:] / z / np.tan(np.deg2rad(fov_y) / 2)
+    visible = (z > 0) & (np.abs(x) <= 1) & (np.abs(y) <= 1)
+
+    # Select the camera which sees the pixel most head-on
+    source_index = np.argmax(np.where(visible, z, -np.inf), axis=-1)
+    visible = np.take_along_axis(visible, source_index[..., None], -1)[..., 0]
+    x = np.take_along_axis(x, source_index[..., None], -1)[..., 0]
+    y = np.take_along_axis(y, source_index[..., None], -1)[..., 0]
+
+    # Continuous pixel coordinates in the source image, clamped to the pixel centers
+    map_x = np.clip((x + 1) / 2 * width - 0.5, 0, width - 1)
+    map_y = np.clip((1 - y) / 2 * height - 0.5, 0, height - 1)
+    map_x[~visible], map_y[~visible] = 0, 0
+
+    # The four bilinear taps and their weights
+    x0, y0 = np.floor(map_x).astype(int), np.floor(map_y).astype(int)
+    x1, y1 = np.minimum(x0 + 1, width - 1), np.minimum(y0 + 1, height - 1)
+    wx, wy = map_x - x0, map_y - y0
+    offset = source_index * width * height
+    indices = np.stack(
+        (
+            offset + x0 * height + y0,
+            offset + x1 * height + y0,
+            offset + x0 * height + y1,
+            offset + x1 * height + y1,
+        ),
+        axis=-1,
+    )
+    weights = np.stack(
+        ((1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy), axis=-1
+    )
+    weights[~visible] = 0
+    return indices, weights.astype(np.float32)
 
-        # Field of view in radians
-        fov_x_rad = np.deg2rad(fov_x)
-        fov_y_rad = np.deg2rad(fov_y)
 
-        # Compute the angles in the camera coordinate system
-        phi_cam = np.arctan2(dirs_cam[:, 1], dirs_cam[:, 0])
-        theta_cam = np.arcsin(dirs_cam[:, 2] / np.linalg.norm(dirs_cam, axis=1))
+def _centers(n: int) -> np.ndarray:
+    """Returns the normalized centers of n pixels in [0, 1]."""
+    return (np.arange(n) + 0.5) / n
 
-        # Mask for pixels within the camera's field of view
-        fov_mask = (
-            (phi_cam >= -fov_x_rad / 2) & (phi_cam <= fov_x_rad / 2) &
-            (theta_cam >= -fov_y_rad / 2) & (theta_cam <= fov_y_rad / 2)
-        )
 
-        # Map the spherical coordinates to pixel coordinates in the camera image
-        x_cam = ((phi_cam[fov_mask] + fov_x_rad / 2) / fov_x_rad) * (w - 1)
-        y_cam = ((theta_cam[fov_mask] + fov_y_rad / 2) / fov_y_rad) * (h - 1)
+def project_images_to_spherical_panorama(
+    images: List[np.ndarray] | np.ndarray,
+    yaw_angles: List[float],
+    fov_x: float,
+    fov_y: float,
+    total_resolution: Tuple[int, int],
+    *,
+    lut: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> np.ndarray:
+    """
+    Projects multiple camera images onto a spherical surface to create a panorama.
 
-        # Panorama coordinates corresponding to these directions
-        pano_coords = np.argwhere(fov_mask.reshape(total_width, total_height))
+    Args:
+        images: List of images from the cameras, each W x H x C. If an array of
+            shape (N, W, H, C) is passed, it isn't copied.
+        yaw_angles: List of yaw angles (in degrees) corresponding to each camera image.
+        fov_x: Horizontal field of view of each camera in degrees.
+        fov_y: Vertical field of view of each camera in degrees.
+        total_resolution: Resolution (width, height) of the resulting panorama.
 
-        # Sample the camera image at the computed coordinates
-        x_cam = x_cam.astype(np.float32)
-        y_cam = y_cam.astype(np.float32)
+    Keyword Args:
+        lut: The lookup table from `compute_spherical_panorama_lut`. If None, it's
+            computed for the full sphere, which is slow; callers which project
+            repeatedly should precompute it.
 
-        sampled_pixels = cv2.remap(
-            image,
-            x_cam.reshape(-1, 1),
-            y_cam.reshape(-1, 1),
-            interpolation=cv2.INTER_LINEAR,
-            borderMode=cv2.BORDER_CONSTANT,
-            borderValue=0
+    Returns:
+        The spherical panorama image as a NumPy array.
+    """
+    images = np.asarray(images)
+    if lut is None:
+        lut = compute_spherical_panorama_lut(
+            images.shape[1:3], yaw_angles, fov_x, fov_y, total_resolution
         )
-
-        # Place the sampled pixels into the panorama
-        panorama[pano_coords[:, 0], pano_coords[:, 1]] = sampled_pixels.reshape(-1, 3)
-        filled_mask[pano_coords[:, 0], pano_coords[:, 1]] = True
-
-    return panorama
\ No newline at end of file
+    indices, weights = lut
+
+    # Gather the four taps of every panorama pixel at once and blend them
+    pixels = np.take(images.reshape(-1, images.shape[-1]), indices, axis=0)
+    panorama = np.einsum("whkc,whk->whc", pixels, weights)
+    if np.issubdtype(images.dtype, np.integer):
+        return panorama.round().astype(images.dtype)
+    return panorama.astype(images.dtype, copy=False)
@@ -1,5 +1,7 @@
 """Wrapper around the mujoco viewer for rendering scenes."""
 
+import ctypes
+import math
 from abc import ABC, abstractmethod
 from copy import deepcopy
 from enum import Flag, auto
@@ -62,6 +64,21 @@ class MjCambrianRendererConfig(MjCambrianBaseConfig):
             useful for rendering multiple renderers at the same time. If False, the
             renderer will create its own context. This is computationally expensive if
             there are many renderers.
+        use_shared_scene (bool): Whether to share the scene with other renderers which
+            render the same model and data with the same options. If True, the scene
+            geometry is only updated once per simulation step (keyed on the data
+            timestamp) and each renderer only updates its camera before rendering.
+            Defaults to False.
+        use_uint8 (bool): Whether to return the rgb image as uint8 in [0, 255] rather
+            than float32 in [0, 1]. This skips the float conversion and is 4x smaller,
+            which is useful when the image is passed straight to the policy. Defaults
+            to False.
+        use_async_readback (bool): Whether to read the pixels back asynchronously
+            through double-buffered pixel buffer objects. Only used by offscreen
+            viewers. The readback of a frame is queued on the GPU and only copied out
+            at the next render, so it overlaps with the following renders and physics
+            steps instead of stalling. The returned image therefore lags one render
+            behind. Defaults to False.
 
         save_mode (Optional[MjCambrianRendererSaveMode]): The save modes to use for
             saving the rendered images. See `MjCambrianRenderer.SaveMode` for options.
@@ -80,6 +97,9 @@ class MjCambrianRendererConfig(MjCambrianBaseConfig):
     camera: mj.MjvCamera
 
     use_shared_context: bool
+    use_shared_scene: bool = False
+    use_uint8: bool = False
+    use_async_readback: bool = False
 
     save_mode: Optional[MjCambrianRendererSaveMode] = None
 
@@ -90,6 +110,10 @@ mj.gl_context.GLContext.free = lambda self: None
 GL_CONTEXT: mj.gl_context.GLContext = None
 MJR_CONTEXT: mj.MjrContext = None
 
+# Scenes shared between viewers which set use_shared_scene. Maps the scene key (see
+# MjCambrianViewer._get_scene_key) to the scene and the data time it was updated at.
+SHARED_SCENES: Dict[Tuple, Tuple[mj.MjvScene, float]] = {}
+
 
 class MjCambrianViewer(ABC):
     """The base class for the viewer. This class should not be instantiated directly.
@@ -130,6 +154,11 @@ class MjCambrianViewer(ABC):
 
         self._viewport = mj.MjrRect(0, 0, width, height)
 
+        # The data may have changed without the time advancing, so invalidate the
+        # shared scene
+        if self._config.use_shared_scene:
+            SHARED_SCENES.pop(self._get_scene_key(), None)
+
         # Initialize the buffers
         if self._rgb_uint8.shape[0] != height or self._rgb_uint8.shape[1] != width:
             self._rgb_uint8 = np.empty((height, width, 3), dtype=np.uint8)
@@ -181,6 +210,10 @@ class MjCambrianViewer(ABC):
         # Subclass should override this method such that this is not possible
         assert width == self._viewport.width and height == self._viewport.height
 
+        if self._config.use_shared_scene:
+            self._update_shared_scene()
+            return
+
         mj.mjv_updateScene(
             self._model,
             self._data,
@@ -191,6 +224,48 @@ class MjCambrianViewer(ABC):
             self._scene,
         )
 
+    def _update_shared_scene(self):
+        """Updates the scene shared with the other viewers with the same key. The
+        geometry is only updated if it hasn't been updated yet at the current data
+        time; otherwise, only the camera (and headlight) is updated."""
+        key = self._get_scene_key()
+        scene, time = SHARED_SCENES.get(key, (self._scene, None))
+        if time == self._data.time:
+            mj.mjv_updateCamera(self._model, self._data, self._camera, scene)
+
+            # mjv_updateCamera doesn't move the headlight, which is the first light
+            # and sits at the (stereo averaged) camera
+            if self._model.vis.headlight.active:
+                left, right = scene.camera[0], scene.camera[1]
+                scene.lights[0].pos = (left.pos + right.pos) / 2
+                scene.lights[0].dir = (left.forward + right.forward) / 2
+        else:
+            mj.mjv_updateScene(
+                self._model,
+                self._data,
+                self._scene_options,
+                None,  # mjvPerturb
+                self._camera,
+                mj.mjtCatBit.mjCAT_ALL,
+                scene,
+            )
+            SHARED_SCENES[key] = (scene, self._data.time)
+        self._scene = scene
+
+    def _get_scene_key(self) -> Tuple:
+        """Viewers can only share a scene if they render the same model and data with
+        the same options and render flags."""
+        return (
+            id(self._model),
+            id(self._data),
+            self._scene_options.flags.tobytes(),
+            self._scene_options.geomgroup.tobytes(),
+            self._scene_options.sitegroup.tobytes(),
+            self._scene_options.frame,
+            self._scene_options.label,
+            self._scene.flags.tobytes(),
+        )
+
     def render(self, *, overlays: List[MjCambrianViewerOverlay] = []):
         self.make_context_current()
         self.update(self._viewport.width, self._viewport.height)
@@ -203,9 +278,22 @@ class MjCambrianViewer(ABC):
         for overlay in overlays:
             overlay.draw_after_render(self._mjr_context, self._viewport)
 
-    def read_pixels(self, read_depth: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    def read_pixels(
+        self, read_depth: bool = False, *, out: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Reads the rgb (and depth) image of the viewport as W x H x C.
+
+        Args:
+            read_depth (bool): Whether to read the depth as well.
+
+        Keyword Args:
+            out (Optional[np.ndarray]): If passed, the W x H x 3 rgb image is written
+                directly into it and it's returned instead of the internal buffer.
+                If it's uint8, the raw image is written; otherwise, the image is
+                converted to [0, 1] like the float32 image.
+        """
         rgb_uint8, depth = self._rgb_uint8, self._depth if read_depth else None
-        mj.mjr_readPixels(rgb_uint8, depth, self._viewport, self._mjr_context)
+        self._read_pixels(rgb_uint8, depth)
 
         # Flipud the images
         # NOTE: If you plan to convert to a pytorch tensor, negative indices aren't
@@ -214,17 +302,31 @@ class MjCambrianViewer(ABC):
             depth[::-1, ...] if read_depth else None
         )
 
-        # Convert to float32
-        rgb_float32 = self._rgb_float32
-        np.divide(rgb_uint8, np.array([255.0], np.float32), out=rgb_float32)
+        # Convert to float32, unless the raw uint8 image is requested. The output
+        # buffer is W x H x C, so it's written through its transposed view.
+        if out is not None:
+            rgb = out.transpose(1, 0, 2)
+            if out.dtype == np.uint8:
+                np.copyto(rgb, rgb_uint8)
+            else:
+                np.divide(rgb_uint8, np.array([255.0], np.float32), out=rgb)
+        elif self._config.use_uint8:
+            rgb = rgb_uint8
+        else:
+            rgb = self._rgb_float32
+            np.divide(rgb_uint8, np.array([255.0], np.float32), out=rgb)
 
         # Transpose the rgb/depth to be W x H x C
-        rgb_float32 = rgb_float32.transpose(1, 0, 2)
+        rgb = rgb.transpose(1, 0, 2)
         if read_depth:
             depth = depth.transpose(1, 0)
 
         # Return the flipped images
-        return rgb_float32, depth
+        return rgb, depth
+
+    def _read_pixels(self, rgb: np.ndarray, depth: np.ndarray | None):
+        """Reads the pixels of the viewport into the rgb and depth buffers."""
+        mj.mjr_readPixels(rgb, depth, self._viewport, self._mjr_context)
 
     @abstractmethod
     def make_context_current(self):
@@ -270,7 +372,103 @@ class MjCambrianViewer(ABC):
 
 
 class MjCambrianOffscreenViewer(MjCambrianViewer):
-    """The offscreen viewer for rendering scenes."""
+    """The offscreen viewer for rendering scenes.
+
+    If `use_async_readback` is set, the pixels are read back through two pixel buffer
+    objects (PBOs) which are used alternately. Each read queues the readback of the
+    current frame into one PBO and copies out the previous frame from the other,
+    which has had a whole render (and physics step) to finish transferring.
+    """
+
+    def __init__(self, config: MjCambrianRendererConfig):
+        super().__init__(config)
+
+        self._rgb_pbos: List[int] = []
+        self._depth_pbos: List[int] = []
+        self._pbo_index: int = 0
+        self._pbo_primed: bool = False
+
+    def reset(self, model: mj.MjModel, data: mj.MjData, width: int, height: int):
+        super().reset(model, data, width, height)
+
+        if self._config.use_async_readback:
+            self._initialize_pbos(width, height)
+
+    def _initialize_pbos(self, width: int, height: int):
+        """Allocates the PBOs for the rgb and depth readback. The first read after
+        a reset is synchronous, such that the previous episode never leaks into the
+        observations."""
+        self.make_context_current()
+
+        if self._rgb_pbos:
+            GL.glDeleteBuffers(len(self._rgb_pbos), self._rgb_pbos)
+            GL.glDeleteBuffers(len(self._depth_pbos), self._depth_pbos)
+
+        self._rgb_pbos = list(GL.glGenBuffers(2))
+        self._depth_pbos = list(GL.glGenBuffers(2))
+        for pbo in self._rgb_pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            size = width * height * 3
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, size, None, GL.GL_STREAM_READ)
+        for pbo in self._depth_pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            size = width * height * np.dtype(np.float32).itemsize
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, size, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        self._pbo_index = 0
+        self._pbo_primed = False
+
+    def _read_pixels(self, rgb: np.ndarray, depth: np.ndarray | None):
+        if not self._config.use_async_readback:
+            super()._read_pixels(rgb, depth)
+            return
+
+        ctx, viewport = self._mjr_context, self._viewport
+        x, y, w, h = viewport.left, viewport.bottom, viewport.width, viewport.height
+
+        # Resolve the multisampled framebuffer, like mjr_readPixels does
+        if ctx.offSamples:
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, ctx.offFBO)
+            GL.glBindFramebuffer(GL.GL_DRAW_FRAMEBUFFER, ctx.offFBO_r)
+            mask = GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT
+            rect = (x, y, x + w, y + h)
+            GL.glBlitFramebuffer(*rect, *rect, mask, GL.GL_NEAREST)
+            GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, ctx.offFBO_r)
+
+        # Queue the readback of the current frame. These calls don't block. The depth
+        # is read raw, which matches mjr_readPixels since readDepthMap is ZEROFAR.
+        current = self._pbo_index
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._rgb_pbos[current])
+        GL.glReadPixels(x, y, w, h, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        if depth is not None:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self._depth_pbos[current])
+            pointer = ctypes.c_void_p(0)
+            GL.glReadPixels(x, y, w, h, GL.GL_DEPTH_COMPONENT, GL.GL_FLOAT, pointer)
+
+        # Copy out the previous frame. Right after a reset there's no previous frame,
+        # so wait for the current one instead.
+        previous = 1 - current if self._pbo_primed else current
+        self._copy_pbo(self._rgb_pbos[previous], rgb)
+        if depth is not None:
+            self._copy_pbo(self._depth_pbos[previous], depth)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        # Restore the framebuffer binding set by mjr_setBuffer
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, ctx.offFBO)
+
+        self._pbo_index = 1 - current
+        self._pbo_primed = True
+
+    def _copy_pbo(self, pbo: int, out: np.ndarray):
+        """Copies the contents of the PBO into `out`."""
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        pointer = GL.glMapBufferRange(
+            GL.GL_PIXEL_PACK_BUFFER, 0, out.nbytes, GL.GL_MAP_READ_BIT
+        )
+        ctypes.memmove(out.ctypes.data, pointer, out.nbytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
 
     def get_framebuffer_option(self) -> int:
         return mj.mjtFramebuffer.mjFB_OFFSCREEN.value
@@ -519,6 +717,10 @@ class MjCambrianRenderer:
 
         self._record: bool = False
 
+        # Set by MjCambrianAtlasRenderer if this renderer is rendered in an atlas
+        self._atlas: Optional["MjCambrianAtlasRenderer"] = None
+        self._atlas_index: int = -1
+
     def reset(
         self,
         model: mj.MjModel,
@@ -539,8 +741,31 @@ class MjCambrianRenderer:
         return self.render(resetting=True)
 
     def render(
-        self, *, overlays: List[MjCambrianViewerOverlay] = [], resetting: bool = False
+        self,
+        *,
+        overlays: List[MjCambrianViewerOverlay] = [],
+        resetting: bool = False,
+        out: Optional[np.ndarray] = None,
     ) -> np.ndarray | Tuple[np.ndarray, np.ndarray] | None:
+        """Renders the scene and returns the rgb (and depth) image(s).
+
+        Keyword Args:
+            overlays (List[MjCambrianViewerOverlay]): The overlays to draw.
+            resetting (bool): Whether this render is part of a reset.
+            out (Optional[np.ndarray]): If passed, the W x H x 3 rgb image is written
+                directly into it. See `MjCambrianViewer.read_pixels`.
+        """
+        if self._atlas is not None and not resetting:
+            # The atlas renders all its renderers at once, so just return our view
+            output = self._atlas.get(self._atlas_index)
+            if out is None:
+                return output
+            if isinstance(output, tuple):
+                np.copyto(out, output[0])
+                return out, output[1]
+            np.copyto(out, output)
+            return out
+
         self._viewer.render(overlays=overlays)
 
         if not any(
@@ -549,7 +774,7 @@ class MjCambrianRenderer:
             return
 
         rgb, depth = self._viewer.read_pixels(
-            "depth_array" in self._config.render_modes
+            "depth_array" in self._config.render_modes, out=out
         )
         if self._record and not resetting:
             self._rgb_buffer.append(rgb.copy().transpose(1, 0, 2))
@@ -580,7 +805,9 @@ class MjCambrianRenderer:
         get_logger().info(f"Saving visualizations at {path}...")
 
         path = Path(path)
-        rgb_buffer = (np.array(self._rgb_buffer) * 255.0).astype(np.uint8)
+        rgb_buffer = np.array(self._rgb_buffer)
+        if rgb_buffer.dtype != np.uint8:
+            rgb_buffer = (rgb_buffer * 255.0).astype(np.uint8)
 
         if save_mode & MjCambrianRendererSaveMode.MP4:
             try:
@@ -647,6 +874,140 @@ class MjCambrianRenderer:
         return self.width / self.height
 
 
+class MjCambrianAtlasRenderer:
+    """Renders multiple offscreen renderers in a single pass. The viewports of the
+    renderers are laid out in a grid within one offscreen buffer (the atlas). Each
+    renderer's camera is rendered into its sub-rect and the whole atlas is read back
+    with a single `mjr_readPixels`. The `render` method of each renderer then returns a
+    view of its sub-rect in the atlas.
+
+    The atlas is rendered lazily the first time one of the renderers is rendered
+    after `invalidate` is called. This should be called each time the data changes.
+
+    All the renderers must share the same context (i.e. `use_shared_context`) and must
+    have the same size and render modes.
+
+    Args:
+        renderers (List[MjCambrianRenderer]): The renderers to render in the atlas.
+            They must already have been reset.
+    """
+
+    def __init__(self, renderers: List[MjCambrianRenderer]):
+        self._viewers = [renderer.viewer for renderer in renderers]
+
+        viewer = self._viewers[0]
+        width, height = viewer.width, viewer.height
+        self._mjr_context = viewer._mjr_context
+        self._render_depth = "depth_array" in viewer.config.render_modes
+        self._use_uint8 = viewer.config.use_uint8
+        for renderer in renderers:
+            assert isinstance(
+                renderer.viewer, MjCambrianOffscreenViewer
+            ), "Atlas rendering is only supported for offscreen renderers."
+            assert (
+                renderer.viewer._mjr_context is self._mjr_context
+            ), "All renderers in an atlas must use a shared context."
+            assert (
+                renderer.width == width and renderer.height == height
+            ), "All renderers in an atlas must have the same size."
+            assert list(renderer.config.render_modes) == list(
+                viewer.config.render_modes
+            ), "All renderers in an atlas must have the same render modes."
+            assert (
+                renderer.config.use_uint8 == self._use_uint8
+            ), "All renderers in an atlas must have the same output dtype."
+            assert (
+                not renderer.config.use_async_readback
+            ), "Async readback isn't supported for atlas rendering."
+
+        # Lay out the viewports in a grid
+        ncols = math.ceil(math.sqrt(len(renderers)))
+        nrows = math.ceil(len(renderers) / ncols)
+        self._viewports = [
+            mj.MjrRect((i % ncols) * width, (i // ncols) * height, width, height)
+            for i in range(len(renderers))
+        ]
+        self._viewport = mj.MjrRect(0, 0, ncols * width, nrows * height)
+
+        # Make sure the offscreen buffer can fit the atlas
+        viewer.make_context_current()
+        max_size = GL.glGetIntegerv(GL.GL_MAX_RENDERBUFFER_SIZE)
+        assert max(self._viewport.width, self._viewport.height) <= max_size, (
+            f"Atlas of size {self._viewport.width}x{self._viewport.height} exceeds "
+            f"the max renderbuffer size of {max_size}."
+        )
+        self._fit_offscreen_buffer()
+
+        atlas_shape = (self._viewport.height, self._viewport.width)
+        self._rgb_uint8 = np.empty((*atlas_shape, 3), dtype=np.uint8)
+        self._rgb_float32 = np.empty((*atlas_shape, 3), dtype=np.float32)
+        self._depth = np.empty(atlas_shape, dtype=np.float32)
+
+        self._outputs: List[np.ndarray | Tuple[np.ndarray, np.ndarray]] = []
+        self._is_dirty = True
+
+        for i, renderer in enumerate(renderers):
+            renderer._atlas, renderer._atlas_index = self, i
+
+    def _fit_offscreen_buffer(self):
+        """Grows the offscreen buffer of the shared context such that it fits the
+        atlas. Other offscreen viewers which share the context resize the buffer to
+        their own size when they're updated, so this is checked before each render."""
+        ctx = self._mjr_context
+        if ctx.offWidth < self._viewport.width or ctx.offHeight < self._viewport.height:
+            offwidth = max(ctx.offWidth, self._viewport.width)
+            offheight = max(ctx.offHeight, self._viewport.height)
+            mj.mjr_resizeOffscreen(offwidth, offheight, ctx)
+
+    def invalidate(self):
+        """Marks the atlas as outdated, such that it's re-rendered the next time one
+        of the renderers is rendered."""
+        self._is_dirty = True
+
+    def get(self, index: int) -> np.ndarray | Tuple[np.ndarray, np.ndarray]:
+        """Returns the output of the renderer at the index, rendering the atlas first
+        if it's outdated. The output matches that of `MjCambrianRenderer.render`."""
+        if self._is_dirty:
+            self.render()
+        return self._outputs[index]
+
+    def render(self):
+        """Renders each viewer into its viewport and reads back the whole atlas."""
+        # All the viewers render the same model
+        model = self._viewers[0]._model
+
+        self._viewers[0].make_context_current()
+        self._fit_offscreen_buffer()
+        mj.mjr_setBuffer(self._viewers[0].get_framebuffer_option(), self._mjr_context)
+
+        for viewer, viewport in zip(self._viewers, self._viewports):
+            viewer.update(viewer.width, viewer.height)
+            mj.mjr_render(viewport, viewer._scene, self._mjr_context)
+
+        depth = self._depth if self._render_depth else None
+        mj.mjr_readPixels(self._rgb_uint8, depth, self._viewport, self._mjr_context)
+
+        # Convert to float32 and metric depth once for the whole atlas
+        rgb_atlas = self._rgb_uint8
+        if not self._use_uint8:
+            rgb_atlas = self._rgb_float32
+            np.divide(self._rgb_uint8, np.array([255.0], np.float32), out=rgb_atlas)
+        if self._render_depth:
+            depth = convert_depth_distances(model, depth)
+
+        # Slice out each viewport and flipud/transpose them to be W x H x C
+        self._outputs.clear()
+        for viewport in self._viewports:
+            rows = slice(viewport.bottom, viewport.bottom + viewport.height)
+            cols = slice(viewport.left, viewport.left + viewport.width)
+            rgb = rgb_atlas[rows, cols][::-1].transpose(1, 0, 2)
+            if self._render_depth:
+                rgb = (rgb, depth[rows, cols][::-1].transpose(1, 0))
+            self._outputs.append(rgb)
+
+        self._is_dirty = False
+
+
 if __name__ == "__main__":
     from cambrian.utils.cambrian_xml import MjCambrianXML
     from cambrian.utils.config import MjCambrianConfig, run_hydra
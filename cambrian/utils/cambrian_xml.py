@@ -263,6 +263,49 @@ class MjCambrianXML:
         """Alias for `find(tag, _all=True, **kwargs)`."""
         return self.find(tag, _all=True, **kwargs)
 
+    def get_referenced_files(self) -> List[Path]:
+        """Get the files referenced by the xml through `file` attributes (includes,
+        textures, meshes, etc.), including the ones referenced by included files.
+        Paths are resolved like mujoco does when compiling from a string, i.e. relative
+        to the working directory or to one of the compiler asset directories. Files
+        which can't be found are skipped.
+
+        Returns:
+            List[Path]: The referenced files, in the order they appear in the xml.
+        """
+        # First, collect the included xmls recursively
+        roots: List[ET.Element] = [self._root]
+        files: List[Path] = []
+        for root in roots:
+            for element in root.iter("include"):
+                path = Path(element.get("file", ""))
+                if path.is_file() and path not in files:
+                    files.append(path)
+                    roots.append(ET.parse(path).getroot())
+
+        # Then, resolve the files relative to the compiler asset directories
+        dirs: List[Path] = [Path()]
+        for root in roots:
+            for element in root.iter("compiler"):
+                for attr in ["assetdir", "meshdir", "texturedir"]:
+                    if (asset_dir := element.get(attr)) is not None:
+                        dirs.append(Path(asset_dir))
+
+        for root in roots:
+            for element in root.iter():
+                if element.tag == "include":
+                    continue
+
+                for attr, file in element.attrib.items():
+                    if not attr.startswith("file"):
+                        continue
+
+                    path = next((d / file for d in dirs if (d / file).is_file()), None)
+                    if path is not None and path not in files:
+                        files.append(path)
+
+        return files
+
     def get_path(self, element: ET.Element) -> Tuple[List[ET.Element], str]:
         """Get the path of an element in the xml tree. Unfortunately, there is no
         built-in way to do this. We'll just iterate up the tree and build the path.
@@ -475,6 +475,22 @@ class MjCambrianContainerConfig:
             content, config=config, instantiated=instantiated
         )
 
+    def merge(self, **overrides: Any) -> Self:
+        """Returns a new config with the given keys overridden. This is a wrapper
+        around OmegaConf.merge, so this config isn't modified and the returned config
+        keeps its flags (e.g. readonly). Unlike copying and then updating the config,
+        the flags don't need to be toggled."""
+        overrides = OmegaConf.create(overrides)
+        content = OmegaConf.merge(self._content, overrides)
+        if self._config_is_content:
+            config = content
+        else:
+            config = OmegaConf.merge(self._config, overrides)
+        instantiated = self.__dict__["_instantiated"]
+        return MjCambrianContainerConfig(
+            content, config=config, instantiated=instantiated
+        )
+
     def clear(self):
         """Wrapper around the clear method to clear the content."""
         self._content.clear()
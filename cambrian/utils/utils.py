@@ -1,7 +1,9 @@
 import ast
 import contextlib
+import os
 import pickle
 import re
+import tempfile
 from dataclasses import dataclass
 from fnmatch import fnmatch
 from pathlib import Path
@@ -114,6 +116,30 @@ def try_load_pickle(folder: Path, pickle_file: Path) -> Any | None:
     return None
 
 
+def get_cache_path(cache_dir: Optional[Path | str], filename: str) -> Optional[Path]:
+    """Returns the path of a file in an on-disk cache directory. Returns None if
+    caching is disabled, i.e. `cache_dir` is None."""
+    if cache_dir is None:
+        return None
+    return Path(cache_dir) / filename
+
+
+def save_atomically(path: Path, save_fn: Callable[[str], None]):
+    """Saves a file with `save_fn`, which is called with the filename to write to.
+    The file is first written to a temporary file in the same directory and then
+    moved to `path`, such that concurrent readers (e.g. workers sharing a cache) never
+    load a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+        pass
+    try:
+        save_fn(f.name)
+        os.replace(f.name, path)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
 # =============
 
 
@@ -288,6 +314,27 @@ def get_sensor_name(model: mj.MjModel, sensoradr: int) -> str:
     return mj.mj_id2name(model, mj.mjtObj.mjOBJ_SENSOR, sensoradr)
 
 
+def check_contacts(
+    data: mj.MjData, geom_rootid: np.ndarray, body_ids: np.ndarray
+) -> np.ndarray:
+    """Checks which of the bodies have contacts. The geoms of the (non-excluded)
+    contacts are mapped to their root bodies and compared against the bodies.
+
+    Args:
+        data (mj.MjData): The data with the current contacts.
+        geom_rootid (np.ndarray): The root body of each geom, i.e.
+            `model.body_rootid[model.geom_bodyid]`.
+        body_ids (np.ndarray): The ids of the root bodies to check.
+
+    Returns:
+        np.ndarray: Whether each of the bodies has contacts.
+    """
+    ncon = data.ncon
+    contact = data.contact
+    geoms = contact.geom[:ncon][contact.exclude[:ncon] == 0]
+    return np.isin(body_ids, geom_rootid[geoms])
+
+
 @dataclass
 class MjCambrianActuator:
     """Helper class which stores information about a Mujoco actuator.
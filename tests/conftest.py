@@ -0,0 +1,32 @@
+"""Shared fixtures for the tests. The configs are composed from the repo's config
+directory, using the detection task with small eyes to keep the tests fast."""
+
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from cambrian.utils.config import MjCambrianConfig
+
+CONFIG_DIR = Path(__file__).parent.parent / "configs"
+
+
+@pytest.fixture(scope="session")
+def compose(tmp_path_factory) -> Callable[..., MjCambrianConfig]:
+    """Returns a function which composes the detection experiment with the given
+    overrides. The logs are written to a temporary directory."""
+    logdir = tmp_path_factory.mktemp("logs")
+
+    def _compose(*overrides: str) -> MjCambrianConfig:
+        return MjCambrianConfig.compose(
+            CONFIG_DIR,
+            "base",
+            overrides=[
+                "exp=tasks/detection",
+                "hydra/sweeper=basic",
+                f"logdir={logdir}",
+                *overrides,
+            ],
+        )
+
+    return _compose
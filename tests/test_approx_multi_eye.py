@@ -0,0 +1,102 @@
+"""Tests for the approximate multi-eye. These create the env, so they require an
+OpenGL context."""
+
+from typing import Dict
+
+import cv2
+import numpy as np
+import pytest
+
+from cambrian.eyes.approx_multi_eye import MjCambrianApproxMultiEye
+
+EYE = "env.agents.agent.eyes.eye"
+
+
+def create_env(compose, *overrides: str):
+    config = compose(
+        f"env/agents/eyes@{EYE}=approx_multi_eye",
+        f"{EYE}.num_eyes=[2,3]",
+        f"{EYE}.resolution=[4,4]",
+        *overrides,
+    )
+    env = config.env.instance(config.env)
+    env.reset(seed=config.seed)
+    return env
+
+
+def get_multi_eye(env) -> MjCambrianApproxMultiEye:
+    return env.agents["agent"].eyes["eye"]
+
+
+@pytest.fixture(scope="module")
+def env(compose):
+    env = create_env(compose)
+    yield env
+    env.close()
+
+
+@pytest.fixture(scope="module")
+def obs(env) -> Dict[str, np.ndarray]:
+    """The float observations of the eyes, which the other modes are compared to."""
+    return {name: obs.copy() for name, obs in get_multi_eye(env).step().items()}
+
+
+@pytest.mark.parametrize(
+    "use_uint8_obs, use_uint8", [(True, True), (True, False), (False, True)]
+)
+def test_obs_dtype_matches_observation_space(compose, obs, use_uint8_obs, use_uint8):
+    env = create_env(
+        compose,
+        f"{EYE}.use_uint8_obs={use_uint8_obs}",
+        f"{EYE}.renderer.use_uint8={use_uint8}",
+    )
+    multi_eye = get_multi_eye(env)
+    for name, eye_obs in multi_eye.step().items():
+        assert eye_obs.dtype == multi_eye.eyes[name].observation_space.dtype
+        if use_uint8_obs:
+            eye_obs = eye_obs / 255.0
+        np.testing.assert_allclose(eye_obs, obs[name], atol=1e-6)
+    env.close()
+
+
+@pytest.mark.parametrize("resolution", [[4, 4], [4, 3]])
+def test_gather_matches_crop_and_resize(compose, resolution):
+    config = compose(
+        f"env/agents/eyes@{EYE}=approx_multi_eye",
+        f"{EYE}.num_eyes=[2,3]",
+        f"{EYE}.resolution=[{resolution[0]},{resolution[1]}]",
+    )
+    eye_config = config.env.agents.agent.eyes.eye
+    multi_eye: MjCambrianApproxMultiEye = eye_config.instance(eye_config, "eye")
+
+    rng = np.random.default_rng(0)
+    full_image = rng.random((*multi_eye._total_resolution, 3), dtype=np.float32)
+    pixels = full_image.reshape(-1, 3)
+    for eye, indices in zip(multi_eye.eyes.values(), multi_eye._gather_indices):
+        obs = np.take(pixels, indices, axis=0)
+        assert obs.shape == (*resolution, 3)
+
+        # The images are W x H, so cv2 is passed (H, W) as the (cols, rows) size
+        x_start, x_end, y_start, y_end = eye._crop_rect
+        crop = full_image[x_start:x_end, y_start:y_end]
+        expected = cv2.resize(crop, resolution[::-1], interpolation=cv2.INTER_NEAREST)
+        np.testing.assert_array_equal(obs, expected)
+
+        # For square eyes, the old per eye step is the same
+        if resolution[0] == resolution[1]:
+            eye._prev_obs = eye._create_obs_buffer()
+            np.testing.assert_array_equal(obs, eye.step(full_image))
+
+
+def test_full_image_matches_concatenated_renders(env):
+    multi_eye = get_multi_eye(env)
+    obs = {name: obs.copy() for name, obs in multi_eye.step().items()}
+
+    # The old step rendered each camera into its own image and concatenated them
+    images = [renderer.render().copy() for renderer in multi_eye._renderers.values()]
+    full_image = np.concatenate(images, axis=0)
+    assert full_image.any()
+    np.testing.assert_array_equal(multi_eye._full_image, full_image)
+
+    for name, eye in multi_eye.eyes.items():
+        np.testing.assert_array_equal(obs[name], eye.step(full_image))
@@ -0,0 +1,143 @@
+"""Tests for the env. These create the env, so they require an OpenGL context."""
+
+from typing import Any, Dict, List
+
+import mujoco as mj
+import numpy as np
+import pytest
+
+from cambrian.agents.agent import MjCambrianAgent
+from cambrian.envs.env import MjCambrianEnv
+
+EYE = "env.agents.agent.eyes.eye"
+
+
+def run_episode(compose, *overrides: str, num_steps: int = 6) -> List[Dict[str, Any]]:
+    """Steps the env with a constant action and returns the eye obs of the agent and
+    whether it was rendered at each step, including the reset. The env reuses the
+    info dict between steps, so the values are copied."""
+    config = compose(f"{EYE}.resolution=[8,6]", *overrides)
+    env = config.env.instance(config.env)
+    obs, info = env.reset(seed=config.seed)
+
+    action = np.full(env.action_spaces["agent"].shape, 0.5)
+    steps = [dict(eye=obs["agent"]["eye"].copy(), rendered=True)]
+    for _ in range(num_steps):
+        obs, _, _, _, info = env.step({"agent": action})
+        rendered = info["agent"]["rendered"]
+        steps.append(dict(eye=obs["agent"]["eye"].copy(), rendered=rendered))
+    env.close()
+    return steps
+
+
+@pytest.fixture(scope="module")
+def every_step(compose) -> List[Dict[str, Any]]:
+    return run_episode(compose)
+
+
+def test_render_every_step(every_step):
+    assert all(step["rendered"] for step in every_step)
+    assert not np.array_equal(every_step[1]["eye"], every_step[-1]["eye"])
+
+
+def test_render_frequency_holds_obs(compose, every_step):
+    steps = run_episode(compose, "env.agents.agent.render_frequency=3")
+
+    rendered = [step["rendered"] for step in steps]
+    assert rendered == [True, False, False, True, False, False, True]
+
+    # The physics isn't affected, so the rendered obs are the same as rendering every
+    # step and the held obs are those of the last render
+    for i, step in enumerate(steps):
+        last_render = max(j for j in range(i + 1) if rendered[j])
+        np.testing.assert_array_equal(step["eye"], every_step[last_render]["eye"])
+
+
+@pytest.mark.parametrize("threshold, expected", [(1e-6, True), (1e6, False)])
+def test_render_pose_threshold(compose, every_step, threshold, expected):
+    steps = run_episode(
+        compose,
+        "env.agents.agent.render_frequency=100",
+        f"env.agents.agent.render_pose_threshold={threshold}",
+    )
+
+    # The agent moves every step, so it's rendered early only below the threshold
+    assert all(step["rendered"] == expected for step in steps[1:])
+    expected_eye = every_step[-1]["eye"] if expected else every_step[0]["eye"]
+    np.testing.assert_array_equal(steps[-1]["eye"], expected_eye)
+
+
+def get_model_arrays(model: mj.MjModel) -> Dict[str, np.ndarray]:
+    arrays = {name: getattr(model, name) for name in dir(model) if name[0] != "_"}
+    return {k: v for k, v in arrays.items() if isinstance(v, np.ndarray)}
+
+
+def test_model_cache(compose, every_step, tmp_path, monkeypatch):
+    cache_override = f"env.model_cache_dir={tmp_path}"
+    config = compose(f"{EYE}.resolution=[8,6]", cache_override)
+    env = config.env.instance(config.env)
+    assert len(list(tmp_path.glob("model_*.mjb"))) == 1
+
+    # The env model has to be loaded from the cache from now on. The agents compile
+    # their own models, which aren't cached.
+    from_xml_string = mj.MjModel.from_xml_string
+
+    def compile_uncached(xml_string: str, *args):
+        assert xml_string != env.xml.to_string(), "Not cached."
+        return from_xml_string(xml_string, *args)
+
+    monkeypatch.setattr(mj.MjModel, "from_xml_string", compile_uncached)
+    cached_env = config.env.instance(config.env)
+    arrays = get_model_arrays(env.model)
+    cached_arrays = get_model_arrays(cached_env.model)
+    assert arrays.keys() == cached_arrays.keys()
+    for name, value in arrays.items():
+        np.testing.assert_array_equal(cached_arrays[name], value, err_msg=name)
+    env.close()
+    cached_env.close()
+
+    steps = run_episode(compose, cache_override)
+    for step, expected_step in zip(steps, every_step, strict=True):
+        np.testing.assert_array_equal(step["eye"], expected_step["eye"])
+
+
+@pytest.fixture(scope="module")
+def env(compose):
+    config = compose(f"{EYE}.resolution=[4,4]")
+    env = config.env.instance(config.env)
+    env.reset(seed=config.seed)
+    yield env
+    env.close()
+
+
+def has_contacts_loop(env: MjCambrianEnv, agent: MjCambrianAgent) -> bool:
+    """Checks the contacts of the agent by walking through all the contacts, which is
+    the reference for the vectorized checks."""
+    if not agent.config.check_contacts:
+        return False
+
+    for contact in env.data.contact:
+        body1 = env.model.geom_bodyid[int(contact.geom[0])]
+        body2 = env.model.geom_bodyid[int(contact.geom[1])]
+        rootbodies = env.model.body_rootid[[body1, body2]]
+        if agent.body_id in rootbodies and not contact.exclude:
+            return True
+    return False
+
+
+# The agent is placed on the outer walls of the maze and in the open
+@pytest.mark.parametrize(
+    "pos, in_contact", [((-17, 0), True), ((-1, 4), True), ((-9, -2), False)]
+)
+def test_has_contacts_matches_loop(env, pos, in_contact):
+    agent = env.agents["agent"]
+    agent.pos = [*pos, None]
+    mj.mj_forward(env.model, env.data)
+
+    info = {name: {"has_contacts": False} for name in env.agents}
+    env._update_contacts(info)
+    for name, agent in env.agents.items():
+        expected = has_contacts_loop(env, agent)
+        assert agent.has_contacts == expected
+        assert info[name]["has_contacts"] == expected
+    assert info["agent"]["has_contacts"] == in_contact
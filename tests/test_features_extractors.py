@@ -0,0 +1,84 @@
+"""Tests for the feature extractors. These only build the extractors from the
+observation spaces, so they don't require the env."""
+
+from functools import partial
+
+import gymnasium as gym
+import numpy as np
+import pytest
+import torch
+from gymnasium import spaces
+from gymnasium.wrappers import FrameStackObservation
+from stable_baselines3.common.torch_layers import FlattenExtractor
+
+from cambrian.ml.features_extractors import (
+    MjCambrianCombinedExtractor,
+    MjCambrianMLPExtractor,
+)
+
+IMAGE_SHAPE = (3, 4, 4, 3)  # (N, W, H, C), i.e. a stacked multi-eye
+STACK_SIZE = 5
+
+
+class StackedEyeEnv(gym.Env):
+    """An env which only defines the observation space, for the wrappers."""
+
+    def __init__(self, observation_space: spaces.Dict):
+        self.observation_space = observation_space
+        self.action_space = spaces.Box(-1, 1, (2,))
+
+
+def create_extractor(observation_space: spaces.Dict) -> MjCambrianCombinedExtractor:
+    """Creates the extractor with fixed weights, so two extractors for the same shape
+    compute the same features."""
+    torch.manual_seed(0)
+    return MjCambrianCombinedExtractor(
+        observation_space,
+        normalized_image=False,
+        image_extractor=partial(
+            MjCambrianMLPExtractor,
+            features_dim=8,
+            activation=torch.nn.Tanh,
+            architecture=[16],
+        ),
+    )
+
+
+def test_uint8_images_are_normalized():
+    uint8_space = spaces.Dict(eye=spaces.Box(0, 255, IMAGE_SHAPE, np.uint8))
+    float_space = spaces.Dict(eye=spaces.Box(0, 1, IMAGE_SHAPE, np.float32))
+    uint8_extractor = create_extractor(uint8_space)
+    float_extractor = create_extractor(float_space)
+
+    # sb3 casts the observations to float before passing them to the extractor
+    obs = torch.randint(0, 256, (2, *IMAGE_SHAPE)).float()
+    torch.testing.assert_close(
+        uint8_extractor(dict(eye=obs)), float_extractor(dict(eye=obs / 255.0))
+    )
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.float32])
+def test_frame_stacked_images(dtype):
+    high = 255 if dtype == np.uint8 else 1
+    observation_space = spaces.Dict(
+        eye=spaces.Box(0, high, IMAGE_SHAPE, dtype), action=spaces.Box(-1, 1, (2,))
+    )
+    env = FrameStackObservation(StackedEyeEnv(observation_space), STACK_SIZE)
+    assert env.observation_space["eye"].shape == (STACK_SIZE, *IMAGE_SHAPE)
+    extractor = create_extractor(env.observation_space)
+
+    # The frames and eyes are folded into one stack of images, so the features are
+    # the same as for the unfolded images
+    folded_shape = (STACK_SIZE * IMAGE_SHAPE[0], *IMAGE_SHAPE[1:])
+    folded_space = spaces.Dict(env.observation_space.spaces)
+    folded_space["eye"] = spaces.Box(0, high, folded_shape, dtype)
+    folded_extractor = create_extractor(folded_space)
+    assert extractor.features_dim == folded_extractor.features_dim
+    assert not isinstance(extractor.extractors["eye"], FlattenExtractor)
+
+    obs = {
+        k: torch.as_tensor(np.stack([v] * 2)).float()
+        for k, v in env.observation_space.sample().items()
+    }
+    folded_obs = dict(obs, eye=obs["eye"].flatten(1, 2))
+    torch.testing.assert_close(extractor(obs), folded_extractor(folded_obs))
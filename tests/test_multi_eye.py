@@ -0,0 +1,63 @@
+"""Tests for the multi-eye. These create the env, so they require an OpenGL
+context."""
+
+import numpy as np
+import pytest
+
+from cambrian.eyes.multi_eye import MjCambrianMultiEye
+from cambrian.utils.config import MjCambrianContainerConfig
+
+EYE = "env.agents.agent.eyes.eye"
+
+
+@pytest.fixture(scope="module")
+def env(compose):
+    config = compose(
+        f"env/agents/eyes@{EYE}=multi_eye",
+        f"{EYE}.num_eyes=[1,3]",
+        f"{EYE}.resolution=[4,4]",
+        f"{EYE}.use_stacked_obs=true",
+    )
+    env = config.env.instance(config.env)
+    env.reset(seed=config.seed)
+    yield env
+    env.close()
+
+
+def test_stacked_obs_is_not_aliased(env):
+    eye: MjCambrianMultiEye = env.agents["agent"].eyes["eye"]
+    obs = eye.step()[eye.name]
+    assert obs.shape == (3, 4, 4, 3)
+
+    # Wrappers (e.g. frame stacking) keep references to the returned obs, so it must
+    # not be overwritten by the next step
+    next_obs = eye.step()[eye.name]
+    assert not np.shares_memory(obs, next_obs)
+    assert not np.shares_memory(obs, eye._obs_arena)
+    assert not np.shares_memory(eye.prev_obs[eye.name], eye._obs_arena)
+
+
+def test_eye_configs_are_independent_configs(compose):
+    config = compose(
+        f"env/agents/eyes@{EYE}=multi_eye",
+        f"{EYE}.num_eyes=[1,3]",
+        f"{EYE}.resolution=[4,4]",
+    )
+    multi_eye_config = config.env.agents.agent.eyes.eye
+    multi_eye: MjCambrianMultiEye = multi_eye_config.instance(multi_eye_config, "eye")
+
+    coords = [eye.config.coord for eye in multi_eye.eyes.values()]
+    assert len({tuple(coord) for coord in coords}) == 3
+    for eye, coord in zip(multi_eye.eyes.values(), coords):
+        assert isinstance(eye.config, MjCambrianContainerConfig)
+        assert eye.config.to_container()["coord"] == list(coord)
+        assert eye.config.to_container(use_instantiated=False)["coord"] == list(coord)
+        assert list(eye.config.resolution) == [4, 4]
+
+    # Updating one eye's config doesn't affect the other eyes or the multi-eye
+    eye, *other_eyes = multi_eye.eyes.values()
+    with eye.config.set_readonly_temporarily(False):
+        eye.config.renderer.width = 8
+    assert eye.config.renderer.width == 8
+    assert all(other.config.renderer.width == 4 for other in other_eyes)
+    assert multi_eye_config.renderer.width == 4
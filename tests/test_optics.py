@@ -0,0 +1,276 @@
+"""Tests for the optics eye. The renderer is replaced by one which returns fixed
+synthetic images, so these don't require an OpenGL context."""
+
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+import pytest
+import torch
+
+from cambrian.eyes import optics
+from cambrian.eyes.eye import MjCambrianEye
+from cambrian.eyes.optics import MjCambrianOpticsEye
+
+EYE = "env.agents.agent.eyes.eye"
+NEAR, FAR = 0.05, 100.0  # Range of the precomputed and synthetic depths
+
+
+class SyntheticRenderer:
+    """Returns a fixed random image and a depth map which spans the near and far
+    depths. A fraction of the pixels is at the far depth, which is treated as sky."""
+
+    def __init__(self, width: int, height: int, near: float, far: float, seed: int):
+        rng = np.random.default_rng(seed)
+        self._image = rng.random((width, height, 3), dtype=np.float32)
+        log_depth = rng.uniform(np.log(near), np.log(far), (width, height))
+        self._depth = np.exp(log_depth).astype(np.float32)
+        self._depth[rng.random((width, height)) < 0.2] = far
+
+    def render(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._image, self._depth
+
+
+@pytest.fixture(scope="module")
+def eye_config(compose):
+    config = compose(
+        f"env/agents/eyes@{EYE}=optics",
+        f"{EYE}.pupil_resolution=[11,11]",
+        f"{EYE}.resolution=[5,5]",
+        f"{EYE}.depth_range=[{NEAR},{FAR}]",
+        f"{EYE}.num_depths=4",
+    )
+    return config.env.agents.agent.eyes.eye
+
+
+def create_eye(
+    eye_config, name: str = "eye", *, seed: int = 0, **kwargs
+) -> MjCambrianOpticsEye:
+    """Creates an optics eye with the given config overrides and a synthetic
+    renderer."""
+    eye_config = eye_config.copy()
+    eye_config.set_readonly(False)
+    for key, value in kwargs.items():
+        setattr(eye_config, key, value)
+    eye: MjCambrianOpticsEye = eye_config.instance(eye_config, name)
+
+    W, H = eye_config.renderer.width, eye_config.renderer.height
+    eye._renderer = SyntheticRenderer(W, H, NEAR, FAR, seed)
+    eye._prev_obs = eye._create_obs_buffer()
+    return eye
+
+
+@pytest.mark.parametrize("num_depth_planes", [2, 4])
+def test_depth_planes_partition_image(eye_config, num_depth_planes):
+    eye = create_eye(eye_config, conv_mode="direct", num_depth_planes=num_depth_planes)
+    image, depth = (torch.from_numpy(x) for x in eye._renderer.render())
+    image = image.permute(2, 0, 1)
+
+    layers, kernels = eye._split_layers(image, depth)
+    assert len(layers) == len(kernels) == num_depth_planes
+
+    # Each pixel is in exactly one plane and the sky is in the farthest plane
+    in_plane = (layers != 0).any(1)
+    assert (in_plane.sum(0) == 1).all()
+    assert in_plane[-1][depth == depth.max()].all()
+    torch.testing.assert_close(layers.sum(0), image)
+
+    assert np.isfinite(eye.step()).all()
+
+
+@pytest.mark.parametrize("conv_mode", ["direct", "fft", "separable"])
+@pytest.mark.parametrize("num_depth_planes", [1, 3])
+def test_step_batched_matches_step(eye_config, conv_mode, num_depth_planes):
+    eyes = [
+        create_eye(
+            eye_config,
+            f"eye_{i}",
+            seed=i,
+            conv_mode=conv_mode,
+            num_depth_planes=num_depth_planes,
+        )
+        for i in range(3)
+    ]
+    expected = np.stack([eye.step() for eye in eyes])
+
+    out = torch.zeros_like(torch.from_numpy(expected))
+    batched_obs = MjCambrianOpticsEye.step_batched(eyes, out)
+    np.testing.assert_allclose(batched_obs, expected, atol=1e-6)
+    np.testing.assert_array_equal(out.numpy(), batched_obs)
+
+
+def test_conv_mode_defaults_to_direct(eye_config):
+    assert create_eye(eye_config)._conv_mode == "direct"
+
+
+@pytest.mark.parametrize("num_depth_planes", [1, 3])
+@pytest.mark.parametrize("interpolate_psfs", [False, True])
+def test_fft_matches_direct(eye_config, num_depth_planes, interpolate_psfs):
+    kwargs = dict(num_depth_planes=num_depth_planes, interpolate_psfs=interpolate_psfs)
+    direct_eye = create_eye(eye_config, conv_mode="direct", **kwargs)
+    fft_eye = create_eye(eye_config, conv_mode="fft", **kwargs)
+    assert fft_eye._conv_mode == "fft"
+
+    np.testing.assert_allclose(fft_eye.step(), direct_eye.step(), atol=1e-5)
+
+
+def test_auto_conv_mode_picks_fft_for_large_psfs(eye_config):
+    # The psf is more than half the size of the image, so the fft is cheaper
+    assert create_eye(eye_config, conv_mode="auto")._conv_mode == "fft"
+
+
+def test_psf_cache(eye_config, tmp_path, monkeypatch):
+    # Don't share the psfs in-process, so the second eye has to load them from disk
+    monkeypatch.setattr(optics, "OPTICS_CACHE", OrderedDict())
+    eye = create_eye(eye_config, psf_cache_dir=tmp_path)
+    cache_files = list(tmp_path.iterdir())
+    assert [f.name for f in cache_files] == [f"psfs_{eye._get_psf_key()}.pt"]
+
+    monkeypatch.setattr(optics, "OPTICS_CACHE", OrderedDict())
+    monkeypatch.setattr(
+        MjCambrianOpticsEye, "_calculate_psf", lambda *_: pytest.fail("Not cached.")
+    )
+    cached_eye = create_eye(eye_config, psf_cache_dir=tmp_path)
+    torch.testing.assert_close(cached_eye._psfs, eye._psfs)
+    np.testing.assert_array_equal(cached_eye.step(), eye.step())
+
+
+def test_psf_cache_key_depends_on_optics(eye_config):
+    eye = create_eye(eye_config)
+    assert create_eye(eye_config)._get_psf_key() == eye._get_psf_key()
+    assert create_eye(eye_config, f_stop=4.0)._get_psf_key() != eye._get_psf_key()
+    assert create_eye(eye_config, num_depths=5)._get_psf_key() != eye._get_psf_key()
+
+
+@pytest.mark.parametrize("conv_mode", ["direct", "fft"])
+@pytest.mark.parametrize("precompute_psfs", [False, True])
+def test_all_sky_is_finite(eye_config, conv_mode, precompute_psfs):
+    # If the psfs aren't precomputed, they're calculated at the scene depth each step
+    kwargs = {} if precompute_psfs else dict(depth_range=None, depths=[])
+    eye = create_eye(eye_config, conv_mode=conv_mode, interpolate_psfs=True, **kwargs)
+    assert (eye._psfs is not None) == precompute_psfs
+
+    # Every pixel is at the far depth, so the whole image is sky
+    _, depth = eye._renderer.render()
+    depth[:] = FAR
+
+    obs = eye.step()
+    assert np.isfinite(obs).all()
+    assert obs.max() > 0
+
+
+def test_full_rank_separable_matches_direct(eye_config):
+    direct_eye = create_eye(eye_config, conv_mode="direct")
+    rank = min(direct_eye._psf_resolution)
+    eye = create_eye(eye_config, conv_mode="separable", separable_rank=rank)
+    assert eye.separable_error < 1e-5
+
+    np.testing.assert_allclose(eye.step(), direct_eye.step(), atol=1e-5)
+
+
+def test_separable_error_decreases_with_rank(eye_config):
+    errors = [
+        create_eye(
+            eye_config, conv_mode="separable", separable_rank=rank
+        ).separable_error
+        for rank in [1, 2, 4]
+    ]
+    assert errors == sorted(errors, reverse=True)
+    assert create_eye(eye_config, conv_mode="direct").separable_error is None
+
+
+def step_numpy(eye: MjCambrianOpticsEye) -> np.ndarray:
+    """The reference optics step, which computes the depth statistics in numpy and
+    convolves a copy of the rendered image."""
+    image, depth = eye._renderer.render()
+    image = torch.from_numpy(image.copy())
+
+    depth = depth[depth < np.max(depth)]
+    depth = np.clip(depth, 5 * max(eye.config.focal), np.inf)
+    psf = eye._get_psf(torch.tensor(np.mean(depth)))
+
+    image = image.permute(2, 0, 1).unsqueeze(0)
+    image = torch.nn.functional.conv2d(
+        image, psf.unsqueeze(1), padding="same", groups=3
+    )
+    image *= eye._scaling_intensity
+
+    image = image.squeeze(0).permute(1, 2, 0)
+    return torch.clip(eye._crop(image), 0, 1).numpy()
+
+
+def test_step_matches_numpy(eye_config):
+    eye = create_eye(eye_config)
+    np.testing.assert_allclose(eye.step(), step_numpy(eye), atol=1e-6)
+
+
+def test_step_writes_into_obs_buffer(eye_config):
+    eye = create_eye(eye_config)
+    prev_obs = eye._prev_obs
+    assert eye._create_obs_buffer() is prev_obs
+
+    obs = eye.step()
+    assert eye._prev_obs is prev_obs
+    np.testing.assert_array_equal(obs, prev_obs)
+    assert not np.shares_memory(obs, prev_obs)
+
+
+def test_to_tensor_with_flipped_array(eye_config):
+    eye = create_eye(eye_config)
+    array = np.arange(24, dtype=np.float32).reshape(2, 3, 4)[::-1, :, ::-1]
+    assert any(stride < 0 for stride in array.strides)
+    torch.testing.assert_close(eye._to_tensor(array), torch.from_numpy(array.copy()))
+
+
+def sample_noise(eye: MjCambrianOpticsEye, seed: int, num_steps: int) -> np.ndarray:
+    """Resets the eye after seeding the global rng and samples the noise which is
+    added to a gray image for a few steps."""
+    torch.manual_seed(seed)
+    eye.reset(None, None)
+
+    image = torch.full((3, *eye._renderer.render()[1].shape), 0.5)
+    return np.stack([eye._apply_noise(image, 0.1) - 0.5 for _ in range(num_steps)])
+
+
+def test_noise_bank_is_reseeded_on_reset(eye_config, monkeypatch):
+    monkeypatch.setattr(MjCambrianEye, "reset", lambda *_: None)
+    eye = create_eye(eye_config, noise_std=0.1, noise_bank_size=4)
+
+    noise = sample_noise(eye, 0, 8)
+    np.testing.assert_array_equal(sample_noise(eye, 0, 8), noise)
+    assert not np.allclose(sample_noise(eye, 1, 8), noise)
+
+    # The noise is scaled standard normal noise, the clipping is 5 stds away
+    assert abs(noise.mean()) < 0.01
+    assert noise.std() == pytest.approx(0.1, rel=0.05)
+
+
+def test_psfs_are_batched_over_depths(eye_config):
+    eye = create_eye(eye_config)
+    psfs = torch.stack([eye._calculate_psf(depth) for depth in eye._depths])
+    torch.testing.assert_close(eye._calculate_psf(eye._depths), psfs)
+    torch.testing.assert_close(eye._psfs, psfs)
+
+
+def test_optics_are_shared_between_eyes(eye_config, monkeypatch):
+    monkeypatch.setattr(optics, "OPTICS_CACHE", OrderedDict())
+    eye = create_eye(eye_config, "eye_0")
+    other_eye = create_eye(eye_config, "eye_1")
+    assert other_eye._psfs is eye._psfs and other_eye._pupil is eye._pupil
+
+    other_eye = create_eye(eye_config, "eye_2", f_stop=4.0)
+    assert other_eye._psfs is not eye._psfs
+
+
+def test_optics_cache_is_bounded(eye_config, monkeypatch):
+    monkeypatch.setattr(optics, "OPTICS_CACHE", OrderedDict())
+    monkeypatch.setattr(optics, "OPTICS_CACHE_SIZE", 4)
+
+    eye = create_eye(eye_config, f_stop=2.0)
+    for f_stop in [3.0, 4.0, 5.0]:
+        create_eye(eye_config, f_stop=f_stop)
+        assert len(optics.OPTICS_CACHE) <= 4
+
+    # The least recently used psfs are evicted and recomputed
+    assert ("psfs", eye._get_psf_key()) not in optics.OPTICS_CACHE
+    torch.testing.assert_close(create_eye(eye_config, f_stop=2.0)._psfs, eye._psfs)
@@ -0,0 +1,68 @@
+"""Tests for the raycast eye. The eye is reset with a small hand written model, so
+these don't require an OpenGL context."""
+
+import mujoco as mj
+import numpy as np
+import pytest
+
+from cambrian.eyes.raycast import MjCambrianRaycastEye
+
+EYE = "env.agents.agent.eyes.eye"
+
+# The camera looks along +x at a red box which covers the right half of the view
+XML = """
+<mujoco>
+    <worldbody>
+        <camera name="eye" pos="0 0 0" xyaxes="0 -1 0 0 0 1"/>
+        <geom type="box" pos="10 -2 0" size="0.1 2 5" rgba="1 0 0 1"/>
+    </worldbody>
+</mujoco>
+"""
+
+
+@pytest.fixture(scope="module")
+def eye_config(compose):
+    config = compose(f"env/agents/eyes@{EYE}=raycast", f"{EYE}.resolution=[4,3]")
+    return config.env.agents.agent.eyes.eye
+
+
+def create_eye(eye_config, use_uint8_obs: bool) -> MjCambrianRaycastEye:
+    eye_config = eye_config.copy()
+    eye_config.set_readonly(False)
+    eye_config.use_uint8_obs = use_uint8_obs
+    eye: MjCambrianRaycastEye = eye_config.instance(eye_config, "eye")
+
+    model = mj.MjModel.from_xml_string(XML)
+    data = mj.MjData(model)
+    mj.mj_forward(model, data)
+    eye.reset(model, data)
+    return eye
+
+
+@pytest.mark.parametrize("use_uint8_obs", [False, True])
+def test_obs(eye_config, use_uint8_obs):
+    eye = create_eye(eye_config, use_uint8_obs)
+    obs = eye.step()
+    assert obs.shape == eye.observation_space.shape == (4, 3, 3)
+    assert obs.dtype == eye.observation_space.dtype
+    assert eye.observation_space.contains(obs)
+
+    # The pixels are indexed from the left, so the right half is red
+    red = np.array([255, 0, 0] if use_uint8_obs else [1.0, 0.0, 0.0])
+    np.testing.assert_array_equal(obs[2:], np.broadcast_to(red, (2, 3, 3)))
+    assert not obs[:2].any()
+
+
+def test_multiray_with_normal(eye_config, monkeypatch):
+    expected = create_eye(eye_config, use_uint8_obs=False).step()
+
+    # Newer mujoco versions require the normal output
+    multiray = mj.mj_multiRay
+
+    def multiray_with_normal(*, normal, **kwargs):
+        multiray(**kwargs)
+
+    monkeypatch.setattr(mj, "mj_multiRay", multiray_with_normal)
+    eye = create_eye(eye_config, use_uint8_obs=False)
+    assert eye._multiray_kwargs == dict(normal=None)
+    np.testing.assert_array_equal(eye.step(), expected)
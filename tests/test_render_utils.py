@@ -0,0 +1,95 @@
+"""Tests for the rendering utilities. These only use numpy images, so they don't
+require an OpenGL context."""
+
+from typing import List
+
+import cv2
+import numpy as np
+import pytest
+
+from cambrian.renderer.render_utils import (
+    compute_spherical_panorama_lut,
+    project_images_to_spherical_panorama,
+)
+
+YAWS = [135.0, 45.0, -45.0, -135.0]
+FOV_X, FOV_Y = 90.0, 60.0
+IMAGE_RESOLUTION = (12, 8)
+TOTAL_RESOLUTION = (40, 16)
+
+
+def project_with_remap(images: np.ndarray, yaws: List[float]) -> np.ndarray:
+    """The reference projection, which remaps each camera image separately with cv2
+    and keeps the camera which sees each panorama pixel most head-on."""
+    width, height = IMAGE_RESOLUTION
+    total_width, total_height = TOTAL_RESOLUTION
+
+    lon = np.deg2rad(180 - 360 * (np.arange(total_width) + 0.5) / total_width)
+    lat = np.deg2rad(90 - 180 * (np.arange(total_height) + 0.5) / total_height)
+    lon, lat = np.meshgrid(lon, lat, indexing="ij")
+
+    panorama = np.zeros((total_width, total_height, 3), dtype=np.float32)
+    best_z = np.zeros((total_width, total_height))
+    for image, yaw in zip(images, np.deg2rad(yaws)):
+        # The direction in the camera frame, which looks along its x axis
+        z = np.cos(lat) * np.cos(lon - yaw)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = -np.cos(lat) * np.sin(lon - yaw) / z / np.tan(np.deg2rad(FOV_X) / 2)
+            y = np.sin(lat) / z / np.tan(np.deg2rad(FOV_Y) / 2)
+        visible = (z > best_z) & (np.abs(x) <= 1) & (np.abs(y) <= 1)
+
+        # The images are W x H, so the cv2 columns are along the height
+        map_x = np.clip((x + 1) / 2 * width - 0.5, 0, width - 1).astype(np.float32)
+        map_y = np.clip((1 - y) / 2 * height - 0.5, 0, height - 1).astype(np.float32)
+        remapped = cv2.remap(
+            image, map_y, map_x, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+        )
+        panorama[visible] = remapped[visible]
+        best_z[visible] = z[visible]
+    return panorama
+
+
+@pytest.fixture(scope="module")
+def images() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.random((len(YAWS), *IMAGE_RESOLUTION, 3), dtype=np.float32)
+
+
+def test_panorama_matches_remap(images):
+    lut = compute_spherical_panorama_lut(
+        IMAGE_RESOLUTION, YAWS, FOV_X, FOV_Y, TOTAL_RESOLUTION
+    )
+    panorama = project_images_to_spherical_panorama(
+        images, YAWS, FOV_X, FOV_Y, TOTAL_RESOLUTION, lut=lut
+    )
+    assert panorama.shape == (*TOTAL_RESOLUTION, 3)
+
+    # cv2 uses fixed point bilinear weights, so it's only accurate to ~1e-3
+    expected = project_with_remap(images, YAWS)
+    np.testing.assert_allclose(panorama, expected, atol=5e-3)
+
+    # The lut is computed on the fly if it isn't passed
+    np.testing.assert_array_equal(
+        project_images_to_spherical_panorama(
+            list(images), YAWS, FOV_X, FOV_Y, TOTAL_RESOLUTION
+        ),
+        panorama,
+    )
+
+
+def test_panorama_cameras():
+    # Each camera sees a constant color, so the panorama shows which camera is used
+    colors = np.arange(1, len(YAWS) + 1, dtype=np.uint8)
+    images = np.broadcast_to(colors[:, None, None, None], (4, *IMAGE_RESOLUTION, 3))
+    panorama = project_images_to_spherical_panorama(
+        images, YAWS, FOV_X, FOV_Y, TOTAL_RESOLUTION
+    )
+    assert panorama.dtype == np.uint8
+
+    # The longitude decreases from left to right, from 180 to -180 degrees. The
+    # cameras cover the full longitude but only the latitudes within the fov.
+    total_width, total_height = TOTAL_RESOLUTION
+    for color, yaw in zip(colors, YAWS):
+        x = int((180 - yaw) / 360 * total_width)
+        assert (panorama[x, total_height // 2] == color).all()
+    assert not panorama[:, 0].any() and not panorama[:, -1].any()
@@ -0,0 +1,137 @@
+"""Tests for the renderer. These create the env, so they require an OpenGL
+context."""
+
+from typing import List
+
+import mujoco as mj
+import numpy as np
+import pytest
+
+from cambrian.renderer import MjCambrianRenderer
+
+EYE = "env.agents.agent.eyes.eye"
+
+
+def render_separately(renderers: List[MjCambrianRenderer]) -> List[np.ndarray]:
+    """Renders each renderer on its own, bypassing the atlas."""
+    outputs = []
+    for renderer in renderers:
+        atlas, renderer._atlas = renderer._atlas, None
+        outputs.append(renderer.render().copy())
+        renderer._atlas = atlas
+    return outputs
+
+
+@pytest.fixture(scope="module")
+def atlas_env(compose):
+    config = compose(
+        f"env/agents/eyes@{EYE}=multi_eye",
+        f"{EYE}.num_eyes=[2,3]",
+        f"{EYE}.resolution=[8,6]",
+        f"{EYE}.use_atlas=true",
+    )
+    env = config.env.instance(config.env)
+    env.reset(seed=config.seed)
+    yield env
+    env.close()
+
+
+def test_atlas_matches_separate_renders(atlas_env):
+    multi_eye = atlas_env.agents["agent"].eyes["eye"]
+    renderers = [eye._renderer for eye in multi_eye.eyes.values()]
+    multi_eye._atlas.invalidate()
+    atlas_outputs = [renderer.render() for renderer in renderers]
+
+    expected = render_separately(renderers)
+    assert any(output.any() for output in expected)
+    for output, expected_output in zip(atlas_outputs, expected):
+        assert output.shape == (8, 6, 3)
+        np.testing.assert_array_equal(output, expected_output)
+
+
+def test_atlas_after_offscreen_buffer_is_shrunk(atlas_env):
+    multi_eye = atlas_env.agents["agent"].eyes["eye"]
+    renderers = [eye._renderer for eye in multi_eye.eyes.values()]
+    expected = render_separately(renderers)
+
+    # Another viewer which shares the context resizes it to its own size. Rendering
+    # outside of the offscreen buffer is undefined, so check the size explicitly.
+    atlas = multi_eye._atlas
+    renderers[0].viewer.make_context_current()
+    mj.mjr_resizeOffscreen(8, 6, atlas._mjr_context)
+
+    atlas.invalidate()
+    for renderer, expected_output in zip(renderers, expected):
+        np.testing.assert_array_equal(renderer.render(), expected_output)
+    assert atlas._mjr_context.offWidth >= atlas._viewport.width
+    assert atlas._mjr_context.offHeight >= atlas._viewport.height
+
+
+@pytest.mark.parametrize("use_shared_scene", [False, True])
+def test_shared_scene_matches_separate_scenes(compose, use_shared_scene):
+    config = compose(
+        f"env/agents/eyes@{EYE}=multi_eye",
+        f"{EYE}.num_eyes=[2,3]",
+        f"{EYE}.resolution=[8,6]",
+        f"{EYE}.renderer.use_shared_scene={use_shared_scene}",
+    )
+    env = config.env.instance(config.env)
+    env.reset(seed=config.seed)
+
+    # The scene is only shared once the data has been stepped
+    multi_eye = env.agents["agent"].eyes["eye"]
+    mj.mj_step(env.model, env.data)
+    obs = {name: obs.copy() for name, obs in multi_eye.step().items()}
+
+    # Render each eye with its own scene
+    for eye in multi_eye.eyes.values():
+        viewer = eye._renderer.viewer
+        viewer._scene = viewer._config.scene(model=env.model)
+        mj.mjv_updateScene(
+            env.model,
+            env.data,
+            viewer.scene_options,
+            None,
+            viewer.camera,
+            mj.mjtCatBit.mjCAT_ALL,
+            viewer._scene,
+        )
+        viewer.make_context_current()
+        mj.mjr_render(viewer._viewport, viewer._scene, viewer._mjr_context)
+        rgb, _ = viewer.read_pixels()
+        np.testing.assert_array_equal(obs[eye.name], rgb)
+    env.close()
+
+
+def render_trajectory(compose, use_async_readback: bool) -> List[np.ndarray]:
+    """Renders the eye of the agent at its reset position and then at a few other
+    positions."""
+    config = compose(
+        f"{EYE}.resolution=[8,6]",
+        f"{EYE}.renderer.render_modes=[rgb_array,depth_array]",
+        f"{EYE}.renderer.use_async_readback={use_async_readback}",
+    )
+    env = config.env.instance(config.env)
+    env.reset(seed=config.seed)
+
+    agent = env.agents["agent"]
+    renderer = agent.eyes["eye"]._renderer
+    outputs = [[output.copy() for output in renderer.render()]]
+    for x, y in [(-17, 0), (-9, -2), (-1, 4), (-9, 2)]:
+        agent.pos = [x, y, None]
+        mj.mj_forward(env.model, env.data)
+        outputs.append([output.copy() for output in renderer.render()])
+    env.close()
+    return outputs
+
+
+def test_async_readback_lags_sync_readback_by_one_frame(compose):
+    expected = render_trajectory(compose, use_async_readback=False)
+    outputs = render_trajectory(compose, use_async_readback=True)
+    assert not any(np.array_equal(a[0], b[0]) for a, b in zip(expected, expected[1:]))
+
+    # The read during the reset waits for the current frame, so the first async read
+    # returns the reset frame as well
+    for output, expected_output in zip(outputs, [expected[0], *expected[:-1]]):
+        np.testing.assert_array_equal(output[0], expected_output[0])
+        np.testing.assert_array_equal(output[1], expected_output[1])
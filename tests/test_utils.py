@@ -0,0 +1,30 @@
+"""Tests for the utilities in `cambrian.utils`."""
+
+from pathlib import Path
+
+import pytest
+
+from cambrian.utils import get_cache_path, save_atomically
+
+
+def test_get_cache_path(tmp_path):
+    assert get_cache_path(None, "file.pt") is None
+    assert get_cache_path(tmp_path, "file.pt") == tmp_path / "file.pt"
+
+
+def test_save_atomically(tmp_path):
+    path = tmp_path / "cache" / "file.txt"
+    save_atomically(path, lambda f: Path(f).write_text("data"))
+    assert path.read_text() == "data"
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_save_atomically_cleans_up_on_error(tmp_path):
+    def save_fn(filename: str):
+        Path(filename).write_text("partial")
+        raise RuntimeError("Failed to save.")
+
+    path = tmp_path / "file.txt"
+    with pytest.raises(RuntimeError):
+        save_atomically(path, save_fn)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,174 @@
+"""Tests for the vectorized environments. These create the envs, so they require an
+OpenGL context."""
+
+from functools import partial
+from typing import Callable, List, Tuple
+
+import gymnasium as gym
+import numpy as np
+import pytest
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import DummyVecEnv, VecEnv
+
+from cambrian.envs import env as cambrian_env
+from cambrian.ml.model import MjCambrianModel
+from cambrian.ml.vec_env import (
+    MjCambrianAsyncVecEnv,
+    MjCambrianSharedMemoryVecEnv,
+    MjCambrianThreadedVecEnv,
+)
+from cambrian.utils.wrappers import make_wrapped_env
+
+EYE = "env.agents.agent.eyes.eye"
+NUM_ENVS = 3
+NUM_STEPS = 4
+
+
+def make_env_fns(compose, *overrides: str) -> List[Callable[[], gym.Env]]:
+    """Creates the env functions like the trainer, with a different seed per env."""
+    config = compose(f"{EYE}.resolution=[4,4]", *overrides)
+    wrappers = [w for w in config.trainer.wrappers.values() if w]
+    return [
+        make_wrapped_env(config.env.copy(), wrappers, seed=config.seed + i)
+        for i in range(NUM_ENVS)
+    ]
+
+
+def get_actions(vec_env: VecEnv) -> np.ndarray:
+    actions = np.linspace(-1, 1, NUM_ENVS * vec_env.action_space.shape[0])
+    return actions.reshape(NUM_ENVS, -1)
+
+
+def rollout(vec_env: VecEnv) -> List[dict]:
+    """Steps the vec env with fixed actions and returns the observations."""
+    vec_env.seed(0)
+    observations = [vec_env.reset()]
+    actions = get_actions(vec_env)
+    for _ in range(NUM_STEPS):
+        obs, _, dones, _ = vec_env.step(actions)
+        assert not dones.any()
+        observations.append(obs)
+    vec_env.close()
+    return observations
+
+
+@pytest.fixture(scope="module")
+def expected(compose) -> List[dict]:
+    return rollout(DummyVecEnv(make_env_fns(compose)))
+
+
+def assert_observations_equal(observations: List[dict], expected: List[dict]):
+    assert len(observations) == len(expected)
+    for obs, expected_obs in zip(observations, expected):
+        assert obs.keys() == expected_obs.keys()
+        for key in obs:
+            np.testing.assert_array_equal(obs[key], expected_obs[key])
+
+
+@pytest.mark.parametrize("share_model", [False, True])
+def test_threaded_vec_env_matches_dummy_vec_env(compose, expected, share_model):
+    env_fns = make_env_fns(compose, f"env.share_model={share_model}")
+    vec_env = MjCambrianThreadedVecEnv(env_fns)
+    if share_model:
+        models = {id(env.unwrapped.model) for env in vec_env.envs}
+        assert len(models) == 1
+    assert_observations_equal(rollout(vec_env), expected)
+
+
+def test_shared_model_is_released_by_last_env(compose, monkeypatch):
+    monkeypatch.setattr(cambrian_env, "SHARED_MODELS", {})
+    env_fns = make_env_fns(compose, "env.share_model=True")
+    envs = [env_fn() for env_fn in env_fns[:2]]
+    assert len(cambrian_env.SHARED_MODELS) == 1
+    (shared_model,) = cambrian_env.SHARED_MODELS.values()
+    assert shared_model.num_users == 2
+
+    envs[0].close()
+    assert list(cambrian_env.SHARED_MODELS.values()) == [shared_model]
+    envs[0].close()  # Closing twice doesn't release the model for the other env
+    assert shared_model.num_users == 1
+
+    envs[1].close()
+    assert not cambrian_env.SHARED_MODELS
+
+
+def test_changed_shared_model_asserts_on_close(compose, monkeypatch):
+    monkeypatch.setattr(cambrian_env, "SHARED_MODELS", {})
+    env = make_env_fns(compose, "env.share_model=True")[0]()
+    env.unwrapped.model.geom_rgba[0] += 0.5
+    with pytest.raises(AssertionError, match="was changed"):
+        env.close()
+    assert not cambrian_env.SHARED_MODELS
+
+
+def test_shared_memory_vec_env_matches_dummy_vec_env(compose, expected):
+    vec_env = MjCambrianSharedMemoryVecEnv(make_env_fns(compose))
+    assert_observations_equal(rollout(vec_env), expected)
+
+
+def test_async_vec_env_matches_dummy_vec_env(compose, expected):
+    vec_env = MjCambrianAsyncVecEnv(make_env_fns(compose), batch_size=1)
+    vec_env.seed(0)
+    observations = [vec_env.reset()]
+    actions = get_actions(vec_env)
+    for _ in range(NUM_STEPS):
+        # Collect the observations of the batches by env id
+        vec_env.send(actions, np.arange(NUM_ENVS))
+        obs = {key: np.empty_like(value) for key, value in observations[0].items()}
+        while vec_env.num_pending > 0:
+            batch_obs, _, dones, _, env_ids = vec_env.recv()
+            assert len(env_ids) == 1 and not dones.any()
+            for key, value in batch_obs.items():
+                obs[key][env_ids] = value
+        observations.append(obs)
+    vec_env.close()
+    assert_observations_equal(observations, expected)
+
+
+class StepCallback(BaseCallback):
+    """Records the dones of each call."""
+
+    def __init__(self):
+        super().__init__()
+        self.dones: List[np.ndarray] = []
+
+    def _on_step(self) -> bool:
+        self.dones.append(self.locals["dones"].copy())
+        return True
+
+
+def collect_rollouts(compose, vec_env: VecEnv) -> Tuple[MjCambrianModel, StepCallback]:
+    """Collects a rollout with a deterministic policy, such that the actions only
+    depend on the observations and not on the order the envs are stepped in."""
+    config = compose()
+    model: MjCambrianModel = config.trainer.model(
+        env=vec_env, n_steps=NUM_STEPS, batch_size=NUM_STEPS, device="cpu", seed=0
+    )
+    model.policy.forward = partial(model.policy.forward, deterministic=True)
+
+    _, callback = model._setup_learn(NUM_ENVS * NUM_STEPS, StepCallback())
+    assert model.collect_rollouts(model.env, callback, model.rollout_buffer, NUM_STEPS)
+    vec_env.close()
+    return model, callback
+
+
+def test_async_collect_rollouts_matches_sync(compose):
+    # The shared memory vec env is stepped synchronously, by the sb3 collect_rollouts
+    expected_model, expected_callback = collect_rollouts(
+        compose, MjCambrianSharedMemoryVecEnv(make_env_fns(compose))
+    )
+    async_env = MjCambrianAsyncVecEnv(make_env_fns(compose), batch_size=1)
+    model, callback = collect_rollouts(compose, async_env)
+
+    # The callback is called once per step of all the envs
+    assert model.num_timesteps == expected_model.num_timesteps == NUM_ENVS * NUM_STEPS
+    assert len(callback.dones) == len(expected_callback.dones) == NUM_STEPS
+    assert all(dones.shape == (NUM_ENVS,) for dones in callback.dones)
+
+    buffer, expected_buffer = model.rollout_buffer, expected_model.rollout_buffer
+    for key, value in buffer.observations.items():
+        np.testing.assert_array_equal(value, expected_buffer.observations[key])
+    for name in ["actions", "rewards", "episode_starts", "values", "returns"]:
+        np.testing.assert_allclose(
+            getattr(buffer, name), getattr(expected_buffer, name), rtol=1e-5
+        )
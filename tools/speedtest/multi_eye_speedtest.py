@@ -0,0 +1,59 @@
+"""Benchmarks the construction time of a multi-eye for an increasing number of eyes.
+The config of each eye is the multi-eye's config merged with its coord (see
+`MjCambrianContainerConfig.merge`), so the construction time per eye should be
+roughly constant, i.e. the time per eye should stay flat up to a few hundred eyes.
+
+The first eye of the first agent must be a multi-eye, e.g.
+
+    python tools/speedtest/multi_eye_speedtest.py exp=<exp> \\
+        env/agents/eyes@env.agents.agent.eyes.eye=multi_eye
+"""
+
+import time
+
+import numpy as np
+
+from cambrian.eyes.multi_eye import MjCambrianMultiEye
+from cambrian.utils.config import MjCambrianConfig, run_hydra
+from cambrian.utils.logger import get_logger
+
+num_eyes_sweep = [(1, 1), (2, 5), (5, 10), (10, 10), (10, 20), (20, 20)]
+num_samples = 3  # Number of constructions per configuration
+
+
+def main(config: MjCambrianConfig):
+    agent_config = next(iter(config.env.agents.values()))
+    eye_name, eye_config = next(iter(agent_config.eyes.items()))
+
+    def run(num_eyes: tuple[int, int]) -> float:
+        eye_config1 = eye_config.copy()
+        eye_config1.set_readonly(False)
+        eye_config1.num_eyes = list(num_eyes)
+
+        start_time = time.perf_counter()
+        eye: MjCambrianMultiEye = eye_config1.instance(eye_config1, eye_name)
+        elapsed_time = time.perf_counter() - start_time
+        assert isinstance(eye, MjCambrianMultiEye), "Must use a multi-eye."
+        return elapsed_time
+
+    timing_data = []
+    for num_eyes in num_eyes_sweep:
+        total_eyes = int(np.prod(num_eyes))
+        elapsed_time = np.mean([run(num_eyes) for _ in range(num_samples)])
+        ms_per_eye = elapsed_time / total_eyes * 1000
+        timing_data.append((total_eyes, elapsed_time, ms_per_eye))
+
+        get_logger().info(
+            f"num_eyes={total_eyes}, time={elapsed_time:.3f}s, "
+            f"ms/eye={ms_per_eye:.3f}"
+        )
+
+    timing_data = np.array(
+        timing_data,
+        dtype=[("num_eyes", int), ("time", float), ("ms_per_eye", float)],
+    )
+    np.save(config.expdir / "multi_eye_timing_data.npy", timing_data)
+
+
+if __name__ == "__main__":
+    run_hydra(main)
@@ -0,0 +1,80 @@
+"""Benchmarks the optics stage of the optics eye (depth layering, convolution and
+post-processing) on synthetic images. The renderer isn't used, so this only measures
+the cost added by the optics for each number of depth planes and scene resolution.
+
+The first eye of the first agent must be an optics eye, e.g.
+
+    python tools/speedtest/optics_speedtest.py exp=<exp> \\
+        env/agents/eyes@env.agents.agent.eyes.eye=optics
+"""
+
+import time
+
+import numpy as np
+import torch
+
+from cambrian.eyes.optics import MjCambrianOpticsEye
+from cambrian.utils.config import MjCambrianConfig, run_hydra
+from cambrian.utils.logger import get_logger
+
+num_depth_planes_sweep = [1, 2, 4, 8]
+pupil_resolution_sweep = [51, 101, 201, 501]  # scene resolution is 2 * pupil + 1
+num_steps = 20  # Number of timed steps per configuration
+
+
+def main(config: MjCambrianConfig):
+    agent_config = next(iter(config.env.agents.values()))
+    eye_name, eye_config = next(iter(agent_config.eyes.items()))
+
+    def run(num_depth_planes: int, pupil_resolution: int) -> float:
+        eye_config1 = eye_config.copy()
+        eye_config1.set_readonly(False)
+        eye_config1.num_depth_planes = num_depth_planes
+        eye_config1.pupil_resolution = [pupil_resolution, pupil_resolution]
+        eye: MjCambrianOpticsEye = eye_config1.instance(eye_config1, eye_name)
+        assert isinstance(eye, MjCambrianOpticsEye), "Must use an optics eye."
+
+        # Synthetic image and depth which span the precomputed depths
+        W, H = eye_config1.renderer.width, eye_config1.renderer.height
+        image = torch.rand(3, W, H, device=eye._device)
+        log_near, log_far = eye._depths[0].log(), eye._depths[-1].log()
+        depth = torch.rand(W, H, device=eye._device) * (log_far - log_near) + log_near
+        depth = depth.exp()
+
+        def step():
+            layers, kernels = eye._split_layers(image, depth)
+            obs = eye._convolve(layers, kernels).sum(0) * eye._scaling_intensity
+            return eye._postprocess(obs).cpu().numpy()
+
+        step()  # warmup
+        if eye._device.type == "cuda":
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        for _ in range(num_steps):
+            step()
+        return (time.perf_counter() - start_time) / num_steps * 1000
+
+    timing_data = []
+    for pupil_resolution in pupil_resolution_sweep:
+        for num_depth_planes in num_depth_planes_sweep:
+            ms_per_step = run(num_depth_planes, pupil_resolution)
+            timing_data.append((num_depth_planes, pupil_resolution, ms_per_step))
+
+            get_logger().info(
+                f"pupil_resolution={pupil_resolution}, "
+                f"num_depth_planes={num_depth_planes}, ms/step={ms_per_step:.3f}"
+            )
+
+    timing_data = np.array(
+        timing_data,
+        dtype=[
+            ("num_depth_planes", int),
+            ("pupil_resolution", int),
+            ("ms_per_step", float),
+        ],
+    )
+    np.save(config.expdir / "optics_timing_data.npy", timing_data)
+
+
+if __name__ == "__main__":
+    run_hydra(main)
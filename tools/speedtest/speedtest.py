@@ -11,18 +11,29 @@ from cambrian.utils.logger import get_logger
 num_eyes_sweep = np.arange(1, 100, 10).tolist()
 resolution_sweep = np.arange(1, 100, 10).tolist()
 num_samples = 5  # Number of runs per configuration
+# Add True to also benchmark the shared scene update of the eyes. The results of each
+# setting are saved separately, such that the default sweep stays comparable.
+use_shared_scene_sweep = [False]
 
 
 def main(config: MjCambrianConfig):
+    for use_shared_scene in use_shared_scene_sweep:
+        run_sweep(config, use_shared_scene)
+
+
+def run_sweep(config: MjCambrianConfig, use_shared_scene: bool):
     # Data storage
     timing_data = []
     ram_usage_data = []
+    suffix = "_shared_scene" if use_shared_scene else ""
 
     def run(num_eyes: int, resolution: int, config: MjCambrianConfig):
         with config.set_readonly_temporarily(False), config.set_struct_temporarily(False):
             config.merge_with_dotlist([
                 f"env.agents.agent.eyes.eye.num_eyes[0]={num_eyes}",
                 f"env.agents.agent.eyes.eye.resolution=[{resolution},{resolution}]",
+                "env.agents.agent.eyes.eye.renderer.use_shared_scene="
+                f"{use_shared_scene}",
             ])
         trainer = MjCambrianTrainer(config)
         start_time = time.time()
@@ -71,14 +82,14 @@ def main(config: MjCambrianConfig):
     )
 
     # Save data to files
-    np.save(config.expdir / "timing_data.npy", timing_data)
-    np.save(config.expdir / "ram_usage_data.npy", ram_usage_data)
+    np.save(config.expdir / f"timing_data{suffix}.npy", timing_data)
+    np.save(config.expdir / f"ram_usage_data{suffix}.npy", ram_usage_data)
 
     # Plotting
-    plot_data(config, timing_data, ram_usage_data)
+    plot_data(config, timing_data, ram_usage_data, suffix)
 
 
-def plot_data(config: MjCambrianConfig, timing_data, ram_usage_data):
+def plot_data(config: MjCambrianConfig, timing_data, ram_usage_data, suffix=""):
     # Extract unique values for num_eyes and resolution
     num_eyes_values = np.unique(timing_data["num_eyes"])
     resolution_values = np.unique(timing_data["resolution"])
@@ -99,7 +110,7 @@ def plot_data(config: MjCambrianConfig, timing_data, ram_usage_data):
     plt.title("Resolution vs Time (varying num_eyes)")
     plt.legend()
     plt.grid()
-    plt.savefig(config.expdir / "resolution_vs_time_with_ci.png")
+    plt.savefig(config.expdir / f"resolution_vs_time_with_ci{suffix}.png")
 
     # Plot 2: num_eyes vs time for different resolutions
     plt.figure()
@@ -117,7 +128,7 @@ def plot_data(config: MjCambrianConfig, timing_data, ram_usage_data):
     plt.title("Num Eyes vs Time (varying resolution)")
     plt.legend()
     plt.grid()
-    plt.savefig(config.expdir / "num_eyes_vs_time_with_ci.png")
+    plt.savefig(config.expdir / f"num_eyes_vs_time_with_ci{suffix}.png")
 
     # Plot 3: RAM vs CI
     plt.figure()
@@ -134,9 +145,11 @@ def plot_data(config: MjCambrianConfig, timing_data, ram_usage_data):
     plt.title("RAM Usage vs Confidence Interval")
     plt.legend()
     plt.grid()
-    plt.savefig(config.expdir / "ram_vs_ci.png")
+    plt.savefig(config.expdir / f"ram_vs_ci{suffix}.png")
 
-    print("Plots saved: resolution_vs_time_with_ci.png, ram_vs_ci.png")
+    print(
+        f"Plots saved: resolution_vs_time_with_ci{suffix}.png, ram_vs_ci{suffix}.png"
+    )
 
 
 if __name__ == "__main__":